@@ -0,0 +1,195 @@
+"""
+Chunking throughput (MB/s per language) and golden-output check.
+
+The current TextProcessor is compared against a frozen copy of the original
+multi-pass chunker: both `chunk_text` and streaming ingest (`iter_chunks`
+over several read sizes) must return exactly the reference chunks for every
+document in the corpus. Any mismatch is reported and the script exits with
+status 1.
+
+Usage:
+    python -m benchmarks.chunking --size-mb 8
+    python -m benchmarks.chunking --corpus docs/ --output chunking.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import Dict, List
+
+from utils.text_processor import TextProcessor
+
+
+def legacy_chunk_text(text: str, language: str = 'en', chunk_size: int = 300) -> List[str]:
+    """
+    The original chunker, kept verbatim (modulo helpers) as the reference.
+    """
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s\.\!\?\,\;\:\-\(\)\[\]\{\}\"\'。！？、；：（）［］｛｝「」『』]', '', text)
+    text = text.strip()
+
+    paragraphs = []
+    for para in re.split(r'\n\s*\n', text):
+        sections = re.split(r'(?=\d+\.\s)', para)
+        paragraphs.extend([s.strip() for s in sections if s.strip()])
+
+    chunks = []
+    for paragraph in paragraphs:
+        if len(paragraph) <= chunk_size:
+            if paragraph.strip():
+                chunks.append(paragraph.strip())
+        else:
+            if language == 'ja':
+                sentences = re.split(r'[。！？]', paragraph)
+            else:
+                sentences = re.split(r'[.!?]+\s+', paragraph)
+            sentences = [s.strip() for s in sentences if s.strip()]
+            current_chunk = ""
+            for sentence in sentences:
+                if len(current_chunk) + len(sentence) > chunk_size and current_chunk:
+                    chunks.append(current_chunk.strip())
+                    current_chunk = sentence
+                else:
+                    current_chunk += " " + sentence if current_chunk else sentence
+            if current_chunk.strip():
+                chunks.append(current_chunk.strip())
+
+    unique_chunks = []
+    seen = set()
+    for chunk in chunks:
+        chunk_clean = chunk.strip()
+        if len(chunk_clean) > 50 and chunk_clean not in seen:
+            unique_chunks.append(chunk_clean)
+            seen.add(chunk_clean)
+    return unique_chunks
+
+
+EN_SENTENCES = [
+    "Check blood glucose levels as recommended by your healthcare provider.",
+    "Target HbA1c levels below 7% for most adults!",
+    "Annual eye examinations screen for diabetic retinopathy.",
+    "Kidney function tests should be done every 6-12 months.",
+    "Is the patient taking metformin (500 mg) twice daily?",
+    "Know the signs of diabetic ketoacidosis; have a sick day plan.",
+]
+JA_SENTENCES = [
+    "医療提供者の推奨に従って血糖値をチェックする。",
+    "成人の多くでHbA1c値は7未満を目標とする！",
+    "糖尿病性網膜症の年次眼科検査を受ける。",
+    "6-12ヶ月ごとに腎機能検査を行う。",
+    "患者はメトホルミンを一日二回服用していますか？",
+    "「シックデイ」の対応計画を準備しておく、",
+]
+
+
+def synthetic_document(language: str, size: int, seed: int = 0) -> str:
+    """
+    A document of about `size` characters with numbered sections, paragraph
+    breaks, repeated boilerplate and the odd symbol to be cleaned.
+    """
+    rng = random.Random(seed)
+    sentences = JA_SENTENCES if language == 'ja' else EN_SENTENCES
+    parts = []
+    length = 0
+    section = 1
+    while length < size:
+        if rng.random() < 0.15:
+            part = f"\n\n{section}. {'セクション' if language == 'ja' else 'Section'} {section} ★\n"
+            section += 1
+        else:
+            part = rng.choice(sentences) + rng.choice([' ', ' ', '\n', '  \t'])
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+
+def load_corpus(args) -> Dict[str, List[str]]:
+    if args.corpus:
+        from utils.language import detect_language
+        corpus = {'en': [], 'ja': []}
+        for root, _, files in os.walk(args.corpus):
+            for name in sorted(files):
+                if name.endswith('.txt'):
+                    with open(os.path.join(root, name), encoding='utf-8') as f:
+                        text = f.read()
+                    corpus[detect_language(text[:20000])].append(text)
+        return corpus
+    size = int(args.size_mb * 1024 * 1024 / 2)
+    return {
+        language: [synthetic_document(language, size, seed)] + [
+            synthetic_document(language, 5000, seed + i) for i in range(1, 50)
+        ]
+        for seed, language in enumerate(['en', 'ja'])
+    }
+
+
+def golden_check(processor: TextProcessor, corpus: Dict[str, List[str]]) -> int:
+    mismatches = 0
+    for language, documents in corpus.items():
+        for number, text in enumerate(documents):
+            expected = legacy_chunk_text(text, language, processor.chunk_size)
+            candidates = {'chunk_text': processor.chunk_text(text, language)}
+            for piece in (1, 7, 4096):
+                if piece == 1 and len(text) > 100000:
+                    continue
+                pieces = (text[i:i + piece] for i in range(0, len(text), piece))
+                candidates[f'iter_chunks/{piece}'] = list(processor.iter_chunks(pieces, language))
+            for name, chunks in candidates.items():
+                if chunks != expected:
+                    mismatches += 1
+                    print(f"MISMATCH {language} document {number} via {name}: "
+                          f"{len(chunks)} chunks vs {len(expected)} expected")
+    return mismatches
+
+
+def throughput(processor: TextProcessor, corpus: Dict[str, List[str]], repeat: int) -> List[Dict]:
+    report = []
+    for language, documents in corpus.items():
+        megabytes = sum(len(text.encode('utf-8')) for text in documents) / 1e6
+        runs = {
+            'legacy': lambda text: legacy_chunk_text(text, language, processor.chunk_size),
+            'chunk_text': lambda text: processor.chunk_text(text, language),
+            'iter_chunks': lambda text: list(processor.iter_chunks(
+                (text[i:i + 65536] for i in range(0, len(text), 65536)), language)),
+        }
+        for name, run in runs.items():
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for text in documents:
+                    run(text)
+                best = min(best, time.perf_counter() - start)
+            report.append({'language': language, 'chunker': name, 'mb': megabytes, 'mb_per_s': megabytes / best})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help="Directory of .txt documents (default: synthetic corpus)")
+    parser.add_argument('--size-mb', type=float, default=4.0, help="Synthetic corpus size")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    processor = TextProcessor()
+    corpus = load_corpus(args)
+
+    mismatches = golden_check(processor, corpus)
+    print(f"golden check: {'OK' if not mismatches else f'{mismatches} mismatches'}")
+
+    report = throughput(processor, corpus, args.repeat)
+    print(f"{'language':<9} {'chunker':<12} {'MB':>7} {'MB/s':>8}")
+    for row in report:
+        print(f"{row['language']:<9} {row['chunker']:<12} {row['mb']:>7.2f} {row['mb_per_s']:>8.2f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'mismatches': mismatches, 'results': report}, f, indent=2)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
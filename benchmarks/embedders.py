@@ -0,0 +1,171 @@
+"""
+Embedding backends compared: accuracy against a reference backend, encode
+throughput and single-query latency.
+
+Every backend encodes the same document chunks and queries. Accuracy is the
+cosine between each text's embedding and the reference embedding of that
+text (mean and worst case), and how many of the reference top-k chunks for
+each query the backend retrieves too. A backend in --check whose mean
+cosine falls below --min-cosine fails the run (exit status 1). Backends
+whose dependencies are missing are skipped. The hash backend is a test
+stand-in and is expected to disagree with the model.
+
+Usage:
+    python -m benchmarks.embedders
+    python -m benchmarks.embedders --backends torch,onnx_int8 --corpus docs/ --output embedders.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.chunking import EN_SENTENCES, JA_SENTENCES, synthetic_document
+from benchmarks.language_detection import QUERIES
+from utils.embedders import create_embedder
+from utils.language import detect_language
+from utils.text_processor import TextProcessor
+
+
+def load_corpus(args) -> Dict[str, List[str]]:
+    processor = TextProcessor()
+    documents = []
+    if args.corpus:
+        for root, _, files in os.walk(args.corpus):
+            for name in sorted(files):
+                if name.endswith('.txt'):
+                    with open(os.path.join(root, name), encoding='utf-8') as f:
+                        documents.append(f.read())
+    else:
+        documents = [synthetic_document(language, 3000, seed) for seed in range(10) for language in ('en', 'ja')]
+
+    chunks = []
+    for text in documents:
+        chunks.extend(processor.chunk_text(text, detect_language(text)))
+    queries = [query for query, _ in QUERIES] + EN_SENTENCES + JA_SENTENCES
+    return {'chunks': chunks[:args.chunks], 'queries': queries}
+
+
+def measure(embedder, corpus: Dict[str, List[str]], batch_size: int, repeat: int) -> Dict:
+    """
+    Embeddings of the corpus, best batch throughput over `repeat` runs and
+    single-query latencies (as served by /retrieve).
+    """
+    chunks, queries = corpus['chunks'], corpus['queries']
+    embedder.encode(chunks[:batch_size], batch_size=batch_size)  # Warm-up
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunk_vectors = embedder.encode(chunks, batch_size=batch_size)
+        best = min(best, time.perf_counter() - start)
+
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            embedder.encode([query], batch_size=1)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'chunks_per_s': len(chunks) / best,
+        'query_p50_ms': float(np.percentile(latencies, 50)),
+        'query_p95_ms': float(np.percentile(latencies, 95)),
+        'chunk_vectors': chunk_vectors,
+        'query_vectors': embedder.encode(queries, batch_size=batch_size)
+    }
+
+
+def agreement(result: Dict, reference: Dict, k: int) -> Dict:
+    """
+    Cosine between paired embeddings (when the dimensions match) and the
+    share of the reference top-k chunks per query that are retrieved too.
+    """
+    scores = {}
+    if result['chunk_vectors'].shape[1] == reference['chunk_vectors'].shape[1]:
+        vectors = np.vstack([result['chunk_vectors'], result['query_vectors']])
+        expected = np.vstack([reference['chunk_vectors'], reference['query_vectors']])
+        cosines = (vectors * expected).sum(axis=1) / np.maximum(
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(expected, axis=1), 1e-12)
+        scores['cosine_mean'] = float(cosines.mean())
+        scores['cosine_min'] = float(cosines.min())
+
+    def top_k(run):
+        return np.argsort(-(run['query_vectors'] @ run['chunk_vectors'].T), axis=1)[:, :k]
+
+    hits = sum(len(set(a) & set(b)) for a, b in zip(top_k(result), top_k(reference)))
+    scores['overlap_at_k'] = hits / float(len(result['query_vectors']) * k)
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='torch,onnx,onnx_int8,hash', help="Comma-separated backends")
+    parser.add_argument('--reference', default='torch', help="Backend the others are compared against")
+    parser.add_argument('--model', help="Model name (default: EMBEDDING_MODEL_NAME)")
+    parser.add_argument('--corpus', help="Directory of .txt documents (default: synthetic corpus)")
+    parser.add_argument('--chunks', type=int, default=512, help="Chunks to encode at most")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--check', default='onnx,onnx_int8', help="Backends held to --min-cosine")
+    parser.add_argument('--min-cosine', type=float, default=0.98)
+    parser.add_argument('--output', help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    backends = args.backends.split(',')
+    if args.reference not in backends:
+        backends.insert(0, args.reference)
+
+    results = {}
+    for name in backends:
+        start = time.perf_counter()
+        try:
+            embedder = create_embedder(name, args.model)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        load_seconds = time.perf_counter() - start
+        results[name] = {'load_s': load_seconds, 'dimension': embedder.dimension,
+                         **measure(embedder, corpus, args.batch_size, args.repeat)}
+
+    reference = results.get(args.reference)
+    if reference is None:
+        print(f"Reference backend {args.reference} is unavailable; no accuracy figures")
+
+    failures = 0
+    report = []
+    for name, result in results.items():
+        row = {'backend': name, 'dimension': result['dimension'], 'load_s': result['load_s'],
+               'chunks_per_s': result['chunks_per_s'], 'query_p50_ms': result['query_p50_ms'],
+               'query_p95_ms': result['query_p95_ms']}
+        if reference is not None:
+            row.update(agreement(result, reference, args.k))
+        if reference is not None and name in args.check.split(',') and row.get('cosine_mean', 0.0) < args.min_cosine:
+            failures += 1
+            print(f"FAIL {name}: mean cosine {row.get('cosine_mean')} below {args.min_cosine}")
+        report.append(row)
+
+    def figure(value, spec):
+        return format(value, spec) if value is not None else format('-', spec.split('.')[0])
+
+    print(f"{'backend':<10} {'dim':>5} {'load s':>7} {'chunks/s':>9} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'cos mean':>9} {'cos min':>8} {'top-k':>6}")
+    for row in report:
+        print(f"{row['backend']:<10} {row['dimension']:>5} {row['load_s']:>7.2f} {row['chunks_per_s']:>9.1f} "
+              f"{row['query_p50_ms']:>7.2f} {row['query_p95_ms']:>7.2f} {figure(row.get('cosine_mean'), '>9.4f')} "
+              f"{figure(row.get('cosine_min'), '>8.4f')} {figure(row.get('overlap_at_k'), '>6.3f')}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'chunks': len(corpus['chunks']), 'queries': len(corpus['queries']),
+                       'failures': failures, 'results': report}, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
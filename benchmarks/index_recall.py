@@ -0,0 +1,134 @@
+"""
+Recall@k vs. latency report for the supported FAISS index types.
+
+Every configuration is compared against an exact flat search over the same
+vectors. Vectors come from an existing index file or from a synthetic,
+clustered corpus.
+
+Usage:
+    python -m benchmarks.index_recall --vectors 100000 --queries 500
+    python -m benchmarks.index_recall --index-file data/faiss_index.bin --output recall.json
+"""
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from utils.index_factory import build_index, extract_vectors, set_search_params, train_and_fill
+
+# (index type, knob name, knob values)
+SWEEPS = [
+    ('flat', None, [None]),
+    ('ivf_flat', 'nprobe', [1, 4, 16, 64]),
+    ('hnsw', 'ef_search', [16, 32, 64, 128]),
+    ('ivf_pq', 'nprobe', [4, 16, 64]),
+    ('sq8', None, [None]),
+    ('sq_fp16', None, [None]),
+    ('pq', None, [None]),
+]
+
+
+def synthetic_vectors(count: int, dimension: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Normalized vectors drawn around random centres, roughly like sentence embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension)).astype('float32')
+    vectors = centres[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dimension)).astype('float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def recall_at_k(exact: np.ndarray, approx: np.ndarray, k: int) -> float:
+    hits = sum(len(set(e[:k]) & set(a[:k]) - {-1}) for e, a in zip(exact, approx))
+    return hits / float(len(exact) * k)
+
+
+def time_queries(index: faiss.Index, queries: np.ndarray, k: int) -> Dict[str, float]:
+    """
+    Single-query latencies (as served by /retrieve) and batched throughput.
+    """
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'batch_qps': len(queries) / batch_seconds,
+        'ids': ids
+    }
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[Dict]:
+    dimension = vectors.shape[1]
+    baseline = faiss.IndexFlatIP(dimension)
+    baseline.add(vectors)
+    _, exact = baseline.search(queries, k)
+
+    report = []
+    for index_type, knob, values in SWEEPS:
+        start = time.perf_counter()
+        index = train_and_fill(build_index(index_type, dimension, num_vectors=len(vectors)), vectors)
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        for value in values:
+            if knob:
+                set_search_params(index, **{knob: value})
+            timing = time_queries(index, queries, k)
+            report.append({
+                'index_type': index_type,
+                'param': f"{knob}={value}" if knob else "",
+                'recall_at_k': recall_at_k(exact, timing.pop('ids'), k),
+                'build_s': build_seconds,
+                'size_mb': size_mb,
+                **timing
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-file', help="Use the vectors stored in this FAISS index")
+    parser.add_argument('--vectors', type=int, default=50000, help="Synthetic corpus size")
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--output', help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    if args.index_file:
+        vectors = extract_vectors(faiss.read_index(args.index_file))
+    else:
+        vectors = synthetic_vectors(args.vectors + args.queries, args.dimension)
+
+    # Held-out queries, lightly perturbed so they are not exact matches
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype('float32')
+    faiss.normalize_L2(queries)
+
+    report = run(np.ascontiguousarray(vectors), np.ascontiguousarray(queries), args.k)
+
+    print(f"{'index':<10} {'param':<14} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8} {'batch qps':>10} {'size MB':>8} {'build s':>8}")
+    for row in report:
+        print(f"{row['index_type']:<10} {row['param']:<14} {row['recall_at_k']:>9.3f} {row['p50_ms']:>8.3f} "
+              f"{row['p99_ms']:>8.3f} {row['batch_qps']:>10.0f} {row['size_mb']:>8.1f} {row['build_s']:>8.2f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'vectors': len(vectors), 'queries': len(queries), 'k': args.k, 'results': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Language detection throughput and agreement: the script-based detector
+(cold and memoized) against the original langdetect path.
+
+Queries and documents are labelled 'en' or 'ja'. For each detector the
+report gives items/s, MB/s, accuracy against the labels and whether two
+runs over the same inputs agree. Documents come from a synthetic corpus or
+from a directory of .txt files whose labels are taken from the
+script-based detector (accuracy is then agreement with it).
+
+Usage:
+    python -m benchmarks.language_detection
+    python -m benchmarks.language_detection --corpus docs/ --output language.json
+"""
+import argparse
+import json
+import os
+import random
+import time
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.chunking import EN_SENTENCES, JA_SENTENCES, synthetic_document
+from utils import language as language_module
+from utils.language import detect_language
+
+QUERIES = [
+    ("What is the HbA1c target for adults?", 'en'),
+    ("kidney function tests", 'en'),
+    ("signs of diabetic ketoacidosis", 'en'),
+    ("metformin dose", 'en'),
+    ("Is café-au-lait spotting a symptom?", 'en'),
+    ("HbA1cの目標値は？", 'ja'),
+    ("腎機能検査の頻度", 'ja'),
+    ("糖尿病性網膜症", 'ja'),
+    ("メトホルミンの服用量", 'ja'),
+    ("シックデイの対応", 'ja'),
+]
+
+
+def legacy_detect_language(text: str) -> str:
+    """
+    The original detector: langdetect over the whole text, unseeded.
+    """
+    from langdetect import detect
+    try:
+        language = detect(text)
+        if language in ['ja', 'jp']:
+            return 'ja'
+        return 'en'
+    except Exception:
+        return 'en'
+
+
+def load_corpus(args) -> Dict[str, List[Tuple[str, str]]]:
+    rng = random.Random(0)
+    queries = []
+    for i in range(args.queries):
+        query, language = QUERIES[i % len(QUERIES)]
+        # Distinct texts, so the memo is not hit across queries
+        sentences = EN_SENTENCES if language == 'en' else JA_SENTENCES
+        queries.append((f"{query} {rng.choice(sentences)[:rng.randint(0, 20)]}", language))
+
+    if args.corpus:
+        documents = []
+        for root, _, files in os.walk(args.corpus):
+            for name in sorted(files):
+                if name.endswith('.txt'):
+                    with open(os.path.join(root, name), encoding='utf-8') as f:
+                        text = f.read()
+                    documents.append((text, detect_language(text)))
+    else:
+        documents = [
+            (synthetic_document(language, args.document_chars, seed), language)
+            for seed in range(args.documents)
+            for language in ('en', 'ja')
+        ]
+    return {'queries': queries, 'documents': documents}
+
+
+def measure(detect: Callable[[str], str], items: List[Tuple[str, str]], repeat: int, reset: Callable[[], None]):
+    """
+    Best time over `repeat` runs, the labels of the first run and whether
+    every run returned the same labels.
+    """
+    best = float('inf')
+    runs = []
+    for _ in range(repeat):
+        reset()
+        start = time.perf_counter()
+        runs.append([detect(text) for text, _ in items])
+        best = min(best, time.perf_counter() - start)
+    return best, runs[0], all(run == runs[0] for run in runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help="Directory of .txt documents (default: synthetic corpus)")
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--documents', type=int, default=50, help="Synthetic documents per language")
+    parser.add_argument('--document-chars', type=int, default=20000, help="Synthetic document size")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+
+    def clear_memo():
+        language_module._cache.clear()
+
+    def unseed():
+        from langdetect import DetectorFactory
+        DetectorFactory.seed = None
+
+    detectors = [
+        ('langdetect', legacy_detect_language, unseed),
+        ('script', detect_language, clear_memo),
+        ('script_memoized', detect_language, lambda: None),
+    ]
+    report = []
+    for name, items in corpus.items():
+        megabytes = sum(len(text.encode('utf-8')) for text, _ in items) / 1e6
+        for detector, detect, reset in detectors:
+            seconds, labels, deterministic = measure(detect, items, args.repeat, reset)
+            correct = sum(label == expected for label, (_, expected) in zip(labels, items))
+            report.append({
+                'corpus': name,
+                'detector': detector,
+                'items': len(items),
+                'items_per_s': len(items) / seconds,
+                'mb_per_s': megabytes / seconds,
+                'accuracy': correct / max(len(items), 1),
+                'deterministic': deterministic
+            })
+
+    print(f"{'corpus':<10} {'detector':<16} {'items':>6} {'items/s':>10} {'MB/s':>9} {'accuracy':>9} {'stable':>7}")
+    for row in report:
+        print(f"{row['corpus']:<10} {row['detector']:<16} {row['items']:>6} {row['items_per_s']:>10.0f} "
+              f"{row['mb_per_s']:>9.2f} {row['accuracy']:>9.3f} {str(row['deterministic']):>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
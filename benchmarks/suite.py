@@ -0,0 +1,448 @@
+"""
+End-to-end performance suite on synthetic English/Japanese guideline corpora.
+
+For every corpus size (in chunks) the suite measures:
+- chunking: TextProcessor.chunk_text over the generated documents
+- embedding: batch encode of all chunks and single-query latency
+- index: FAISSManager add, snapshot (save), load and search, in a scratch
+  data directory
+Once per run it also drives the FastAPI app through a test client:
+documents are posted to /ingest, then again as background jobs
+(/ingest?background=true, timed until every job has finished), and
+/retrieve and /generate are called from --concurrency threads at once.
+
+Corpora are generated from a seed, so runs on the same settings see the same
+text. The default embedder is the offline `hash` backend; pass --embedder
+torch (or onnx, onnx_int8) to include the model. Translation uses the stub
+backend throughout.
+
+Results are written as JSON with --output. With --baseline, each metric is
+compared with the same metric of an earlier run: throughputs (*_per_s) must
+not drop, and times (*_s, *_ms) must not grow, by more than --tolerance
+(time changes under --min-delta-ms are ignored). Any regression is
+reported and the script exits with status 1.
+
+Usage:
+    python -m benchmarks.suite --sizes 10000,100000 --output baseline.json
+    python -m benchmarks.suite --sizes 10000,100000 --baseline baseline.json --tolerance 0.2
+    python -m benchmarks.suite --sizes 1000000 --skip-api --embed-batch 4096
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import faiss
+import numpy as np
+
+from services.document_service import build_chunk_metadata
+from utils.embedders import create_embedder
+from utils.embedding_engine import EmbeddingEngine
+from utils.faiss_manager import FAISSManager
+from utils.index_factory import index_type_of, training_threshold
+from utils.text_processor import TextProcessor
+
+VOCABULARY = {
+    'en': {
+        'condition': ["type 2 diabetes", "hypertension", "chronic kidney disease", "heart failure", "asthma",
+                      "COPD", "atrial fibrillation", "hypothyroidism", "osteoporosis", "gestational diabetes",
+                      "hyperlipidemia", "obesity"],
+        'test': ["HbA1c", "blood pressure", "eGFR", "the lipid panel", "urine albumin", "a retinal examination",
+                 "a foot examination", "thyroid function", "a bone density scan", "spirometry", "an ECG",
+                 "liver enzymes"],
+        'drug': ["metformin", "lisinopril", "atorvastatin", "insulin glargine", "amlodipine", "levothyroxine",
+                 "empagliflozin", "salbutamol", "warfarin", "alendronate"],
+    },
+    'ja': {
+        'condition': ["2型糖尿病", "高血圧", "慢性腎臓病", "心不全", "喘息", "COPD", "心房細動", "甲状腺機能低下症",
+                      "骨粗鬆症", "妊娠糖尿病", "脂質異常症", "肥満"],
+        'test': ["HbA1c", "血圧", "eGFR", "脂質検査", "尿中アルブミン", "眼底検査", "足の診察", "甲状腺機能検査",
+                 "骨密度検査", "肺機能検査", "心電図", "肝機能検査"],
+        'drug': ["メトホルミン", "リシノプリル", "アトルバスタチン", "インスリングラルギン", "アムロジピン",
+                 "レボチロキシン", "エンパグリフロジン", "サルブタモール", "ワルファリン", "アレンドロン酸"],
+    },
+}
+TEMPLATES = {
+    'en': [
+        "Check {test} every {n} months in adults with {condition}.",
+        "Start {drug} at {dose} mg daily unless contraindicated.",
+        "Refer patients with {condition} to a specialist if {test} worsens over {n} visits.",
+        "Review the dose of {drug} when {test} falls below target.",
+        "Targets for {test} depend on age, comorbidities and the risk of hypoglycemia.",
+        "Patients taking {drug} need {test} within {n} weeks of any dose change.",
+    ],
+    'ja': [
+        "{condition}の成人では{n}ヶ月ごとに{test}を確認する。",
+        "禁忌でなければ{drug}を1日{dose}mgで開始する。",
+        "{test}が{n}回の受診で悪化した{condition}の患者は専門医に紹介する。",
+        "{test}が目標値を下回った場合は{drug}の用量を見直す。",
+        "{test}の目標値は年齢、合併症、低血糖のリスクによって異なる。",
+        "{drug}を服用中の患者は用量変更後{n}週間以内に{test}を行う。",
+    ],
+}
+TITLES = {'en': "{Condition} guideline {document}-{section}", 'ja': "{condition}ガイドライン{document}-{section}"}
+QUERY_TEMPLATES = {
+    'en': ["{test} for {condition}", "{drug} dose", "when to refer {condition}"],
+    'ja': ["{condition}の{test}", "{drug}の用量", "{condition}の紹介基準"],
+}
+SECTIONS_PER_DOCUMENT = 20
+
+
+def _fill(rng: random.Random, language: str, template: str, **fields) -> str:
+    words = VOCABULARY[language]
+    condition = rng.choice(words['condition'])
+    return template.format(
+        condition=condition, Condition=condition[:1].upper() + condition[1:],
+        test=rng.choice(words['test']), drug=rng.choice(words['drug']),
+        n=rng.randint(2, 12), dose=rng.choice([5, 10, 20, 40, 250, 500, 1000]), **fields
+    )
+
+
+def synthetic_corpus(chunks: int, seed: int = 0) -> List[Tuple[str, str, str]]:
+    """
+    (filename, language, text) of about `chunks` chunks, alternating English
+    and Japanese documents. Every numbered section fits in one chunk.
+    """
+    rng = random.Random(seed)
+    limit = TextProcessor().chunk_size
+    documents = []
+    for number in range(-(-chunks // SECTIONS_PER_DOCUMENT)):
+        language = ('en', 'ja')[number % 2]
+        sections = []
+        for section in range(1, SECTIONS_PER_DOCUMENT + 1):
+            text = f"{section}. " + _fill(rng, language, TITLES[language], document=number, section=section)
+            text += ": " if language == 'en' else "："
+            target = rng.randint(limit // 2, limit - 20) if language == 'en' else rng.randint(limit // 4, limit // 2)
+            while True:
+                sentence = _fill(rng, language, rng.choice(TEMPLATES[language]))
+                # The chunker drops chunks of 50 characters or less
+                if len(text) > 60 and len(text) + len(sentence) + 1 > target:
+                    break
+                text += sentence + (" " if language == 'en' else "")
+            sections.append(text.strip())
+        documents.append((f"guideline_{seed}_{number:07d}_{language}.txt", language, "\n\n".join(sections)))
+    return documents
+
+
+def synthetic_queries(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [_fill(rng, language, rng.choice(QUERY_TEMPLATES[language]))
+            for language in (('en', 'ja')[i % 2] for i in range(count))]
+
+
+def percentiles(latencies: List[float], prefix: str) -> Dict[str, float]:
+    return {f"{prefix}_{name}_ms": float(np.percentile(latencies, q)) if latencies else 0.0
+            for name, q in (('p50', 50), ('p95', 95), ('p99', 99))}
+
+
+def bench_chunking(documents: List[Tuple[str, str, str]], repeat: int) -> Tuple[Dict, List[List[str]]]:
+    processor = TextProcessor()
+    megabytes = sum(len(text.encode('utf-8')) for _, _, text in documents) / 1e6
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = [processor.chunk_text(text, language) for _, language, text in documents]
+        best = min(best, time.perf_counter() - start)
+    total = sum(len(document_chunks) for document_chunks in chunks)
+    return {'documents': len(documents), 'chunks': total, 'mb': megabytes,
+            'mb_per_s': megabytes / best, 'chunks_per_s': total / best}, chunks
+
+
+def bench_embedding(engine: EmbeddingEngine, chunks: List[str], queries: List[str]) -> Tuple[Dict, np.ndarray, np.ndarray]:
+    engine.encode_batch(chunks[:engine.batch_size])  # Warm-up
+    start = time.perf_counter()
+    embeddings = engine.encode_batch(chunks)
+    seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        engine.encode_batch([query])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return ({'chunks_per_s': len(chunks) / seconds, **percentiles(latencies, 'query')},
+            embeddings, engine.encode_batch(queries))
+
+
+def bench_index(args, dimension: int, documents, chunks: List[List[str]], embeddings: np.ndarray,
+                query_vectors: np.ndarray) -> Dict:
+    """
+    Add, snapshot, load and search in a scratch data directory (the
+    current working directory).
+    """
+    manager = FAISSManager(dimension, index_type=args.index_type)
+    # As for bulk ingest: maintenance once, timed as the save
+    manager.auto_maintenance = False
+
+    row = 0
+    windows = []
+    for (filename, language, _), document_chunks in zip(documents, chunks):
+        metadata = build_chunk_metadata(document_chunks, str(uuid.uuid4()), filename, language)
+        for start in range(0, len(metadata), args.add_batch):
+            window = metadata[start:start + args.add_batch]
+            windows.append((embeddings[row:row + len(window)], window))
+            row += len(window)
+    start = time.perf_counter()
+    for vectors, metadata in windows:
+        manager.add_embeddings(vectors.copy(), metadata)
+    add_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if index_type_of(manager.index) != manager.index_type and manager.ntotal >= training_threshold(manager.index_type):
+        manager.migrate()
+    manager.compact()
+    save_seconds = time.perf_counter() - start
+    snapshot_mb = sum(os.path.getsize(path) for path in (manager.index_file, manager.metadata_file)
+                      if os.path.exists(path)) / 1e6
+
+    start = time.perf_counter()
+    manager = FAISSManager(dimension, index_type=args.index_type)
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in query_vectors:
+        start = time.perf_counter()
+        manager.search(query.copy(), top_k=args.k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    manager.search_batch(query_vectors.copy(), [args.k] * len(query_vectors))
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        'rows': manager.ntotal,
+        'index_type': index_type_of(manager.index),
+        'add_rows_per_s': row / add_seconds,
+        'save_s': save_seconds,
+        'snapshot_mb': snapshot_mb,
+        'load_s': load_seconds,
+        **percentiles(latencies, 'search'),
+        'search_batch_queries_per_s': len(query_vectors) / batch_seconds,
+    }
+
+
+def bench_api(args) -> List[Dict]:
+    """
+    /ingest, then concurrent /retrieve and /generate, against the app in
+    this process with its data directory in the current working directory.
+    """
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ["EMBEDDING_BACKEND"] = args.embedder
+    os.environ["TRANSLATION_BACKEND"] = "stub"
+    os.environ["WARM_UP_ON_STARTUP"] = "true"
+    from fastapi.testclient import TestClient
+    import main
+
+    headers = {'x-api-key': os.environ["API_KEY"]}
+    documents = synthetic_corpus(args.api_documents * SECTIONS_PER_DOCUMENT, seed=args.seed + 1)
+    queries = synthetic_queries(args.api_requests, seed=args.seed + 1)
+
+    def timed(call):
+        start = time.perf_counter()
+        response = call()
+        return (time.perf_counter() - start) * 1000, response
+
+    def run(name, calls):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(timed, calls))
+        seconds = time.perf_counter() - start
+        errors = sum(response.status_code != 200 or not response.json().get('status') for _, response in outcomes)
+        return {'stage': f"api{name}", 'requests': len(outcomes), 'errors': errors,
+                'requests_per_s': len(outcomes) / seconds,
+                **percentiles([latency for latency, _ in outcomes], 'request')}, outcomes
+
+    report = []
+    with TestClient(main.app) as client:
+        # Readiness first, so the warm-up is not part of the timings
+        deadline = time.monotonic() + 300
+        while client.get('/ready').status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError("The app did not become ready; see the warm-up error above")
+            time.sleep(0.1)
+
+        row, _ = run('/ingest', [
+            lambda name=name, text=text: client.post(
+                '/ingest', files={'file': (name, text.encode('utf-8'), 'text/plain')}, headers=headers)
+            for name, _, text in documents
+        ])
+        report.append(row)
+
+        # The same burst as background jobs: upload latency, and documents/s
+        # until the last job is done
+        start = time.time()
+        row, outcomes = run('/ingest?background', [
+            lambda name=name, text=text: client.post(
+                '/ingest?background=true', files={'file': (f"background/{name}", text.encode('utf-8'), 'text/plain')},
+                headers=headers)
+            for name, _, text in documents
+        ])
+        job_ids = [response.json()['data']['job_id'] for _, response in outcomes if response.status_code == 202]
+        states = []
+        for job_id in job_ids:
+            while True:
+                state = client.get(f'/ingest/jobs/{job_id}', headers=headers).json()['data']
+                if state['status'] in ('succeeded', 'failed'):
+                    states.append(state)
+                    break
+                time.sleep(0.01)
+        jobs = main.ingest_job_service.stats()
+        finished = max((state['finished_at'] for state in states), default=start)
+        row.update(errors=len(documents) - len(job_ids) + sum(state['status'] == 'failed' for state in states),
+                   documents_per_s=len(documents) / max(finished - start, 1e-9),
+                   commits=jobs['commits'], windows=jobs['windows'])
+        report.append(row)
+
+        row, outcomes = run('/retrieve', [
+            lambda query=query: client.post('/retrieve', json={'query': query, 'top_k': args.k}, headers=headers)
+            for query in queries
+        ])
+        report.append(row)
+
+        contexts = [response.json()['data']['documents'] if response.status_code == 200 else []
+                    for _, response in outcomes]
+        row, _ = run('/generate', [
+            lambda query=query, context=context: client.post(
+                '/generate', json={'query': query, 'documents': context}, headers=headers)
+            for query, context in zip(queries, contexts)
+        ])
+        report.append(row)
+    return report
+
+
+def compare(report: List[Dict], baseline: List[Dict], tolerance: float, min_delta_ms: float) -> List[str]:
+    """
+    Metrics that got worse than their baseline value by more than
+    `tolerance`. Times that changed by less than `min_delta_ms` are noise.
+    """
+    previous = {(row['stage'], row.get('size')): row for row in baseline}
+    regressions = []
+    print(f"\n{'stage':<14} {'size':>8} {'metric':<28} {'baseline':>12} {'current':>12} {'change':>8}")
+    for row in report:
+        old = previous.get((row['stage'], row.get('size')))
+        if old is None:
+            continue
+        for metric, value in row.items():
+            if metric.endswith('_per_s'):
+                higher_is_better, unit_ms = True, None
+            elif metric.endswith('_ms'):
+                higher_is_better, unit_ms = False, 1.0
+            elif metric.endswith('_s'):
+                higher_is_better, unit_ms = False, 1000.0
+            else:
+                continue
+            if not isinstance(old.get(metric), (int, float)) or not old[metric]:
+                continue
+            change = value / old[metric] - 1
+            worse = -change if higher_is_better else change
+            noise = unit_ms is not None and abs(value - old[metric]) * unit_ms < min_delta_ms
+            flag = " REGRESSION" if worse > tolerance and not noise else ""
+            print(f"{row['stage']:<14} {str(row.get('size', '')):>8} {metric:<28} {old[metric]:>12.3f} "
+                  f"{value:>12.3f} {change:>+8.1%}{flag}")
+            if flag:
+                regressions.append(f"{row['stage']} {row.get('size', '')} {metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000', help="Comma-separated corpus sizes in chunks")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--embedder', default='hash', help="Embedding backend (default: hash, runs offline)")
+    parser.add_argument('--embed-batch', type=int, help="Model batch size (default: EMBEDDING_BATCH_SIZE)")
+    parser.add_argument('--index-type', help="Index type (default: FAISS_INDEX_TYPE)")
+    parser.add_argument('--add-batch', type=int, default=256, help="Chunks per add, as a streaming ingest window")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3, help="Chunking runs; the best is reported")
+    parser.add_argument('--skip-api', action='store_true', help="Do not benchmark the HTTP endpoints")
+    parser.add_argument('--api-documents', type=int, default=50)
+    parser.add_argument('--api-requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--baseline', help="Earlier --output to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="Smaller changes in time are not regressions")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch data directories")
+    parser.add_argument('--output', help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    home = os.getcwd()
+    engine = EmbeddingEngine(model=create_embedder(args.embedder), batch_size=args.embed_batch)
+    queries = synthetic_queries(args.queries, seed=args.seed)
+
+    report = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        documents = synthetic_corpus(size, seed=args.seed)
+        row, chunks = bench_chunking(documents, args.repeat)
+        report.append({'stage': 'chunking', 'size': size, **row})
+        print(f"[{size}] chunking: {row['chunks']} chunks, {row['mb']:.1f} MB at {row['mb_per_s']:.2f} MB/s")
+
+        row, embeddings, query_vectors = bench_embedding(
+            engine, [chunk for document_chunks in chunks for chunk in document_chunks], queries)
+        report.append({'stage': 'embedding', 'size': size, **row})
+        print(f"[{size}] embedding: {row['chunks_per_s']:.0f} chunks/s, query p50 {row['query_p50_ms']:.2f} ms")
+
+        workdir = tempfile.mkdtemp(prefix=f"bench-{size}-")
+        os.chdir(workdir)
+        try:
+            row = bench_index(args, engine.dimension, documents, chunks, embeddings, query_vectors)
+        finally:
+            os.chdir(home)
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        report.append({'stage': 'index', 'size': size, **row})
+        print(f"[{size}] index: add {row['add_rows_per_s']:.0f} rows/s, save {row['save_s']:.2f}s, "
+              f"load {row['load_s']:.2f}s, search p50 {row['search_p50_ms']:.3f} ms")
+        del documents, chunks, embeddings
+
+    if not args.skip_api:
+        workdir = tempfile.mkdtemp(prefix="bench-api-")
+        os.chdir(workdir)
+        try:
+            rows = bench_api(args)
+        finally:
+            os.chdir(home)
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        for row in rows:
+            report.append({**row, 'size': args.api_documents})
+            print(f"{row['stage']}: {row['requests_per_s']:.1f} req/s, p50 {row['request_p50_ms']:.1f} ms, "
+                  f"p99 {row['request_p99_ms']:.1f} ms, {row['errors']} errors")
+
+    meta = {
+        'embedder': args.embedder,
+        'index_type': args.index_type or os.getenv("FAISS_INDEX_TYPE", "flat"),
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'faiss': faiss.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        for key in ('embedder', 'index_type', 'concurrency', 'cpus'):
+            if baseline.get('meta', {}).get(key) != meta[key]:
+                print(f"Note: baseline has {key}={baseline.get('meta', {}).get(key)}, this run {meta[key]}")
+        regressions = compare(report, baseline.get('results', []), args.tolerance, args.min_delta_ms)
+        print(f"\nbaseline check: {'OK' if not regressions else f'{len(regressions)} regressions'}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'meta': meta, 'regressions': regressions, 'results': report}, f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
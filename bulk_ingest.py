@@ -0,0 +1,290 @@
+"""
+Offline bulk ingest of a whole corpus into the FAISS index.
+
+Reads .txt files from a directory or a tarball (.tar, .tar.gz, .tgz, ...),
+detects their language and chunks them in a process pool, encodes the
+chunks in large batches and appends them to the index through the WAL. The
+index snapshot is written once at the end (after training it, if the
+configured index type needs it).
+
+Runs are resumable: the content hash of every ingested file is recorded in
+a manifest, so an interrupted run can simply be restarted and unchanged
+files are skipped. A file whose name is already indexed but whose content
+changed replaces the old version, as a re-upload through /ingest does. Stop
+the API server first, both would write to the same data directory.
+
+Usage:
+    python bulk_ingest.py corpus/ --workers 8
+    python bulk_ingest.py guidelines.tar.gz --encode-batch 4096
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import tarfile
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+from services.document_service import build_chunk_metadata
+from utils.embedding_engine import EmbeddingEngine
+from utils.faiss_manager import FAISSManager
+from utils.index_factory import index_type_of, training_threshold
+from utils.near_duplicates import simhash
+from utils.text_processor import TextProcessor
+from utils.language import detect_language
+
+LANGUAGE_SAMPLE_CHARS = int(os.getenv("LANGUAGE_SAMPLE_CHARS", "20000"))
+
+_text_processor = TextProcessor()
+
+
+def iter_sources(source: str) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (name, raw bytes) for every .txt file under a directory or in a
+    tarball. Names are paths relative to the corpus root.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.txt'):
+                    path = os.path.join(root, name)
+                    with open(path, 'rb') as f:
+                        yield os.path.relpath(path, source), f.read()
+    else:
+        with tarfile.open(source, 'r:*') as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith('.txt'):
+                    yield os.path.normpath(member.name), tar.extractfile(member).read()
+
+
+def prepare_document(filename: str, data: bytes):
+    """
+    Worker process: decode, detect the language and chunk one file, and
+    compute each chunk's near-duplicate signature.
+    Returns (filename, language, [(chunk, simhash)], error).
+    """
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return filename, None, [], "not valid UTF-8"
+    language = detect_language(text[:LANGUAGE_SAMPLE_CHARS])
+    chunks = _text_processor.chunk_text(text, language)
+    return filename, language, [(chunk, simhash(chunk)) for chunk in chunks], None
+
+
+class Manifest:
+    """
+    Content hashes of the files already ingested, one JSON line per file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.hashes = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.hashes.add(json.loads(line)['sha256'])
+                    except (ValueError, KeyError):
+                        # Torn last line of an interrupted run
+                        continue
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, entries: List[Dict]):
+        for entry in entries:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.hashes.add(entry['sha256'])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BulkIngester:
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        encode_batch: int = 2048,
+        batch_size: Optional[int] = None,
+        index_type: Optional[str] = None,
+        manifest: Optional[str] = None,
+        progress_every: float = 10.0
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.encode_batch = encode_batch
+        self.progress_every = progress_every
+
+        self.embedding_engine = EmbeddingEngine(batch_size=batch_size)
+        self.faiss_manager = FAISSManager(self.embedding_engine.dimension, index_type=index_type)
+        # No background migrations or compactions mid-run; done once at the end
+        self.faiss_manager.auto_maintenance = False
+        self.manifest = Manifest(manifest or os.path.join(self.faiss_manager.data_dir, "bulk_ingest.manifest"))
+
+        # Prepared documents waiting for the next encode batch
+        self._pending: List[Tuple[str, str, str, List[Tuple[str, int]], int]] = []
+        self._pending_chunks = 0
+        self._hashes = set()
+
+        self.stats = {
+            'files_seen': 0, 'files_ingested': 0, 'skipped_hash': 0, 'replaced': 0,
+            'failed': 0, 'empty': 0, 'bytes': 0, 'chunks': 0,
+            'wait_s': 0.0, 'encode_s': 0.0, 'index_s': 0.0, 'snapshot_s': 0.0
+        }
+        self._started = time.perf_counter()
+        self._last_progress = self._started
+
+    def run(self, source: str):
+        in_flight = deque()
+        # spawn: forking after the embedding model (and its torch / ONNX
+        # thread pools) is loaded can deadlock the workers
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for filename, data in iter_sources(source):
+                self.stats['files_seen'] += 1
+                sha256 = hashlib.sha256(data).hexdigest()
+                if sha256 in self.manifest.hashes or sha256 in self._hashes:
+                    self.stats['skipped_hash'] += 1
+                    continue
+                self._hashes.add(sha256)
+                in_flight.append((pool.submit(prepare_document, filename, data), sha256, len(data)))
+                # Bound the number of files held in memory
+                self._collect(in_flight, self.workers * 4)
+            self._collect(in_flight, 0)
+        self._commit()
+        self._finish()
+        self.manifest.close()
+        self._report(final=True)
+
+    def _collect(self, in_flight: deque, limit: int):
+        while len(in_flight) > limit:
+            future, sha256, size = in_flight.popleft()
+            start = time.perf_counter()
+            filename, language, chunks, error = future.result()
+            self.stats['wait_s'] += time.perf_counter() - start
+
+            if error:
+                self.stats['failed'] += 1
+                print(f"Skipping {filename}: {error}")
+                continue
+            if not chunks:
+                # Nothing to index, but do not prepare it again on resume
+                self.stats['empty'] += 1
+                self.manifest.record([{'sha256': sha256, 'filename': filename, 'document_id': None, 'chunks': 0}])
+                continue
+
+            self._pending.append((sha256, filename, language, chunks, size))
+            self._pending_chunks += len(chunks)
+            if self._pending_chunks >= self.encode_batch:
+                self._commit()
+
+    def _commit(self):
+        """
+        Encode the pending documents in one batch and append them to the
+        index with a single WAL record, tombstone the versions they replace,
+        then record them in the manifest.
+        """
+        if not self._pending:
+            return
+        start = time.perf_counter()
+        embeddings = self.embedding_engine.encode_batch(
+            [chunk for _, _, _, chunks, _ in self._pending for chunk, _ in chunks]
+        )
+        self.stats['encode_s'] += time.perf_counter() - start
+
+        metadata, entries = [], []
+        for sha256, filename, language, chunks, size in self._pending:
+            document_id = str(uuid.uuid4())
+            rows = build_chunk_metadata([chunk for chunk, _ in chunks], document_id, filename, language)
+            for row, (_, signature) in zip(rows, chunks):
+                row['simhash'] = signature
+            metadata.extend(rows)
+            entries.append({'sha256': sha256, 'filename': filename, 'document_id': document_id, 'chunks': len(chunks)})
+            self.stats['bytes'] += size
+
+        start = time.perf_counter()
+        self.faiss_manager.add_embeddings(embeddings, metadata)
+        for entry in entries:
+            self._replace(entry['filename'], entry['document_id'])
+        self.stats['index_s'] += time.perf_counter() - start
+        self.manifest.record(entries)
+
+        self.stats['files_ingested'] += len(entries)
+        self.stats['chunks'] += len(metadata)
+        self._pending = []
+        self._pending_chunks = 0
+        if time.perf_counter() - self._last_progress >= self.progress_every:
+            self._report()
+
+    def _replace(self, filename: str, document_id: str):
+        """
+        Tombstone every earlier document stored under `filename`, so the
+        new version is the only one left (also cleans up after a run
+        interrupted between indexing a file and recording it).
+        """
+        previous = self.faiss_manager.find_document_by_filename(filename)
+        while previous is not None and previous != document_id:
+            self.faiss_manager.delete_document(previous)
+            self.stats['replaced'] += 1
+            previous = self.faiss_manager.find_document_by_filename(filename)
+
+    def _finish(self):
+        """
+        Train the configured index type if needed and write the snapshot.
+        """
+        start = time.perf_counter()
+        faiss_manager = self.faiss_manager
+        target = faiss_manager.index_type
+        if index_type_of(faiss_manager.index) != target and faiss_manager.ntotal >= training_threshold(target):
+            # Trains the new index and writes its snapshot
+            faiss_manager.migrate()
+        if faiss_manager.wal.size_bytes:
+            faiss_manager.compact()
+        self.stats['snapshot_s'] = time.perf_counter() - start
+
+    def _report(self, final: bool = False):
+        self._last_progress = time.perf_counter()
+        elapsed = max(self._last_progress - self._started, 1e-9)
+        stats = self.stats
+        print(f"{'Done' if final else 'Progress'}: {stats['files_ingested']} files, {stats['chunks']} chunks "
+              f"in {elapsed:.1f}s | {stats['files_ingested'] / elapsed:.1f} files/s, "
+              f"{stats['chunks'] / elapsed:.1f} chunks/s, {stats['bytes'] / 1e6 / elapsed:.2f} MB/s")
+        if final:
+            print(f"  seen {stats['files_seen']}, skipped {stats['skipped_hash']} unchanged by content hash, "
+                  f"replaced {stats['replaced']} older versions, {stats['empty']} without chunks, {stats['failed']} failed")
+            print(f"  waiting on workers {stats['wait_s']:.1f}s, encoding {stats['encode_s']:.1f}s, "
+                  f"indexing {stats['index_s']:.1f}s, snapshot {stats['snapshot_s']:.1f}s")
+            print(f"  index: {self.faiss_manager.get_stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="Directory or tarball of .txt documents")
+    parser.add_argument('--workers', type=int, help="Processes for language detection and chunking (default: CPU count)")
+    parser.add_argument('--encode-batch', type=int, default=2048, help="Chunks encoded and indexed per commit")
+    parser.add_argument('--batch-size', type=int, help="Model batch size (default: EMBEDDING_BATCH_SIZE)")
+    parser.add_argument('--index-type', help="Index type (default: FAISS_INDEX_TYPE)")
+    parser.add_argument('--manifest', help="Resume manifest (default: data/bulk_ingest.manifest)")
+    parser.add_argument('--progress-every', type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    BulkIngester(
+        workers=args.workers,
+        encode_batch=args.encode_batch,
+        batch_size=args.batch_size,
+        index_type=args.index_type,
+        manifest=args.manifest,
+        progress_every=args.progress_every
+    ).run(args.source)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Optional
+import json
 import os
+import threading
 import uvicorn
 from dotenv import load_dotenv
 
@@ -13,23 +17,111 @@ from services.document_service import DocumentService
 from services.retrieval_service import RetrievalService
 from services.generation_service import GenerationService
 from services.translation_service import TranslationService
-from models.schemas import IngestRequest, RetrievalRequest, GenerationRequest, DocumentResponse, RetrievalResponse, StandardResponse
+from services.ingest_job_service import IngestJobService
+from models.schemas import IngestRequest, RetrievalRequest, BatchRetrievalRequest, GenerationRequest, DocumentResponse, RetrievalResponse, StandardResponse
+
+from utils.faiss_manager import FAISSManager
+from utils.embedding_engine import EmbeddingEngine
+from utils.model_registry import model_registry
+from utils.executor import default_executor, OverloadedError
+from utils.metrics import RequestMetricsMiddleware, metrics
+from utils.profiler import SlowRequestProfiler
+
+def _warm_up():
+    """
+    Load the FAISS index and the embedding model in the background so the
+    server can bind immediately.
+    """
+    try:
+        shared_faiss_manager.ensure_loaded()
+        model_registry.get_model()
+        print("Warm-up complete: model and index loaded")
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+
+# Requests slower than this are profiled (0 disables the sampling profiler)
+PROFILE_SLOW_REQUESTS_MS = float(os.getenv("PROFILE_SLOW_REQUESTS_MS", "0"))
+slow_request_profiler = SlowRequestProfiler(PROFILE_SLOW_REQUESTS_MS) if PROFILE_SLOW_REQUESTS_MS > 0 else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv("WARM_UP_ON_STARTUP", "true").lower() == "true":
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    if slow_request_profiler is not None:
+        slow_request_profiler.start()
+    ingest_job_service.start()
+    yield
+    await ingest_job_service.stop()
+    if slow_request_profiler is not None:
+        slow_request_profiler.stop()
+    default_executor.shutdown()
 
 app = FastAPI(
     title="Healthcare Knowledge Assistant",
     description="RAG-powered assistant for medical guidelines and research summaries",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Initialize shared FAISS manager
-from utils.faiss_manager import FAISSManager
-shared_faiss_manager = FAISSManager()
+# Per-route latency and status counts; stage breakdown in a Server-Timing
+# header when SERVER_TIMING is on
+app.add_middleware(
+    RequestMetricsMiddleware,
+    server_timing=os.getenv("SERVER_TIMING", "false").lower() == "true",
+    profiler=slow_request_profiler
+)
 
-# Initialize services with shared FAISS manager
-document_service = DocumentService(shared_faiss_manager)
-retrieval_service = RetrievalService(shared_faiss_manager)
-generation_service = GenerationService()
+# Initialize shared FAISS manager (index is loaded lazily or by the warm-up,
+# sized for the configured embedder, which that loads too)
+shared_faiss_manager = FAISSManager(autoload=False, dimension_source=model_registry.dimension)
+
+# Initialize shared embedding engine (model comes from the shared registry)
+shared_embedding_engine = EmbeddingEngine()
+
+# Initialize services with shared FAISS manager and embedding engine
 translation_service = TranslationService()
+document_service = DocumentService(shared_faiss_manager, shared_embedding_engine, translation_service=translation_service)
+retrieval_service = RetrievalService(shared_faiss_manager, shared_embedding_engine)
+generation_service = GenerationService(translation_service, shared_faiss_manager)
+ingest_job_service = IngestJobService(shared_faiss_manager)
+
+# /ingest queues uploads as background jobs unless `background` says otherwise
+INGEST_BACKGROUND = os.getenv("INGEST_BACKGROUND", "false").lower() == "true"
+
+def _cache_stats():
+    """
+    Stats of every cache by name, for the metrics below.
+    """
+    retrieval = retrieval_service.cache_stats()
+    return {
+        "query_embedding": retrieval["embedding_cache"],
+        "retrieval_result": retrieval["result_cache"],
+        "generation": generation_service.cache_stats(),
+        "translation": translation_service.cache_stats()
+    }
+
+def _cache_metric(field: str):
+    return lambda: {(name, ): stats.get(field) for name, stats in _cache_stats().items()}
+
+metrics.callback("faiss_index_vectors", "Vectors in the index, including deleted ones", lambda: shared_faiss_manager.ntotal)
+metrics.callback("faiss_deleted_chunks", "Deleted chunks awaiting a purge", lambda: shared_faiss_manager.metadata_store.deleted_count)
+metrics.callback("faiss_delta_segments", "Delta segments not yet compacted into the base index", lambda: len(shared_faiss_manager.deltas))
+metrics.callback("faiss_wal_bytes", "Size of the write-ahead log", lambda: shared_faiss_manager.wal.size_bytes)
+metrics.callback("embedding_model_loaded", "Whether the embedding model is loaded", lambda: int(model_registry.is_loaded()))
+metrics.callback("executor_queue_depth", "Tasks running or queued in the executor", lambda: default_executor.queue_depth)
+metrics.callback("executor_max_queue", "Executor task limit before requests get 503", lambda: default_executor.max_queue)
+metrics.callback("ingest_jobs", "Ingest jobs held in memory, by status", lambda: {
+    (status, ): count for status, count in ingest_job_service.stats().items()
+    if status in ("queued", "running", "succeeded", "failed")
+}, ("status",))
+metrics.callback("ingest_commits_total", "Index commits made for background ingest jobs", lambda: ingest_job_service.writer.commits, kind="counter")
+metrics.callback("ingest_committed_windows_total", "Ingest windows indexed by those commits", lambda: ingest_job_service.writer.windows, kind="counter")
+metrics.callback("cache_hits_total", "Cache hits", _cache_metric("hits"), ("cache",), kind="counter")
+metrics.callback("cache_misses_total", "Cache misses", _cache_metric("misses"), ("cache",), kind="counter")
+metrics.callback("cache_evictions_total", "Cache evictions", _cache_metric("evictions"), ("cache",), kind="counter")
+metrics.callback("cache_entries", "Entries held by each cache", lambda: {
+    (name, ): stats.get("size", stats.get("entries")) for name, stats in _cache_stats().items()
+}, ("cache",))
 
 # Security
 security = HTTPBearer()
@@ -37,19 +129,69 @@ API_KEY = os.getenv("API_KEY")
 if not API_KEY:
     raise ValueError("API_KEY environment variable is required. Please set it in your .env file.")
 
+def _overloaded_response() -> JSONResponse:
+    """503 returned when the executor queue is full."""
+    return JSONResponse(
+        status_code=503,
+        content=StandardResponse(status=False, message="overloaded", data={"error": "Server is overloaded, please retry later"}).model_dump()
+    )
+
 async def verify_api_key(x_api_key: str = Header(...)):
     if x_api_key != API_KEY:
         raise HTTPException(status_code=401, detail="Invalid API key")
     return x_api_key
 
+@app.get("/ready")
+async def readiness():
+    """
+    Readiness probe: reports whether the embedding model and index are loaded.
+    """
+    data = {
+        "model_loaded": model_registry.is_loaded(),
+        "index_loaded": shared_faiss_manager.is_loaded
+    }
+    if not all(data.values()):
+        return JSONResponse(
+            status_code=503,
+            content=StandardResponse(status=False, message="warming up", data=data).model_dump()
+        )
+    return StandardResponse(status=True, message="ready", data=data)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus metrics of this worker: request and stage latency
+    histograms, index size, cache hits and executor queue depth.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def get_stats(api_key: str = Depends(verify_api_key)) -> StandardResponse:
+    """
+    Index statistics and retrieval/translation/generation cache hit/miss/eviction counts.
+    """
+    return StandardResponse(
+        status=True,
+        message="success",
+        data={
+            "index": shared_faiss_manager.get_stats(),
+            "cache": retrieval_service.cache_stats(),
+            "translation_cache": translation_service.cache_stats(),
+            "generation_cache": generation_service.cache_stats(),
+            "ingest_jobs": ingest_job_service.stats()
+        }
+    )
+
 @app.post("/ingest")
 async def ingest_document(
     file: UploadFile = File(...),
+    background: Optional[bool] = Query(None),
     api_key: str = Depends(verify_api_key)
 ) -> StandardResponse:
     """
     Ingest a .txt document for indexing.
     Detects language, generates embeddings, and stores in FAISS.
+    With `background`, the upload is queued and a job id returned (202).
     """
     try:
         # Validate file type
@@ -60,15 +202,25 @@ async def ingest_document(
                 data=None
             )
         
-        # Read file content
-        content = await file.read()
-        text_content = content.decode('utf-8')
+        if background is None:
+            background = INGEST_BACKGROUND
+        if background:
+            job = await ingest_job_service.submit(file, filename=file.filename)
+            return JSONResponse(
+                status_code=202,
+                content=StandardResponse(
+                    status=True,
+                    message="accepted",
+                    data={
+                        "job_id": job.id,
+                        "status": job.status,
+                        "status_url": f"/ingest/jobs/{job.id}"
+                    }
+                ).model_dump()
+            )
         
-        # Process the document
-        result = await document_service.ingest_document(
-            content=text_content,
-            filename=file.filename
-        )
+        # Process the document, streaming it from the upload
+        result = await document_service.ingest_file(file, filename=file.filename)
         
         return StandardResponse(
             status=True,
@@ -77,9 +229,12 @@ async def ingest_document(
                 "message": result.message,
                 "document_id": result.document_id,
                 "language": result.language,
-                "chunks_processed": result.chunks_processed
+                "chunks_processed": result.chunks_processed,
+                "replaced_document_id": result.replaced_document_id
             }
         )
+    except OverloadedError:
+        return _overloaded_response()
     except UnicodeDecodeError:
         return StandardResponse(
             status=False,
@@ -95,6 +250,63 @@ async def ingest_document(
 
 
 
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(
+    job_id: str,
+    api_key: str = Depends(verify_api_key)
+) -> StandardResponse:
+    """
+    Status and progress of a background ingest job.
+    """
+    job = ingest_job_service.get(job_id)
+    if job is None:
+        return StandardResponse(
+            status=False,
+            message="Job not found",
+            data={"job_id": job_id}
+        )
+    
+    return StandardResponse(
+        status=True,
+        message="success",
+        data=job.as_dict()
+    )
+
+@app.delete("/documents/{document_id}")
+async def delete_document(
+    document_id: str,
+    api_key: str = Depends(verify_api_key)
+) -> StandardResponse:
+    """
+    Delete an ingested document. Its chunks stop appearing in results
+    immediately; the index space is reclaimed by a background purge.
+    """
+    try:
+        chunks_deleted = await document_service.delete_document(document_id)
+        if not chunks_deleted:
+            return StandardResponse(
+                status=False,
+                message="Document not found",
+                data={"document_id": document_id}
+            )
+        
+        return StandardResponse(
+            status=True,
+            message="success",
+            data={
+                "document_id": document_id,
+                "chunks_deleted": chunks_deleted
+            }
+        )
+    except OverloadedError:
+        return _overloaded_response()
+    except Exception as e:
+        return StandardResponse(
+            status=False,
+            message="fail",
+            data={"error": str(e)}
+        )
+
 @app.post("/retrieve")
 async def retrieve_documents(
     request: RetrievalRequest,
@@ -107,7 +319,9 @@ async def retrieve_documents(
     try:
         results = await retrieval_service.retrieve(
             query=request.query,
-            top_k=3
+            top_k=3,
+            include_duplicates=request.include_duplicates,
+            filters=request.filters.model_dump(exclude_none=True) if request.filters else None
         )
         
         # Convert to response format
@@ -124,6 +338,63 @@ async def retrieve_documents(
             message="success",
             data={"documents": documents}
         )
+    except OverloadedError:
+        return _overloaded_response()
+    except Exception as e:
+        return StandardResponse(
+            status=False,
+            message="fail",
+            data={"error": str(e)}
+        )
+
+MAX_BATCH_QUERIES = int(os.getenv("RETRIEVE_BATCH_MAX_QUERIES", "64"))
+
+@app.post("/retrieve/batch")
+async def retrieve_documents_batch(
+    request: BatchRetrievalRequest,
+    api_key: str = Depends(verify_api_key)
+) -> StandardResponse:
+    """
+    Retrieve relevant documents for several queries in one call.
+    Each query carries its own top_k (default 3, at most RETRIEVE_MAX_TOP_K).
+    """
+    try:
+        if not request.queries or len(request.queries) > MAX_BATCH_QUERIES:
+            return StandardResponse(
+                status=False,
+                message=f"Between 1 and {MAX_BATCH_QUERIES} queries are allowed per batch",
+                data=None
+            )
+            
+        batch_results = await retrieval_service.retrieve_batch(
+            queries=[item.query for item in request.queries],
+            top_ks=[item.top_k for item in request.queries],  # Clamped by the service
+            include_duplicates=request.include_duplicates,
+            filters=request.filters.model_dump(exclude_none=True) if request.filters else None
+        )
+        
+        # Convert to response format
+        results = [
+            {
+                "query": item.query,
+                "documents": [
+                    {
+                        "content": doc.content,
+                        "similarity_score": doc.similarity_score
+                    }
+                    for doc in documents
+                ]
+            }
+            for item, documents in zip(request.queries, batch_results)
+        ]
+        
+        return StandardResponse(
+            status=True,
+            message="success",
+            data={"results": results}
+        )
+    except OverloadedError:
+        return _overloaded_response()
     except Exception as e:
         return StandardResponse(
             status=False,
@@ -141,17 +412,7 @@ async def generate_response(
     Returns responses in both English and Japanese.
     """
     try:
-        # Convert input documents to DocumentResponse objects
-        documents = []
-        for doc in request.documents:
-            doc_response = DocumentResponse(
-                content=doc["content"],
-                filename="provided_document",
-                similarity_score=doc["similarity_score"],
-                language="en",  # Default language
-                document_id="provided"
-            )
-            documents.append(doc_response)
+        documents = _provided_documents(request)
         
         # Generate response in both languages
         response = await generation_service.generate(
@@ -168,14 +429,67 @@ async def generate_response(
                 "response_ja": response.response_ja
             }
         )
+    except OverloadedError:
+        return _overloaded_response()
+    except Exception as e:
+        return StandardResponse(
+            status=False,
+            message="fail",
+            data={"error": str(e)}
+        )
+
+
+@app.post("/generate/stream")
+async def generate_response_stream(
+    request: GenerationRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Streaming variant of /generate as Server-Sent Events: 'start', then
+    'delta' events with the source-language text as it is generated,
+    'translation' events with translated sentences (indexed, in order) as
+    they complete, and a final 'done' event with both responses.
+    """
+    try:
+        documents = _provided_documents(request)
     except Exception as e:
         return StandardResponse(
             status=False,
             message="fail",
             data={"error": str(e)}
         )
+    
+    async def events():
+        try:
+            async for event, data in generation_service.generate_stream(request.query, documents):
+                yield _sse(event, data)
+        except Exception as e:
+            # Headers are already sent; report the failure in-stream
+            yield _sse("error", {"error": str(e)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
+def _provided_documents(request: GenerationRequest) -> List[DocumentResponse]:
+    """Convert input documents to DocumentResponse objects."""
+    documents = []
+    for doc in request.documents:
+        doc_response = DocumentResponse(
+            content=doc["content"],
+            filename="provided_document",
+            similarity_score=doc["similarity_score"],
+            language="en",  # Default language
+            document_id="provided"
+        )
+        documents.append(doc_response)
+    return documents
 
+def _sse(event: str, data: dict) -> str:
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
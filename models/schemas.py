@@ -10,9 +10,27 @@ class IngestResponse(BaseModel):
     document_id: str
     language: str
     chunks_processed: int
+    replaced_document_id: Optional[str] = None
+
+class RetrievalFilters(BaseModel):
+    language: Optional[str] = None
+    document_id: Optional[str] = None
+    filename: Optional[str] = None
+    filename_prefix: Optional[str] = None
 
 class RetrievalRequest(BaseModel):
     query: str
+    include_duplicates: bool = False
+    filters: Optional[RetrievalFilters] = None
+
+class BatchRetrievalQuery(BaseModel):
+    query: str
+    top_k: int = 3
+
+class BatchRetrievalRequest(BaseModel):
+    queries: List[BatchRetrievalQuery]
+    include_duplicates: bool = False
+    filters: Optional[RetrievalFilters] = None
 
 class DocumentResponse(BaseModel):
     content: str
@@ -1,77 +1,219 @@
+import asyncio
+import codecs
+import os
 import uuid
-from typing import List
-from langdetect import detect
-from sentence_transformers import SentenceTransformer
-import numpy as np
+from typing import Any, Callable, Dict, List, Optional
 
 from models.schemas import IngestResponse
 from utils.text_processor import TextProcessor
+from utils.language import detect_language, language_sample
 from utils.faiss_manager import FAISSManager
+from utils.embedding_engine import EmbeddingEngine
+from utils.executor import default_executor
+from utils.metrics import span
+
+def build_chunk_metadata(
+    chunks: List[str],
+    document_id: str,
+    filename: str,
+    language: str,
+    first_chunk_id: int = 0
+) -> List[Dict[str, Any]]:
+    """
+    Metadata rows for consecutive chunks of one document, in the layout
+    FAISSManager.add_embeddings expects.
+    """
+    chunk_metadata = []
+    for i, chunk in enumerate(chunks):
+        metadata = {
+            'document_id': document_id,
+            'filename': filename,
+            'chunk_id': first_chunk_id + i,
+            'content': chunk,
+            'language': language
+        }
+        chunk_metadata.append(metadata)
+    return chunk_metadata
 
 class DocumentService:
-    def __init__(self, faiss_manager=None):
+    def __init__(self, faiss_manager=None, embedding_engine=None, executor=None, translation_service=None, index_writer=None):
+        self.executor = executor or default_executor
         self.text_processor = TextProcessor()
-        self.faiss_manager = faiss_manager or FAISSManager()
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_engine = embedding_engine or EmbeddingEngine()
+        self.faiss_manager = faiss_manager or FAISSManager(self.embedding_engine.dimension)
+        # Anything with async add_embeddings(embeddings, metadata) that
+        # indexes windows in place of the FAISS manager (e.g. a
+        # CoalescingIndexWriter sharing commits between ingests)
+        self.index_writer = index_writer
+        self.read_bytes = int(os.getenv("INGEST_READ_BYTES", str(1024 * 1024)))
+        self.window_chunks = int(os.getenv("INGEST_WINDOW_CHUNKS", "256"))
+        self.language_sample_chars = int(os.getenv("LANGUAGE_SAMPLE_CHARS", "20000"))
+        # Translate every chunk into the other language at ingest, so
+        # /generate never waits on a translation
+        self.pretranslate = os.getenv("PRETRANSLATE_ON_INGEST", "false").lower() == "true"
+        self.translation_service = translation_service
+        if self.pretranslate and self.translation_service is None:
+            from services.translation_service import TranslationService
+            self.translation_service = TranslationService(self.executor)
         
     async def ingest_document(self, content: str, filename: str) -> IngestResponse:
         """
         Ingest a document: detect language, chunk, embed, and store in FAISS.
         """
+        with span("ingest.detect"):
+            language = await self.executor.run_cpu(detect_language, language_sample(content))
+
+        async def pieces():
+            yield content
+
+        return await self._ingest_pieces(pieces(), language, filename)
+
+    async def ingest_file(self, file, filename: str, progress: Optional[Callable[[int], None]] = None) -> IngestResponse:
+        """
+        Ingest an uploaded file (anything with async `read(size)` and `seek`)
+        without holding it in memory. A first pass validates the UTF-8 and
+        detects the language from the start of the text; the second pass
+        chunks, embeds and indexes it window by window, calling
+        `progress(chunks_indexed)` after each window.
+        """
+        sample = []
+        sample_len = 0
+        with span("ingest.validate"):
+            async for text in self._decode(file):
+                if sample_len < self.language_sample_chars:
+                    sample.append(text[:self.language_sample_chars - sample_len])
+                    sample_len += len(sample[-1])
+        with span("ingest.detect"):
+            language = await self.executor.run_cpu(detect_language, language_sample(''.join(sample)))
+
+        await file.seek(0)
+        return await self._ingest_pieces(self._decode(file), language, filename, progress)
+
+    async def _decode(self, file):
+        """
+        Yield the file as text, decoding UTF-8 incrementally so multi-byte
+        characters may straddle reads. Raises UnicodeDecodeError.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            data = await file.read(self.read_bytes)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+    async def _ingest_pieces(self, pieces, language: str, filename: str, progress: Optional[Callable[[int], None]] = None) -> IngestResponse:
+        """
+        Chunk text as it arrives and embed/index it in windows of
+        `window_chunks`, so memory does not grow with the document size.
+        A document already stored under `filename` is replaced once the new
+        one is fully indexed, so one of the two versions is always searchable.
+        """
         document_id = str(uuid.uuid4())
-        
+
+        await self.executor.run(self.faiss_manager.ensure_loaded)
+        existing_document_id = self.faiss_manager.find_document_by_filename(filename)
+
+        chunker = self.text_processor.stream(language)
+        window: List[str] = []
+        chunks_processed = 0
         try:
-            language = detect(content)
-            if language in ['ja', 'jp']:
-                language = 'ja'
-            else:
-                language = 'en'  
-        except:
-            language = 'en' 
+            async for text in pieces:
+                with span("ingest.chunk"):
+                    window.extend(await self.executor.run(chunker.feed, text))
+                while len(window) >= self.window_chunks:
+                    await self._index_window(window[:self.window_chunks], document_id, filename, language, chunks_processed)
+                    chunks_processed += self.window_chunks
+                    window = window[self.window_chunks:]
+                    if progress is not None:
+                        progress(chunks_processed)
+            with span("ingest.chunk"):
+                window.extend(chunker.close())
+            if window:
+                await self._index_window(window, document_id, filename, language, chunks_processed)
+                chunks_processed += len(window)
+                if progress is not None:
+                    progress(chunks_processed)
             
-        existing_docs = [meta for meta in self.faiss_manager.metadata_store 
-                        if meta.get('filename') == filename]
+            if chunks_processed and existing_document_id:
+                with span("ingest.replace"):
+                    await self.executor.run(self.faiss_manager.delete_document, existing_document_id)
+        except (Exception, asyncio.CancelledError):
+            # Take back the windows already indexed, so a failed ingest
+            # leaves the previous version (if any) as the only one
+            await self._rollback(document_id, filename)
+            raise
         
-        if existing_docs:
+        if not chunks_processed:
+            # Keep the previous version rather than replacing it with nothing
             return IngestResponse(
-                message=f"Document {filename} already exists",
-                document_id=existing_docs[0]['document_id'],
+                message="No valid chunks created from document",
+                document_id=document_id,
                 language=language,
                 chunks_processed=0
             )
-            
-        chunks = self.text_processor.chunk_text(content, language)
         
-        if not chunks:
+        if existing_document_id:
             return IngestResponse(
-                message="No valid chunks created from document",
+                message="Document replaced successfully",
                 document_id=document_id,
                 language=language,
-                chunks_processed=0
+                chunks_processed=chunks_processed,
+                replaced_document_id=existing_document_id
             )
         
-        embeddings = []
-        chunk_metadata = []
-        
-        for i, chunk in enumerate(chunks):
-            embedding = self.embedding_model.encode(chunk)
-            embeddings.append(embedding)
-            
-            metadata = {
-                'document_id': document_id,
-                'filename': filename,
-                'chunk_id': i,
-                'content': chunk,
-                'language': language
-            }
-            chunk_metadata.append(metadata)
-        
-        embeddings_array = np.array(embeddings)
-        self.faiss_manager.add_embeddings(embeddings_array, chunk_metadata)
-        
         return IngestResponse(
             message="Document ingested successfully",
             document_id=document_id,
             language=language,
-            chunks_processed=len(chunks)
-        )
\ No newline at end of file
+            chunks_processed=chunks_processed
+        )
+
+    async def _rollback(self, document_id: str, filename: str):
+        """
+        Delete the chunks a failed ingest has indexed. Runs outside the
+        bounded executor, so a full queue cannot leave them behind.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            removed = await loop.run_in_executor(None, self.faiss_manager.delete_document, document_id)
+        except Exception as e:
+            print(f"Rollback of failed ingest of {filename} (document {document_id}) failed: {e}")
+            return
+        if removed:
+            print(f"Rolled back {removed} chunks of failed ingest of {filename}")
+
+    async def delete_document(self, document_id: str) -> int:
+        """
+        Delete a document's chunks from the index; returns how many there were.
+        """
+        return await self.executor.run(self.faiss_manager.delete_document, document_id)
+
+    async def _index_window(self, chunks: List[str], document_id: str, filename: str, language: str, first_chunk_id: int):
+        # Encode the window's chunks in sized batches
+        with span("ingest.encode"):
+            embeddings_array = await self.embedding_engine.encode_documents(chunks)
+        chunk_metadata = build_chunk_metadata(chunks, document_id, filename, language, first_chunk_id)
+        if self.pretranslate:
+            with span("ingest.pretranslate"):
+                await self._pretranslate(chunks, chunk_metadata, language)
+        with span("ingest.index"):
+            if self.index_writer is not None:
+                await self.index_writer.add_embeddings(embeddings_array, chunk_metadata)
+            else:
+                await self.executor.run(self.faiss_manager.add_embeddings, embeddings_array, chunk_metadata)
+
+    async def _pretranslate(self, chunks: List[str], chunk_metadata: List[Dict[str, Any]], language: str):
+        """
+        Store each chunk's translation into the other language in its
+        metadata. Chunks whose translation failed are stored without one.
+        """
+        target_language = 'en' if language == 'ja' else 'ja'
+        translations = await self.translation_service.translate_batch(chunks, target_language, language)
+        for metadata, chunk, translation in zip(chunk_metadata, chunks, translations):
+            if translation != chunk:
+                metadata['translation'] = translation
@@ -1,12 +1,95 @@
-from typing import List, Optional
-from langdetect import detect
+import asyncio
+import hashlib
+import os
+import re
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 from models.schemas import DocumentResponse, GenerationResponse
 from services.translation_service import TranslationService
+from utils.cache import TTLCache
+from utils.executor import default_executor, OverloadedError
+from utils.language import detect_language
+from utils.metrics import span
+
+# Sentence ends: ASCII punctuation once followed by whitespace, Japanese
+# punctuation and line breaks right away
+_SENTENCE_END = re.compile(r'[.!?](?=\s)|[。！？\n]')
+
+def generation_key(query: str, documents: List[DocumentResponse]) -> str:
+    """
+    Cache key of a generation: hash of the query and the document contents.
+    """
+    digest = hashlib.sha256(query.encode('utf-8'))
+    for document in documents:
+        digest.update(b'\x00')
+        digest.update(document.content.encode('utf-8'))
+    return digest.hexdigest()
+
+def join_translations(texts: List[str], untranslated: List[bool], target: str) -> str:
+    """
+    Join translated segments: with spaces into English, without into
+    Japanese, except around segments left untranslated (still in the
+    source language), which keep a space.
+    """
+    joined = ''
+    for i, text in enumerate(texts):
+        if i and (target == 'en' or untranslated[i] or untranslated[i - 1]):
+            joined += ' '
+        joined += text
+    return joined
+
+def split_segments(text: str, min_chars: int) -> Tuple[List[str], str]:
+    """
+    Split complete sentences of at least `min_chars` off the front of
+    `text`; returns (segments, unfinished rest).
+    """
+    segments = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        if match.end() - start >= min_chars:
+            segment = text[start:match.end()].strip()
+            if segment:
+                segments.append(segment)
+            start = match.end()
+    return segments, text[start:]
+
+def stream_pieces(text: str, size: int) -> Iterator[str]:
+    """
+    Word-aligned pieces of about `size` characters; text without spaces
+    (e.g. Japanese) is cut by characters.
+    """
+    piece = ''
+    for token in re.findall(r'\s+|\S+\s*', text):
+        if len(token) > size:
+            if piece:
+                yield piece
+                piece = ''
+            for start in range(0, len(token), size):
+                yield token[start:start + size]
+            continue
+        piece += token
+        if len(piece) >= size:
+            yield piece
+            piece = ''
+    if piece:
+        yield piece
 
 class GenerationService:
-    def __init__(self):
-        self.translation_service = TranslationService()
+    def __init__(self, translation_service: Optional[TranslationService] = None, faiss_manager=None, executor=None):
+        self.executor = executor or default_executor
+        self.translation_service = translation_service or TranslationService()
+        # Source of the chunk translations stored at ingest, if any
+        self.faiss_manager = faiss_manager
+        # hash(query, document contents) -> GenerationResponse
+        self.response_cache = TTLCache(
+            max_size=int(os.getenv("GENERATION_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("GENERATION_CACHE_TTL", "3600"))
+        )
+        # Streaming: size of the mock generator's pieces, and the shortest
+        # sentence segment sent for translation on its own
+        self.stream_chunk_chars = int(os.getenv("GENERATION_STREAM_CHUNK_CHARS", "24"))
+        self.segment_min_chars = int(os.getenv("GENERATION_SEGMENT_MIN_CHARS", "40"))
         
     async def generate(
         self, 
@@ -16,34 +99,147 @@ class GenerationService:
         """
         Generate a mock LLM response based on query and retrieved documents.
         Returns responses in both English and Japanese via translation.
+        Responses are cached per query and document contents.
         """
+        key = generation_key(query, documents)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            return cached
+        
         # Detect document language
         document_content = documents[0].content if documents else ""
-        is_japanese_doc = any(ord(char) > 127 for char in document_content)
+        is_japanese_doc = detect_language(document_content) == 'ja'
+        
+        response = self._generate_response_from_documents(documents)
+        source, target = ("ja", "en") if is_japanese_doc else ("en", "ja")
+        with span("generate.translate"):
+            translation = await self._translate(response, documents, target, source)
         
         if is_japanese_doc:
-            # Japanese documents: Generate Japanese response, translate to English
-            response_ja = self._generate_response_from_documents(documents)
-            response_en = await self.translation_service.translate_text(
-                response_ja,
-                target_language="en", 
-                source_language="ja"
-            )
+            # Japanese documents: Japanese response, translated to English
+            result = GenerationResponse(query=query, response_en=translation, response_ja=response)
         else:
-            # English documents: Generate English response, translate to Japanese
-            response_en = self._generate_response_from_documents(documents)
-            response_ja = await self.translation_service.translate_text(
-                response_en,
-                target_language="ja", 
-                source_language="en"
-            )
+            # English documents: English response, translated to Japanese
+            result = GenerationResponse(query=query, response_en=response, response_ja=translation)
+        
+        if translation != response or not response.strip():
+            # A failed translation falls back to the original; retry it next time
+            self.response_cache.set(key, result)
+        return result
         
-        return GenerationResponse(
-            query=query,
-            response_en=response_en,
-            response_ja=response_ja
+    async def _translate(self, response: str, documents: List[DocumentResponse], target: str, source: str) -> str:
+        """
+        Translation of the response: the chunk's pre-translation when one
+        was stored at ingest, otherwise the translation service.
+        """
+        if documents and self.faiss_manager is not None and response == documents[0].content:
+            translation = await self.executor.run(self.faiss_manager.find_translation, response)
+            if translation:
+                return translation
+        return await self.translation_service.translate_text(
+            response,
+            target_language=target,
+            source_language=source
         )
         
+    async def generate_stream(
+        self,
+        query: str,
+        documents: List[DocumentResponse]
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Stream a response as (event, data) pairs. 'delta' events carry the
+        source-language text as it is generated. Completed sentences are
+        translated concurrently and sent in order as 'translation' events
+        once ready. A final 'done' event carries the full GenerationResponse.
+        """
+        document_content = documents[0].content if documents else ""
+        source, target = ("ja", "en") if detect_language(document_content) == 'ja' else ("en", "ja")
+        yield 'start', {'query': query, 'language': source, 'translation_language': target}
+
+        # Own namespace: the segment-by-segment translation may differ from
+        # the whole-text translation /generate caches
+        key = 'stream:' + generation_key(query, documents)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            response, translation = (cached.response_ja, cached.response_en) if source == 'ja' else (cached.response_en, cached.response_ja)
+            yield 'delta', {'text': response}
+            yield 'translation', {'index': 0, 'text': translation}
+            yield 'done', cached.model_dump()
+            return
+
+        pretranslated = None
+        if documents and self.faiss_manager is not None:
+            with span("generate.pretranslation"):
+                pretranslated = await self.executor.run(self.faiss_manager.find_translation, document_content)
+
+        # (segment, translation task) in segment order
+        pending = deque()
+        parts: List[str] = []
+        translations: List[str] = []
+        untranslated: List[bool] = []
+        buffer = ''
+        try:
+            async for piece in self._stream_response_from_documents(documents):
+                parts.append(piece)
+                yield 'delta', {'text': piece}
+                if pretranslated is None:
+                    segments, buffer = split_segments(buffer + piece, self.segment_min_chars)
+                    for segment in segments:
+                        pending.append((segment, asyncio.ensure_future(self._translate_segment(segment, target, source))))
+                while pending and pending[0][1].done():
+                    segment, task = pending.popleft()
+                    translations.append(task.result())
+                    untranslated.append(translations[-1] == segment)
+                    yield 'translation', {'index': len(translations) - 1, 'text': translations[-1]}
+
+            response = ''.join(parts)
+            if pretranslated is not None and response == document_content:
+                translations.append(pretranslated)
+                untranslated.append(False)
+                yield 'translation', {'index': 0, 'text': pretranslated}
+            else:
+                segments, _ = split_segments((response if pretranslated is not None else buffer) + '\n', 1)
+                for segment in segments:
+                    pending.append((segment, asyncio.ensure_future(self._translate_segment(segment, target, source))))
+                while pending:
+                    segment, task = pending.popleft()
+                    translations.append(await task)
+                    untranslated.append(translations[-1] == segment)
+                    yield 'translation', {'index': len(translations) - 1, 'text': translations[-1]}
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+        translation = join_translations(translations, untranslated, target)
+        if source == 'ja':
+            result = GenerationResponse(query=query, response_en=translation, response_ja=response)
+        else:
+            result = GenerationResponse(query=query, response_en=response, response_ja=translation)
+        if not any(untranslated):
+            self.response_cache.set(key, result)
+        yield 'done', result.model_dump()
+
+    async def _translate_segment(self, segment: str, target: str, source: str) -> str:
+        try:
+            with span("generate.translate"):
+                return await self.translation_service.translate_text(segment, target_language=target, source_language=source)
+        except OverloadedError:
+            # Mid-stream there is no status code left to send; keep the original
+            return segment
+
+    async def _stream_response_from_documents(self, documents: List[DocumentResponse]) -> AsyncIterator[str]:
+        """
+        Mock token stream: the generated response in small pieces. A real
+        LLM would yield its tokens here.
+        """
+        for piece in stream_pieces(self._generate_response_from_documents(documents), self.stream_chunk_chars):
+            yield piece
+            await asyncio.sleep(0)
+
+    def cache_stats(self):
+        return self.response_cache.stats()
+        
     def _generate_response_from_documents(self, documents: List[DocumentResponse]) -> str:
         """Generate response directly from documents in their original language."""
         
@@ -54,7 +250,7 @@ class GenerationService:
         document_content = documents[0].content
         
         # Detect if it's Japanese or English and add appropriate wrapper
-        is_japanese = any(ord(char) > 127 for char in document_content)
+        is_japanese = detect_language(document_content) == 'ja'
         
         if is_japanese:
             # Japanese response format
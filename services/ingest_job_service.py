@@ -0,0 +1,341 @@
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.schemas import IngestResponse
+from services.document_service import DocumentService
+from utils.embedding_engine import EmbeddingEngine
+from utils.executor import default_executor, OverloadedError
+from utils.faiss_manager import FAISSManager
+from utils.metrics import span
+
+class _BackgroundExecutor:
+    """
+    Executor view for background jobs: when the executor is full, wait for
+    room instead of raising OverloadedError, which would fail a job that
+    has already indexed part of its document.
+    """
+    def __init__(self, executor, retry_ms: float = 50):
+        self.executor = executor
+        self.retry = retry_ms / 1000.0
+
+    async def run(self, func, *args, **kwargs):
+        return await self._retry(self.executor.run, func, *args, **kwargs)
+
+    async def run_cpu(self, func, *args, **kwargs):
+        return await self._retry(self.executor.run_cpu, func, *args, **kwargs)
+
+    async def _retry(self, submit, func, *args, **kwargs):
+        while True:
+            try:
+                return await submit(func, *args, **kwargs)
+            except OverloadedError:
+                await asyncio.sleep(self.retry)
+
+class CoalescingIndexWriter:
+    """
+    Adds embeddings to a FAISSManager on behalf of concurrent ingests.
+    Windows submitted while a commit runs, or within `max_wait` of the
+    first one, are merged into one `add_embeddings` call of up to
+    `max_rows` rows: one WAL append and one index publish for the lot.
+    There is no wait when `max_rows` rows are already queued.
+    """
+    def __init__(self, faiss_manager, executor, max_rows: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self.faiss_manager = faiss_manager
+        self.executor = executor
+        self.max_rows = max_rows or int(os.getenv("INGEST_COMMIT_MAX_ROWS", "2048"))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("INGEST_COMMIT_WAIT_MS", "5"))
+        self.max_wait = max_wait_ms / 1000.0
+        self.commits = 0
+        self.windows = 0
+
+        self._pending: "deque[Tuple[np.ndarray, List[Dict[str, Any]], asyncio.Future]]" = deque()
+        self._pending_rows = 0
+        self._task = None
+
+    async def add_embeddings(self, embeddings: np.ndarray, metadata: List[Dict[str, Any]]):
+        """
+        Queue one window and wait until the commit holding it is done.
+        """
+        entry = (embeddings, metadata, asyncio.get_running_loop().create_future())
+        self._pending.append(entry)
+        self._pending_rows += len(metadata)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            await asyncio.shield(entry[2])
+        except asyncio.CancelledError:
+            if not self._discard(entry):
+                # Already part of a commit: let it land, so the caller's
+                # rollback deletes these rows instead of racing the commit
+                await asyncio.wait([entry[2]])
+            raise
+
+    def _discard(self, entry) -> bool:
+        # Remove a window that is still queued (compared by identity, the
+        # entries hold arrays)
+        for i, pending in enumerate(self._pending):
+            if pending is entry:
+                del self._pending[i]
+                self._pending_rows -= len(entry[1])
+                return True
+        return False
+
+    async def _run(self):
+        try:
+            while self._pending:
+                if self.max_wait > 0 and self._pending_rows < self.max_rows:
+                    await asyncio.sleep(self.max_wait)
+                batch = []
+                rows = 0
+                while self._pending and (not batch or rows + len(self._pending[0][1]) <= self.max_rows):
+                    batch.append(self._pending.popleft())
+                    rows += len(batch[-1][1])
+                self._pending_rows -= rows
+                if batch:
+                    await self._commit(batch)
+        finally:
+            self._task = None
+
+    async def _commit(self, batch: List[Tuple[np.ndarray, List[Dict[str, Any]], asyncio.Future]]):
+        embeddings = np.vstack([window for window, _, _ in batch]) if len(batch) > 1 else batch[0][0]
+        metadata = [row for _, rows, _ in batch for row in rows]
+        try:
+            with span("ingest.commit"):
+                await self.executor.run(self.faiss_manager.add_embeddings, embeddings, metadata)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.commits += 1
+        self.windows += len(batch)
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+class IngestJob:
+    """
+    State of one queued upload, as reported by /ingest/jobs/{job_id}.
+    """
+    def __init__(self, filename: str, path: str, bytes_total: int):
+        self.id = str(uuid.uuid4())
+        self.filename = filename
+        self.path = path
+        self.status = "queued"
+        self.bytes_total = bytes_total
+        self.bytes_processed = 0
+        self.chunks_indexed = 0
+        self.result: Optional[IngestResponse] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def as_dict(self) -> Dict[str, Any]:
+        if self.status == "succeeded" or not self.bytes_total:
+            progress = 1.0 if self.finished else 0.0
+        else:
+            progress = round(self.bytes_processed / self.bytes_total, 4)
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "progress": progress,
+            "bytes_total": self.bytes_total,
+            "bytes_processed": self.bytes_processed,
+            "chunks_indexed": self.chunks_indexed,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result.model_dump() if self.result is not None else None,
+            "error": self.error
+        }
+
+class _SpooledUpload:
+    """
+    The async `read`/`seek` interface DocumentService.ingest_file expects,
+    over a spooled upload. Counts the bytes read by the indexing pass
+    (the one after the validation pass rewinds the file).
+    """
+    def __init__(self, file, job: IngestJob, executor):
+        self.file = file
+        self.job = job
+        self.executor = executor
+        self.indexing = False
+
+    async def read(self, size: int) -> bytes:
+        data = await self.executor.run(self.file.read, size)
+        if self.indexing:
+            self.job.bytes_processed += len(data)
+        return data
+
+    async def seek(self, offset: int):
+        self.file.seek(offset)
+        self.indexing = True
+        self.job.bytes_processed = offset
+
+class IngestJobService:
+    """
+    Background ingest: uploads are spooled to disk and queued, so /ingest
+    can answer 202 with a job id right away. Worker tasks run the same
+    streaming pipeline as a synchronous ingest, and their index windows
+    go through a CoalescingIndexWriter, so a burst of uploads shares
+    index commits. Jobs for the same filename go to the same worker and
+    run in upload order, so the last upload is the version that stays.
+    Jobs live in this process only.
+    """
+    def __init__(
+        self,
+        faiss_manager=None,
+        executor=None,
+        workers: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        history: Optional[int] = None
+    ):
+        # Uploads are spooled on the plain executor (a full queue answers
+        # 503), the jobs themselves wait for room
+        self.upload_executor = executor or default_executor
+        self.executor = _BackgroundExecutor(self.upload_executor)
+        embedding_engine = EmbeddingEngine(executor=self.executor)
+        self.faiss_manager = faiss_manager or FAISSManager(embedding_engine.dimension)
+        self.writer = CoalescingIndexWriter(self.faiss_manager, self.executor)
+        # With PRETRANSLATE_ON_INGEST the document service creates its own
+        # translation service, which then waits for executor room too
+        self.document_service = DocumentService(
+            self.faiss_manager, embedding_engine, self.executor, index_writer=self.writer
+        )
+        self.workers = workers or int(os.getenv("INGEST_JOB_WORKERS", "4"))
+        self.max_queue = max_queue or int(os.getenv("INGEST_QUEUE_MAX", "256"))
+        self.history = history or int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+        self.spool_dir = os.getenv("INGEST_SPOOL_DIR") or None
+        self.read_bytes = self.document_service.read_bytes
+
+        self.jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """
+        Start the worker tasks on the running event loop.
+        """
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.ensure_future(self._work(queue)) for queue in self._queues]
+
+    async def stop(self):
+        """
+        Cancel the workers. Unfinished jobs are marked failed; a running
+        job may have indexed part of its document.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in self.jobs.values():
+            if not job.finished:
+                self._finish(job, "failed", error="Server shut down before the job finished")
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def submit(self, file, filename: str) -> IngestJob:
+        """
+        Spool an upload (anything with async `read(size)`) to disk and
+        queue it. Raises OverloadedError when `max_queue` jobs are waiting.
+        """
+        if not self._tasks:
+            raise RuntimeError("Ingest job workers are not running")
+        if self.queue_depth >= self.max_queue:
+            raise OverloadedError("Ingest queue is full, please retry later")
+
+        fd, path = tempfile.mkstemp(prefix="ingest-", suffix=".txt", dir=self.spool_dir)
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as spool:
+                while True:
+                    data = await file.read(self.read_bytes)
+                    if not data:
+                        break
+                    # Blocking disk write, keep it off the event loop
+                    await self.upload_executor.run(spool.write, data)
+                    size += len(data)
+        except BaseException:
+            os.remove(path)
+            raise
+
+        job = IngestJob(filename, path, size)
+        self.jobs[job.id] = job
+        self._prune()
+        self._queues[zlib.crc32(filename.encode('utf-8')) % len(self._queues)].put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        counts = {status: 0 for status in ("queued", "running", "succeeded", "failed")}
+        for job in list(self.jobs.values()):
+            counts[job.status] += 1
+        return {
+            **counts,
+            "queue_depth": self.queue_depth,
+            "commits": self.writer.commits,
+            "windows": self.writer.windows
+        }
+
+    def _prune(self):
+        # Forget the oldest finished jobs beyond `history`
+        excess = len(self.jobs) - self.history
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:max(excess, 0)]:
+            del self.jobs[job_id]
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            try:
+                await self._process(job)
+            finally:
+                queue.task_done()
+
+    async def _process(self, job: IngestJob):
+        job.status = "running"
+        job.started_at = time.time()
+
+        def progress(chunks_indexed: int):
+            job.chunks_indexed = chunks_indexed
+
+        try:
+            with open(job.path, 'rb') as f:
+                upload = _SpooledUpload(f, job, self.executor)
+                result = await self.document_service.ingest_file(upload, job.filename, progress=progress)
+            self._finish(job, "succeeded", result=result)
+        except UnicodeDecodeError:
+            self._finish(job, "failed", error="File must be valid UTF-8 encoded text")
+        except Exception as e:
+            print(f"Ingest job {job.id} ({job.filename}) failed: {e}")
+            self._finish(job, "failed", error=str(e))
+
+    def _finish(self, job: IngestJob, status: str, result: Optional[IngestResponse] = None, error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
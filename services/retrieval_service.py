@@ -1,35 +1,194 @@
-from typing import List
-from sentence_transformers import SentenceTransformer
-from langdetect import detect
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
 
 from models.schemas import DocumentResponse
 from utils.faiss_manager import FAISSManager
+from utils.embedding_engine import EmbeddingEngine
+from utils.executor import default_executor
+from utils.metrics import span
+from utils.language import detect_language
+from utils.cache import TTLCache, normalize_query
+
+def _filters_key(filters: Optional[Dict[str, str]]) -> tuple:
+    return tuple(sorted((field, value) for field, value in (filters or {}).items() if value is not None))
+
+def _merge_fallback(results: List, fallback: List, top_k: int) -> List:
+    """
+    Fill `results` up to `top_k` with fallback hits it does not already hold.
+    """
+    seen = {(meta['document_id'], meta['chunk_id']) for meta, _ in results}
+    extra = [hit for hit in fallback if (hit[0]['document_id'], hit[0]['chunk_id']) not in seen]
+    return results + extra[:top_k - len(results)]
 
 class RetrievalService:
-    def __init__(self, faiss_manager=None):
-        self.faiss_manager = faiss_manager or FAISSManager()
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, faiss_manager=None, embedding_engine=None, executor=None):
+        self.executor = executor or default_executor
+        self.embedding_engine = embedding_engine or EmbeddingEngine()
+        self.faiss_manager = faiss_manager or FAISSManager(self.embedding_engine.dimension)
+        
+        # Unless a language filter is given, queries search the partition of
+        # their own language first and fall back to all languages when it
+        # has fewer than top_k hits
+        self.partition_by_language = os.getenv("RETRIEVE_LANGUAGE_PARTITION", "true").lower() == "true"
+        # Upper bound on top_k: every query of a batch allocates nq x k
+        # search (and re-rank) results
+        self.max_top_k = int(os.getenv("RETRIEVE_MAX_TOP_K", "50"))
+        
+        # Two-tier cache: normalized query -> embedding, and
+        # (normalized query, top_k, include_duplicates, filters, index version) -> results
+        self.embedding_cache = TTLCache(
+            max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")),
+            ttl=float(os.getenv("EMBEDDING_CACHE_TTL", "3600"))
+        )
+        self.result_cache = TTLCache(
+            max_size=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", "300"))
+        )
         
-    async def retrieve(self, query: str, top_k: int = 3) -> List[DocumentResponse]:
+    async def retrieve(
+        self,
+        query: str,
+        top_k: int = 3,
+        include_duplicates: bool = False,
+        filters: Optional[Dict[str, str]] = None
+    ) -> List[DocumentResponse]:
         """
-        Retrieve top-k relevant documents for a query.
+        Retrieve top-k relevant documents for a query. Near-duplicate chunks
+        are skipped unless `include_duplicates` is set; `filters` (language,
+        document_id, filename, filename_prefix) restrict the search.
+        `top_k` is clamped to 1..RETRIEVE_MAX_TOP_K.
         """
-        # Detect query language
-        try:
-            query_language = detect(query)
-            if query_language in ['ja', 'jp']:
-                query_language = 'ja'
-            else:
-                query_language = 'en'
-        except:
-            query_language = 'en'
+        top_k = self._clamp_top_k(top_k)
+        cache_key = normalize_query(query)
+        
+        # Any ingest bumps the index version, so stale results are never hit
+        # (once this worker has caught up with the others)
+        await self._sync_index()
+        result_key = (cache_key, top_k, include_duplicates, _filters_key(filters), self.faiss_manager.version)
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            return list(cached)
             
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode(query)
+        # Generate query embedding (micro-batched with concurrent queries)
+        query_embedding = self.embedding_cache.get(cache_key)
+        if query_embedding is None:
+            with span("retrieve.encode"):
+                query_embedding = await self.embedding_engine.encode_query(query)
+            self.embedding_cache.set(cache_key, query_embedding)
+        
+        # Search in FAISS, within the query's language partition if enabled
+        partition = dict(filters or {})
+        fallback = self.partition_by_language and not partition.get('language')
+        if fallback:
+            # Detect query language (script-based and memoized, cheap enough inline)
+            with span("retrieve.detect"):
+                partition['language'] = detect_language(query)
+        with span("retrieve.search"):
+            results = await self.executor.run(self.faiss_manager.search, query_embedding, top_k, include_duplicates, partition)
+            if fallback and len(results) < top_k:
+                del partition['language']
+                more = await self.executor.run(self.faiss_manager.search, query_embedding, top_k, include_duplicates, partition)
+                results = _merge_fallback(results, more, top_k)
+        
+        document_responses = self._to_responses(results)
+        self.result_cache.set(result_key, tuple(document_responses))
+        return document_responses
+        
+    async def retrieve_batch(
+        self,
+        queries: List[str],
+        top_ks: List[int],
+        include_duplicates: bool = False,
+        filters: Optional[Dict[str, str]] = None
+    ) -> List[List[DocumentResponse]]:
+        """
+        Retrieve results for many queries with one batched encode and one
+        FAISS search per language partition. `top_ks[i]` (clamped like
+        in `retrieve`) applies to `queries[i]`; `filters` apply to all of them.
+        """
+        top_ks = [self._clamp_top_k(top_k) for top_k in top_ks]
+        await self._sync_index()
+        version = self.faiss_manager.version
+        filters_key = _filters_key(filters)
+        cache_keys = [normalize_query(query) for query in queries]
+        responses: List[Optional[List[DocumentResponse]]] = [None] * len(queries)
+        
+        pending = []
+        for i, (cache_key, top_k) in enumerate(zip(cache_keys, top_ks)):
+            cached = self.result_cache.get((cache_key, top_k, include_duplicates, filters_key, version))
+            if cached is not None:
+                responses[i] = list(cached)
+            else:
+                pending.append(i)
+                
+        if pending:
+            # Encode only queries whose embedding is not cached, in one batch
+            embeddings = {}
+            to_encode = {}
+            for i in pending:
+                if cache_keys[i] in embeddings or cache_keys[i] in to_encode:
+                    continue
+                embedding = self.embedding_cache.get(cache_keys[i])
+                if embedding is None:
+                    to_encode[cache_keys[i]] = queries[i]
+                else:
+                    embeddings[cache_keys[i]] = embedding
+            if to_encode:
+                with span("retrieve.encode"):
+                    encoded = await self.embedding_engine.encode_queries(list(to_encode.values()))
+                for cache_key, embedding in zip(to_encode, encoded):
+                    embeddings[cache_key] = embedding
+                    self.embedding_cache.set(cache_key, embedding)
+                    
+            partition = dict(filters or {})
+            fallback = self.partition_by_language and not partition.get('language')
+            groups = {partition.get('language'): pending}
+            if fallback:
+                # One search per query language
+                groups = {}
+                with span("retrieve.detect"):
+                    for i in pending:
+                        groups.setdefault(detect_language(queries[i]), []).append(i)
+                    
+            results = {}
+            for language, group in groups.items():
+                results.update(zip(group, await self._search_group(
+                    embeddings, cache_keys, top_ks, group, include_duplicates, dict(partition, language=language)
+                )))
+            short = [i for i in pending if len(results[i]) < top_ks[i]] if fallback else []
+            if short:
+                for i, more in zip(short, await self._search_group(
+                    embeddings, cache_keys, top_ks, short, include_duplicates, partition
+                )):
+                    results[i] = _merge_fallback(results[i], more, top_ks[i])
+                    
+            for i in pending:
+                responses[i] = self._to_responses(results[i])
+                self.result_cache.set((cache_keys[i], top_ks[i], include_duplicates, filters_key, version), tuple(responses[i]))
+                
+        return responses
+        
+    def _clamp_top_k(self, top_k: int) -> int:
+        return min(max(1, top_k), self.max_top_k)
         
-        # Search in FAISS
-        results = self.faiss_manager.search(query_embedding, top_k)
+    async def _sync_index(self):
+        """
+        Load the index, and in multi-worker mode pick up other workers'
+        changes, before its version is read for a result cache key.
+        """
+        if self.faiss_manager.multi_worker or not self.faiss_manager.is_loaded:
+            await self.executor.run(self.faiss_manager.ensure_loaded)
         
+    async def _search_group(self, embeddings, cache_keys, top_ks, group, include_duplicates, partition):
+        query_matrix = np.stack([embeddings[cache_keys[i]] for i in group])
+        with span("retrieve.search"):
+            return await self.executor.run(
+                self.faiss_manager.search_batch, query_matrix, [top_ks[i] for i in group], include_duplicates, partition
+            )
+        
+    def _to_responses(self, results) -> List[DocumentResponse]:
         # Convert to response format
         document_responses = []
         for metadata, score in results:
@@ -42,4 +201,10 @@ class RetrievalService:
             )
             document_responses.append(doc_response)
             
-        return document_responses
\ No newline at end of file
+        return document_responses
+        
+    def cache_stats(self):
+        return {
+            "embedding_cache": self.embedding_cache.stats(),
+            "result_cache": self.result_cache.stats()
+        }
\ No newline at end of file
@@ -1,53 +1,104 @@
-from deep_translator import GoogleTranslator
-from typing import Optional
+import os
+from typing import Dict, List, Optional
+
+from utils.executor import default_executor, OverloadedError
+from utils.language import detect_language
+from utils.metrics import span
+from utils.translation_cache import TranslationCache, translation_key
+from utils.translators import create_translator
 
 class TranslationService:
-    def __init__(self):
-        pass
-        
+    def __init__(self, executor=None, translator=None, cache: Optional[TranslationCache] = None):
+        self.executor = executor or default_executor
+        # Pluggable backend (TRANSLATION_BACKEND), e.g. the offline stub for tests
+        self.translator = translator or create_translator()
+        self.cache = cache or TranslationCache(
+            os.getenv("TRANSLATION_CACHE_PATH", "data/translations.sqlite3"),
+            max_bytes=int(os.getenv("TRANSLATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        )
+
     async def translate_text(self, text: str, target_language: str, source_language: Optional[str] = None) -> str:
         """
         Translate text to target language.
-        
+
         Args:
             text: Text to translate
             target_language: Target language code ('en' or 'ja')
             source_language: Source language code (auto-detected if None)
         """
+        return (await self.translate_batch([text], target_language, source_language))[0]
+
+    async def translate_batch(
+        self,
+        texts: List[str],
+        target_language: str,
+        source_language: Optional[str] = None
+    ) -> List[str]:
+        """
+        Translate several texts, serving repeats from the persistent cache.
+        All misses go to the backend together; on failure they fall back to
+        the original texts (which are not cached).
+        """
+        # Map our language codes to Google Translate codes
+        lang_mapping = {
+            'en': 'en',
+            'ja': 'ja'
+        }
+        target_lang = lang_mapping.get(target_language, 'en')
+        source_lang = lang_mapping.get(source_language, 'auto') if source_language else 'auto'
+
+        keys = [translation_key(text, source_lang, target_lang) for text in texts]
         try:
-            # Map our language codes to Google Translate codes
-            lang_mapping = {
-                'en': 'en',
-                'ja': 'ja'
-            }
-            
-            target_lang = lang_mapping.get(target_language, 'en')
-            source_lang = lang_mapping.get(source_language, 'auto') if source_language else 'auto'
-            
-            translator = GoogleTranslator(source=source_lang, target=target_lang)
-            result = translator.translate(text)
-            
-            return result
-            
+            # SQLite lookup, keep it off the event loop
+            with span("translate.cache"):
+                cached = await self.executor.run(self.cache.get_many, keys)
+        except OverloadedError:
+            raise
+        except Exception as e:
+            print(f"Translation cache lookup failed: {e}")
+            cached = {}
+
+        misses: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and text.strip():
+                misses[key] = text
+        if misses:
+            cached.update(await self._translate_misses(misses, source_lang, target_lang))
+
+        return [cached.get(key, text) for key, text in zip(keys, texts)]
+
+    async def _translate_misses(self, misses: Dict[str, str], source_lang: str, target_lang: str) -> Dict[str, str]:
+        try:
+            # Blocking HTTP call, keep it off the event loop
+            with span("translate.backend"):
+                results = await self.executor.run(
+                    self.translator.translate_batch, list(misses.values()), source_lang, target_lang
+                )
+        except OverloadedError:
+            raise
         except Exception as e:
             # Fallback: return original text if translation fails
             print(f"Translation failed: {e}")
-            return text
-            
+            return {}
+
+        translated = {key: result for key, result in zip(misses, results) if result}
+        try:
+            with span("translate.cache_write"):
+                await self.executor.run(self.cache.set_many, list(translated.items()))
+        except OverloadedError:
+            raise
+        except Exception as e:
+            print(f"Translation cache write failed: {e}")
+        return translated
+
+    def cache_stats(self) -> Dict[str, int]:
+        """
+        Translation cache size and hit/miss/eviction counts.
+        """
+        return self.cache.stats()
+
     def detect_language(self, text: str) -> str:
         """
-        Detect the language of the given text using langdetect.
+        Detect the language of the given text ('en' or 'ja').
         """
-        try:
-            from langdetect import detect
-            detected_lang = detect(text)
-            
-            # Map to our supported languages
-            if detected_lang in ['ja', 'jp']:
-                return 'ja'
-            else:
-                return 'en'
-                
-        except Exception as e:
-            print(f"Language detection failed: {e}")
-            return 'en'  # Default to English
\ No newline at end of file
+        return detect_language(text)
@@ -0,0 +1,125 @@
+import asyncio
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.model_registry import model_registry
+from utils.executor import default_executor
+
+
+class EmbeddingEngine:
+    """
+    Batched embedding engine shared by ingest and retrieval.
+
+    Document chunk lists are encoded in sized batches, and concurrent query
+    encodes are coalesced into short micro-batches. The model, an embedder
+    from utils.embedders, is resolved through the shared registry on first
+    use unless one is passed in.
+    """
+    def __init__(
+        self,
+        model=None,
+        model_name: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        executor=None
+    ):
+        self._model = model
+        self.executor = executor or default_executor
+        self.model_name = model_name
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+        self.max_wait = max_wait_ms / 1000.0
+
+        # Queries waiting for the next micro-batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = model_registry.get_model(self.model_name)
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.dimension
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode a list of texts in batches of `batch_size`.
+        Returns a float32 array of shape (len(texts), dimension).
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+
+        return self.model.encode(texts, batch_size=self.batch_size)
+
+    async def encode_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode all chunks of a document off the event loop.
+        """
+        return await self.executor.run(self.encode_batch, texts)
+
+    async def encode_queries(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode a known batch of queries in one call, bypassing the micro-batcher.
+        """
+        return await self.executor.run(self.encode_batch, texts)
+
+    async def encode_query(self, text: str) -> np.ndarray:
+        """
+        Encode a single query, sharing a forward pass with any other
+        queries that arrive within `max_wait` of it.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """
+        Hand the pending queries to a batch encode.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        if self._pending:
+            # Leftovers start a new micro-batch window
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        if batch:
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """
+        Encode one micro-batch and resolve the waiting futures.
+        Identical query strings are only encoded once.
+        """
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = await self.executor.run(self.encode_batch, unique_texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        positions = {text: i for i, text in enumerate(unique_texts)}
+        for text, future in batch:
+            if not future.done():
+                future.set_result(embeddings[positions[text]])
@@ -0,0 +1,97 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Optional
+
+
+class OverloadedError(Exception):
+    """Raised when the executor already holds `max_queue` tasks."""
+
+
+class TaskExecutor:
+    """
+    Runs blocking work off the asyncio event loop.
+
+    `run` uses a thread pool, which suits numpy/faiss/torch calls that release
+    the GIL and blocking network I/O. `run_cpu` uses a process pool for
+    pure-Python work (chunking, language detection) when one is configured,
+    and falls back to the thread pool otherwise. Both share one bounded
+    in-flight counter; once it is full, new tasks raise OverloadedError
+    instead of queueing without limit.
+    """
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        max_queue: Optional[int] = None
+    ):
+        self.max_workers = max_workers or int(os.getenv("EXECUTOR_THREADS", str(min(32, (os.cpu_count() or 1) + 4))))
+        if process_workers is None:
+            process_workers = int(os.getenv("EXECUTOR_PROCESSES", "0"))
+        self.process_workers = process_workers
+        self.max_queue = max_queue or int(os.getenv("EXECUTOR_MAX_QUEUE", "256"))
+
+        self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="executor")
+        self._processes = None
+        self._process_lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._in_flight
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """
+        Run `func` in the thread pool.
+        """
+        return await self._submit(self._threads, func, *args, **kwargs)
+
+    async def run_cpu(self, func: Callable, *args, **kwargs):
+        """
+        Run a picklable module-level `func` in the process pool, or in the
+        thread pool when no process workers are configured.
+        """
+        pool = self._get_process_pool() or self._threads
+        return await self._submit(pool, func, *args, **kwargs)
+
+    async def _submit(self, pool, func: Callable, *args, **kwargs):
+        with self._in_flight_lock:
+            if self._in_flight >= self.max_queue:
+                raise OverloadedError("Server is overloaded, please retry later")
+            self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(func, *args, **kwargs)
+            if pool is self._threads:
+                # Timing spans in the thread count towards the calling request
+                call = functools.partial(contextvars.copy_context().run, call)
+            return await loop.run_in_executor(pool, call)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    def _get_process_pool(self):
+        if self.process_workers <= 0:
+            return None
+        if self._processes is None:
+            with self._process_lock:
+                if self._processes is None:
+                    # spawn avoids forking a process that already runs torch threads
+                    self._processes = ProcessPoolExecutor(
+                        max_workers=self.process_workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._processes
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False)
+
+
+default_executor = TaskExecutor()
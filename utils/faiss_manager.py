@@ -1,120 +1,1118 @@
 import faiss
 import numpy as np
-from typing import List, Tuple, Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import glob
+import json
 import pickle
 import os
+import threading
+import time
+
+from utils.cache import TTLCache
+from utils.file_lock import FileLock
+from utils.index_view import IndexView
+from utils.wal import WriteAheadLog
+from utils.metadata_store import MetadataStore
+from utils.metrics import span, timed
+from utils.vector_store import VectorStore
+from utils.near_duplicates import NearDuplicateIndex, near_duplicate_text, simhash
+from utils.index_factory import (
+    INDEX_TYPES, QUANTIZED_TYPES, build_index, extract_vectors, index_type_of, read_index,
+    reconstruct_rows, search_parameters, set_search_params, train_and_fill, training_threshold
+)
 
 class FAISSManager:
-    def __init__(self, dimension: int = 384):
+    def __init__(
+        self,
+        dimension: int = 384,
+        autoload: bool = True,
+        index_type: Optional[str] = None,
+        dimension_source: Optional[Callable[[], int]] = None
+    ):
+        # With `dimension_source` (the embedder's dimension), `dimension` is
+        # replaced by its value when the index is loaded, so a lazily loaded
+        # model is not loaded just to build the manager
         self.dimension = dimension
-        self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-        self.metadata_store = []  # Store document metadata
+        self._dimension_source = dimension_source
+        
+        # Configured index type; types that need training start out as a flat
+        # index and are migrated once enough vectors exist
+        self.index_type = index_type or os.getenv("FAISS_INDEX_TYPE", "flat")
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown FAISS_INDEX_TYPE '{self.index_type}', expected one of {INDEX_TYPES}")
+        self.nprobe = int(os.getenv("FAISS_NPROBE", "16"))
+        self.ef_search = int(os.getenv("FAISS_EF_SEARCH", "64"))
+        self.index = self._new_index()  # Inner product for cosine similarity
+        
+        # Once published, the base index is never added to: vectors ingested
+        # since it was built go to small flat delta segments until the next
+        # compaction. With FAISS_MMAP the snapshot base is memory-mapped.
+        self.mmap = os.getenv("FAISS_MMAP", "false").lower() == "true"
+        self.deltas: Tuple[faiss.Index, ...] = ()
+        self._index_mmapped = False
+        # Delta segments are copied when merged; up to this many rows they
+        # are always kept in one segment, beyond it merges halve their count
+        self.delta_merge_rows = int(os.getenv("FAISS_DELTA_MERGE_ROWS", "4096"))
+        self.metadata_store = MetadataStore()  # Columnar chunk metadata, row id == vector id
         
         # Create data directory if it doesn't exist
         self.data_dir = "data"
         os.makedirs(self.data_dir, exist_ok=True)
         
-        self.index_file = os.path.join(self.data_dir, "faiss_index.bin")
-        self.metadata_file = os.path.join(self.data_dir, "metadata.pkl")
+        # Snapshots are versioned: each generation has its own index and
+        # metadata files, and the manifest names the current one
+        self.manifest_file = os.path.join(self.data_dir, "snapshot.json")
+        self.legacy_metadata_file = os.path.join(self.data_dir, "metadata.pkl")
+        self.purge_marker = os.path.join(self.data_dir, "purge.pending")
+        self._use_snapshot(self._read_manifest())
+        
+        # Writers in any process (API workers, bulk ingest) serialize on this
+        # lock and catch up with the WAL first; loads and refreshes share it.
+        # Only one process at a time compacts, migrates or purges.
+        self.index_lock = FileLock(os.path.join(self.data_dir, "index.lock"))
+        self.maintenance_lock = FileLock(os.path.join(self.data_dir, "maintenance.lock"))
+        # With several workers, each one polls for new WAL records and
+        # snapshots at most every `refresh_interval` seconds
+        self.multi_worker = os.getenv("FAISS_MULTI_WORKER", "false").lower() == "true"
+        self.refresh_interval = float(os.getenv("FAISS_REFRESH_INTERVAL", "1.0"))
+        self._last_refresh = 0.0
+        
+        # Quantized indexes keep the float vectors on disk to re-rank the
+        # top `rerank_factor * k` candidates with exact scores
+        self.rerank_factor = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+        self.vector_store = None
+        if self.index_type in QUANTIZED_TYPES and self.rerank_factor > 0:
+            self.vector_store = VectorStore(self.vectors_file, dimension)
+        
+        # New documents are appended to the WAL; the snapshot files above are
+        # only rewritten by compaction once the log grows past this size
+        self.wal = WriteAheadLog(self.data_dir)
+        self.compact_bytes = int(os.getenv("WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+        self._compact_lock = threading.Lock()
+        self._compacting = False
+        self._migrate_lock = threading.Lock()
+        self._migrating = False
+        # Deleted documents stay in the index as tombstones, filtered at
+        # search time, until this fraction of rows is dead and a background
+        # purge rebuilds the index without them
+        self.garbage_ratio = float(os.getenv("FAISS_GARBAGE_RATIO", "0.2"))
+        self._purging = False
+        # Bulk loaders turn this off and migrate/compact once at the end
+        self.auto_maintenance = True
+        
+        # Chunks whose SimHash is within this many bits of an earlier chunk,
+        # and whose text differs from it by at most this fraction of tokens
+        # (none of them numbers or negations), are linked to it at ingest
+        # and left out of search results unless duplicates are requested
+        # (negative distance disables linking)
+        self.near_duplicate_distance = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+        self.near_duplicate_max_change = float(os.getenv("NEAR_DUPLICATE_MAX_CHANGE", "0.15"))
+        self._near_duplicates = None  # Built on first ingest
+        # Set when rows' deleted / duplicate_of values change in place
+        self._rows_changed = False
+        # (canonical_only, partition, ...) -> (view version, filter)
+        self._search_filters = TTLCache(max_size=64, ttl=float('inf'))
+        
+        # Searches restricted to a partition (language, filename, document)
+        # of at most this many rows score those rows directly instead of
+        # going through the index
+        self.exact_scan_rows = int(os.getenv("FAISS_EXACT_SCAN_ROWS", "2048"))
+        
+        # Bumped whenever search results may change; used as a cache key
+        self.version = 0
+        # Position in the WAL up to which records are applied
+        self._wal_cursor = (0, 0)
+        
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        # Guards the writer-side state below; searches take no lock and run
+        # against the published view instead
+        self._lock = threading.RLock()
+        # Held by writers for a whole write, and by a purge while it renumbers
+        # rows
+        self._write_lock = threading.Lock()
+        self._view = None
+        self._publish()
+        
+        # Load existing index if available (deferred when autoload is False)
+        if autoload:
+            self.ensure_loaded()
+            
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+        
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal + sum(delta.ntotal for delta in self.deltas)
         
-        # Load existing index if available
-        self._load_index()
+    def _publish(self):
+        """
+        Make the writer-side state visible to searches as a new view. Called
+        by writers, under `_lock`, once a change is complete.
+        """
+        count = self.ntotal
+        store = self.metadata_store
+        old = self._view
+        if old is not None and old.metadata_store is store and old.ntotal <= count and not self._rows_changed:
+            # Only rows were appended: extend the old masks
+            live = np.concatenate([old.live, store.column_values('deleted', count, start=old.ntotal) == 0])
+            canonical = np.concatenate([old.canonical, store.column_values('duplicate_of', count, start=old.ntotal) < 0])
+        else:
+            live = store.column_values('deleted', count) == 0
+            canonical = store.column_values('duplicate_of', count) < 0
+        self._rows_changed = False
+        self.version += 1
+        self._view = IndexView(self.index, self.deltas, store, self.vector_store, live, canonical, self.version)
         
+    def ensure_loaded(self):
+        """
+        Load the on-disk index once; later calls are no-ops.
+        """
+        if self._loaded:
+            self.refresh()
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._load_index()
+                self._loaded = True
+                
+    def refresh(self):
+        """
+        Pick up what other worker processes wrote: apply new WAL records, or
+        swap to a newer snapshot. Rate-limited, and skipped while this
+        process is writing or another one holds the index exclusively.
+        """
+        if not self.multi_worker or not self._loaded:
+            return
+        now = time.monotonic()
+        if now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+        if self.wal.end() == self._wal_cursor and self._manifest_stamp() == self._snapshot_stamp:
+            return
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            with self.index_lock.acquire(exclusive=False, blocking=False) as locked:
+                if locked:
+                    self._catch_up()
+        finally:
+            self._write_lock.release()
+            
+    def _catch_up(self):
+        """
+        Bring this process up to date with the shared files. Called with the
+        write lock and the index lock held.
+        """
+        manifest = self._read_manifest()
+        if manifest['generation'] != self.generation:
+            self._reload()
+        elif self._apply_wal():
+            with self._lock:
+                self._publish()
+                
+    @timed("faiss.reload")
+    def _reload(self):
+        """
+        Load the current snapshot and WAL aside, then swap them in at once;
+        searches keep using the old state meanwhile.
+        """
+        fresh = FAISSManager(self.dimension, autoload=False, index_type=self.index_type)
+        fresh.nprobe, fresh.ef_search = self.nprobe, self.ef_search
+        fresh._load_state()
+        set_search_params(fresh.index, self.nprobe, self.ef_search)
+        with self._lock:
+            for name in ('index', 'deltas', '_index_mmapped', 'metadata_store', 'vector_store', '_wal_cursor',
+                         'generation', 'index_file', 'metadata_file', 'vectors_file', 'wal_segment', '_snapshot_stamp'):
+                setattr(self, name, getattr(fresh, name))
+            self._near_duplicates = None
+            self._publish()
+        print(f"Switched to index snapshot generation {self.generation} with {self.ntotal} vectors")
+        
+    @timed("faiss.add")
     def add_embeddings(self, embeddings: np.ndarray, metadata: List[Dict[str, Any]]):
         """
         Add embeddings and their metadata to the FAISS index.
         """
+        self.ensure_loaded()
+        
         # Normalize embeddings for cosine similarity
         faiss.normalize_L2(embeddings)
         
-        # Add to index
-        self.index.add(embeddings)
+        signatures = None
+        if self.near_duplicate_distance >= 0:
+            # Bulk loaders may precompute signatures in worker processes
+            signatures = [meta['simhash'] if 'simhash' in meta else simhash(meta['content']) for meta in metadata]
+        elif any(meta.get('translation') for meta in metadata):
+            # Pre-translations are looked up by the SimHash of their chunk
+            for meta in metadata:
+                if 'simhash' not in meta:
+                    meta['simhash'] = simhash(meta['content'])
         
-        # Store metadata
-        self.metadata_store.extend(metadata)
+        with self._write_lock, self.index_lock.acquire():
+            self._catch_up()
+            self._append(embeddings, metadata, signatures)
+            
+        if self.auto_maintenance and not self._maybe_migrate():
+            self._maybe_compact()
+            
+    def _append(self, embeddings: np.ndarray, metadata: List[Dict[str, Any]], signatures: Optional[List[int]]):
+        with self._lock:
+            start_id = self.ntotal
+            if signatures is not None:
+                self._link_duplicates(start_id, metadata, signatures)
+            
+            # Add to index
+            self._add_to_index(embeddings)
+            if self.vector_store is not None:
+                self.vector_store.append(embeddings)
+            
+            # Store metadata
+            self.metadata_store.extend(metadata)
+            
+            # Persist only the new document
+            with span("faiss.wal"):
+                self._wal_cursor = self.wal.append(start_id, embeddings, metadata)
+            self._publish()
+            
+    @timed("faiss.delete")
+    def delete_document(self, document_id: str) -> int:
+        """
+        Delete a document's chunks. They are tombstoned and skipped by
+        searches right away; the vectors are removed by the next purge.
+        Returns the number of chunks deleted (0 if the document is unknown).
+        """
+        self.ensure_loaded()
+        
+        with self._write_lock, self.index_lock.acquire():
+            self._catch_up()
+            with self._lock:
+                rows = self._delete_rows(document_id)
+                if not rows:
+                    return 0
+                self._wal_cursor = self.wal.append_tombstone(self.ntotal, document_id)
+                self._publish()
+            
+        if self.auto_maintenance:
+            self._maybe_purge()
+        return len(rows)
         
-        # Save to disk
-        self._save_index()
+    def _delete_rows(self, document_id: str) -> List[int]:
+        """
+        Tombstone a document's rows and re-link chunks that near-duplicated
+        one of them, so they are not hidden behind a deleted chunk.
+        """
+        rows = self.metadata_store.delete_document(document_id)
+        if not rows:
+            return rows
+        self._rows_changed = True
+        if self.near_duplicate_distance < 0:
+            return rows
+        near_duplicates = self._near_duplicate_index()
+        for row in rows:
+            near_duplicates.remove(row)
+            
+        duplicate_of = self.metadata_store.column_values('duplicate_of')
+        deleted = self.metadata_store.column_values('deleted')
+        orphans = np.flatnonzero(np.isin(duplicate_of, rows) & (deleted == 0))
+        signatures = self.metadata_store.column_values('simhashes')
+        for row in orphans:
+            signature = int(signatures[row])
+            text = self.metadata_store.get_content(row)
+            canonical = near_duplicates.find(
+                signature, lambda other: self._same_chunk(self.metadata_store.get_content(other), text)
+            )
+            self.metadata_store.set_value('duplicate_of', row, -1 if canonical is None else canonical)
+            if canonical is None:
+                near_duplicates.add(int(row), signature)
+        return rows
         
-    def search(self, query_embedding: np.ndarray, top_k: int = 3) -> List[Tuple[Dict[str, Any], float]]:
+    def _link_duplicates(self, start_id: int, metadata: List[Dict[str, Any]], signatures: List[int]):
+        """
+        Record each new chunk's SimHash and the canonical chunk it
+        near-duplicates ('simhash' / 'duplicate_of' in its metadata).
+        """
+        near_duplicates = self._near_duplicate_index()
+        
+        def content(row: int) -> str:
+            return metadata[row - start_id]['content'] if row >= start_id else self.metadata_store.get_content(row)
+            
+        for row, (meta, signature) in enumerate(zip(metadata, signatures), start_id):
+            canonical = near_duplicates.find(signature, lambda found: self._same_chunk(content(found), meta['content']))
+            meta['simhash'] = signature
+            meta['duplicate_of'] = canonical
+            if canonical is None:
+                near_duplicates.add(row, signature)
+                
+    def _same_chunk(self, a: str, b: str) -> bool:
+        return near_duplicate_text(a, b, self.near_duplicate_max_change)
+        
+    def _near_duplicate_index(self) -> NearDuplicateIndex:
+        """
+        LSH index of the canonical chunks, built from the metadata store on
+        first use. Rows from older stores without a SimHash are hashed and
+        linked here, in ingest order, and links that fail the text check
+        (made by older rules or settings) are undone.
+        """
+        if self._near_duplicates is not None:
+            return self._near_duplicates
+        near_duplicates = NearDuplicateIndex(max(self.near_duplicate_distance, 0))
+        signatures = self.metadata_store.column_values('simhashes')
+        duplicate_of = self.metadata_store.column_values('duplicate_of')
+        deleted = self.metadata_store.column_values('deleted')
+        content = self.metadata_store.get_content
+        backfilled = unlinked = 0
+        for row in range(len(signatures)):
+            if deleted[row]:
+                continue
+            signature, canonical = int(signatures[row]), int(duplicate_of[row])
+            if canonical >= 0 and not self._same_chunk(content(canonical), content(row)):
+                canonical = -1
+                self.metadata_store.set_value('duplicate_of', row, canonical)
+                unlinked += 1
+            if not signature:
+                text = content(row)
+                signature = simhash(text)
+                self.metadata_store.set_value('simhashes', row, signature)
+                if canonical < 0:
+                    found = near_duplicates.find(signature, lambda other: self._same_chunk(content(other), text))
+                    if found is not None:
+                        canonical = found
+                        self.metadata_store.set_value('duplicate_of', row, canonical)
+                backfilled += 1
+            if canonical < 0:
+                near_duplicates.add(row, signature)
+        if backfilled:
+            print(f"Computed near-duplicate signatures for {backfilled} chunks")
+        if unlinked:
+            print(f"Unlinked {unlinked} near-duplicate chunks that fail the text check against their canonical chunk")
+        if backfilled or unlinked:
+            self._rows_changed = True
+        self._near_duplicates = near_duplicates
+        return near_duplicates
+        
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 3,
+        include_duplicates: bool = False,
+        partition: Optional[Dict[str, str]] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
         """
         Search for similar embeddings and return metadata with scores.
         """
-        if self.index.ntotal == 0:
-            return []
+        return self.search_batch(query_embedding.reshape(1, -1), [top_k], include_duplicates, partition)[0]
+        
+    @timed("faiss.search")
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_ks: List[int],
+        include_duplicates: bool = False,
+        partition: Optional[Dict[str, str]] = None
+    ) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        Search many queries with one index call. `top_ks[i]` is the number of
+        results wanted for query i; deleted chunks, and near-duplicate
+        chunks unless `include_duplicates` is set, are excluded by the index
+        itself. `partition` restricts the search to chunks matching all of
+        its fields: language, document_id, filename, filename_prefix.
+        """
+        self.ensure_loaded()
+        # Pin the current view; writers publish new ones meanwhile
+        view = self._view
+        
+        if view.ntotal == 0 or not len(top_ks):
+            return [[] for _ in top_ks]
             
-        # Normalize query embedding
-        query_embedding = query_embedding.reshape(1, -1).astype('float32')
-        faiss.normalize_L2(query_embedding)
+        # Normalize query embeddings
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32').reshape(len(top_ks), -1).copy()
+        faiss.normalize_L2(query_embeddings)
         
-        # Search for more results to allow for deduplication
-        search_k = min(top_k * 3, self.index.ntotal)
-        scores, indices = self.index.search(query_embedding, search_k)
+        search_k = min(max(top_ks), view.ntotal)
+        scores, indices = self._search_ids(
+            view, query_embeddings, search_k, canonical_only=not include_duplicates, partition=partition
+        )
         
-        # Deduplicate results by content similarity
         results = []
-        seen_content = set()
+        for row, top_k in enumerate(top_ks):
+            keep = indices[row] >= 0
+            results.append([
+                (view.metadata_store[int(idx)], float(score))
+                for score, idx in zip(scores[row][keep][:top_k], indices[row][keep][:top_k])
+            ])
+        return results
         
-        for score, idx in zip(scores[0], indices[0]):
-            if idx != -1 and idx < len(self.metadata_store):
-                metadata = self.metadata_store[idx]
-                content = metadata['content']
-                
-                # Simple deduplication by checking if content is too similar
-                content_key = content[:100].strip()  # Use first 100 chars as key
-                
-                if content_key not in seen_content and len(content.strip()) > 50:
-                    results.append((metadata, float(score)))
-                    seen_content.add(content_key)
+    def _add_to_index(self, embeddings: np.ndarray):
+        """
+        Append vectors as delta rows. A segment that is part of the published
+        view is never added to: the vectors start a new segment instead, and
+        trailing segments are merged into a copy while they are small or the
+        last one is at least as large as the one before, so O(log n)
+        segments remain.
+        """
+        deltas = list(self.deltas)
+        if deltas and not any(deltas[-1] is delta for delta in self._view.deltas):
+            deltas[-1].add(embeddings)
+        else:
+            segment = faiss.IndexFlatIP(self.dimension)
+            segment.add(embeddings)
+            deltas.append(segment)
+        while len(deltas) > 1 and (deltas[-2].ntotal <= deltas[-1].ntotal
+                                   or deltas[-2].ntotal + deltas[-1].ntotal <= self.delta_merge_rows):
+            last = deltas.pop()
+            if any(deltas[-1] is delta for delta in self._view.deltas):
+                merged = faiss.IndexFlatIP(self.dimension)
+                merged.add(extract_vectors(deltas[-1]))
+                deltas[-1] = merged
+            deltas[-1].add(extract_vectors(last))
+        self.deltas = tuple(deltas)
+            
+    def _search_filter(self, view: IndexView, canonical_only: bool, partition: Optional[Tuple] = None) -> Optional[Dict[str, Any]]:
+        """
+        Per-segment search parameters that skip deleted rows, near-duplicate
+        rows if `canonical_only` and rows outside `partition` (sorted
+        (field, value) pairs), or None when there are none. Small partitions
+        get their row ids instead. Built once per view.
+        """
+        key = (canonical_only, partition, self.nprobe, self.ef_search)
+        cached = self._search_filters.get(key)
+        if cached is not None and cached[0] == view.version:
+            return cached[1]
+            
+        allowed = view.live.copy()
+        if canonical_only:
+            allowed &= view.canonical
+        if partition:
+            allowed &= view.metadata_store.partition_mask(view.ntotal, **dict(partition))
+        search_filter = None
+        if partition and allowed.sum() <= self.exact_scan_rows:
+            search_filter = {'rows': np.flatnonzero(allowed)}
+        elif not allowed.all():
+            # Bitmaps are referenced by the selectors
+            bitmaps = [np.packbits(allowed[start:start + index.ntotal], bitorder='little')
+                       for index, start in view.segments()]
+            search_filter = {
+                'allowed': allowed,
+                'bitmaps': bitmaps,
+                'params': [search_parameters(index, bitmap) if index.ntotal else None
+                           for (index, _), bitmap in zip(view.segments(), bitmaps)]
+            }
+        self._search_filters.set(key, (view.version, search_filter))
+        return search_filter
+        
+    def _filtered_search(self, index: faiss.Index, queries: np.ndarray, k: int, params, allowed: Optional[np.ndarray]):
+        """
+        Search one index, keeping only ids set in `allowed` (local to the
+        index). Indexes without selector support are searched with a growing
+        k and filtered afterwards.
+        """
+        if allowed is None:
+            return index.search(queries, k)
+        if params is not None:
+            return index.search(queries, k, params=params)
+        fetch = k
+        while True:
+            fetch = min(fetch * 2, index.ntotal)
+            scores, ids = index.search(queries, fetch)
+            keep = (ids >= 0) & allowed[np.maximum(ids, 0)]
+            if fetch == index.ntotal or (keep.sum(axis=1) >= k).all():
+                break
+        order = np.argsort(~keep, axis=1, kind='stable')[:, :k]
+        scores = np.take_along_axis(np.where(keep, scores, -np.inf), order, axis=1)
+        ids = np.take_along_axis(np.where(keep, ids, -1), order, axis=1)
+        return scores, ids
+        
+    def _search_ids(
+        self,
+        view: IndexView,
+        queries: np.ndarray,
+        k: int,
+        canonical_only: bool = True,
+        partition: Optional[Dict[str, str]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the base index and the delta segments of `view`, merge by
+        score and, for quantized indexes, re-rank the candidates with the
+        exact float vectors.
+        """
+        partition_key = tuple(sorted((field, value) for field, value in (partition or {}).items() if value is not None))
+        search_filter = self._search_filter(view, canonical_only, partition_key or None)
+        if search_filter is not None and 'rows' in search_filter:
+            return self._exact_search(view, queries, k, search_filter['rows'])
+            
+        fetch = k * self.rerank_factor if view.vector_store is not None else k
+        fetch = min(fetch, view.ntotal)
+        
+        all_scores, all_ids = [], []
+        for i, (index, start) in enumerate(view.segments()):
+            if not index.ntotal:
+                continue
+            segment_scores, segment_ids = self._filtered_search(
+                index, queries, min(fetch, index.ntotal),
+                search_filter and search_filter['params'][i],
+                search_filter and search_filter['allowed'][start:start + index.ntotal]
+            )
+            all_scores.append(segment_scores)
+            all_ids.append(np.where(segment_ids >= 0, segment_ids + start, -1) if start else segment_ids)
+        scores = np.concatenate(all_scores, axis=1)
+        ids = np.concatenate(all_ids, axis=1)
+        if len(all_scores) > 1:
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :fetch]
+            scores = np.take_along_axis(scores, order, axis=1)
+            ids = np.take_along_axis(ids, order, axis=1)
+            
+        if view.vector_store is not None:
+            valid = ids >= 0
+            exact = np.full(scores.shape, -np.inf, dtype='float32')
+            rows = np.repeat(queries, valid.sum(axis=1), axis=0)
+            exact[valid] = np.einsum('ij,ij->i', view.vector_store.get(ids[valid]), rows)
+            order = np.argsort(-exact, axis=1, kind='stable')
+            scores = np.take_along_axis(exact, order, axis=1)
+            ids = np.where(np.isfinite(scores), np.take_along_axis(ids, order, axis=1), -1)
+            
+        return scores[:, :k], ids[:, :k]
+        
+    def _exact_search(self, view: IndexView, queries: np.ndarray, k: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score `rows` directly; cost is proportional to the partition size.
+        """
+        scores = np.full((len(queries), k), -np.inf, dtype='float32')
+        ids = np.full((len(queries), k), -1, dtype='int64')
+        if not len(rows):
+            return scores, ids
+        found = min(k, len(rows))
+        row_scores = queries @ self._vectors_at(view, rows).T
+        top = np.argpartition(-row_scores, found - 1, axis=1)[:, :found]
+        order = np.argsort(-np.take_along_axis(row_scores, top, axis=1), axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        scores[:, :found] = np.take_along_axis(row_scores, top, axis=1)
+        ids[:, :found] = rows[top]
+        return scores, ids
+        
+    def _vectors_at(self, view: IndexView, rows: np.ndarray) -> np.ndarray:
+        """
+        Float vectors for the given ids, exact when the vector store is kept.
+        """
+        if view.vector_store is not None and len(view.vector_store) >= view.ntotal:
+            return view.vector_store.get(rows)
+        vectors = np.empty((len(rows), self.dimension), dtype='float32')
+        for index, start in view.segments():
+            inside = (rows >= start) & (rows < start + index.ntotal)
+            if inside.any():
+                vectors[inside] = reconstruct_rows(index, rows[inside] - start)
+        return vectors
+        
+    def _vectors(self, start: int = 0) -> np.ndarray:
+        """
+        Float vectors for ids `start`..ntotal of the writer-side state,
+        exact when the vector store is kept.
+        """
+        if self.vector_store is not None and len(self.vector_store) == self.ntotal:
+            return self.vector_store.get_range(start, self.ntotal)
+        parts = [np.zeros((0, self.dimension), dtype='float32')]
+        offset = 0
+        for index in (self.index,) + self.deltas:
+            parts.append(extract_vectors(index, max(0, start - offset)))
+            offset += index.ntotal
+        return np.concatenate(parts)
+        
+    def _new_index(self) -> faiss.Index:
+        if training_threshold(self.index_type):
+            return faiss.IndexFlatIP(self.dimension)
+        return build_index(self.index_type, self.dimension)
+        
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """
+        Tune recall vs. latency at runtime (IVF nprobe, HNSW efSearch).
+        """
+        with self._lock:
+            self.nprobe = nprobe or self.nprobe
+            self.ef_search = ef_search or self.ef_search
+            set_search_params(self.index, self.nprobe, self.ef_search)
+            
+    def _maybe_migrate(self) -> bool:
+        """
+        Start a background migration to the configured index type once
+        enough vectors exist to train it. Returns True if one was started.
+        """
+        if self._migrating or index_type_of(self.index) == self.index_type:
+            return False
+        if self.ntotal < training_threshold(self.index_type):
+            return False
+        self._migrating = True
+        threading.Thread(target=self.migrate, name="faiss-migration", daemon=True).start()
+        return True
+        
+    @timed("faiss.migrate")
+    def migrate(self, index_type: Optional[str] = None):
+        """
+        Rebuild the index as `index_type` (default: the configured type),
+        training it if needed, and snapshot the result. Searches keep using
+        the old index while the new one is trained.
+        """
+        index_type = index_type or self.index_type
+        with self.maintenance_lock.acquire(blocking=False) as acquired:
+            if not acquired:
+                # Another process is maintaining the shared index
+                self._migrating = False
+                return
+            with self._migrate_lock:
+                try:
+                    with self._write_lock, self.index_lock.acquire():
+                        self._catch_up()
+                        with self._lock:
+                            vectors = self._vectors()
+                            count = self.ntotal
+                        
+                    new_index = build_index(index_type, self.dimension, num_vectors=count)
+                    train_and_fill(new_index, vectors)
                     
-                    # Stop when we have enough unique results
-                    if len(results) >= top_k:
-                        break
+                    with self._write_lock, self.index_lock.acquire():
+                        # Catch up with documents ingested during training
+                        self._catch_up()
+                        with self._lock:
+                            new_index.add(self._vectors(start=count))
+                            set_search_params(new_index, self.nprobe, self.ef_search)
+                            self.index = new_index
+                            self.deltas = ()
+                            self._index_mmapped = False
+                            self.index_type = index_type
+                            self._publish()
+                        
+                    print(f"Migrated index to {index_type} with {new_index.ntotal} vectors")
+                except Exception as e:
+                    print(f"Error migrating index: {e}")
+                    return
+                finally:
+                    self._migrating = False
+                    
+            self.compact()
+        
+    def _maybe_compact(self):
+        """
+        Start a background compaction once the WAL is large enough.
+        """
+        if self._compacting or self.wal.size_bytes < self.compact_bytes:
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name="faiss-compaction", daemon=True).start()
+        
+    @timed("faiss.compact")
+    def compact(self):
+        """
+        Fold the WAL into a fresh snapshot and delete the sealed segments.
+        Ingests keep appending to a new segment while the snapshot is written.
+        """
+        with self.maintenance_lock.acquire(blocking=False) as acquired, self._compact_lock:
+            try:
+                if not acquired:
+                    # Another process is maintaining the shared index
+                    return
+                with self._write_lock, self.index_lock.acquire():
+                    self._catch_up()
+                    with self._lock:
+                        sealed = self.wal.rotate()
+                        wal_segment = self.wal.current_segment
+                        count = self.ntotal
+                        base = self.index
+                        # Published indexes are immutable; safe to read unlocked
+                        deltas = self.deltas
+                        generation = self.generation + 1
+                        
+                merged = base
+                if deltas:
+                    # Merge the deltas into a private copy of the base
+                    merged = faiss.deserialize_index(faiss.serialize_index(base))
+                    for delta in deltas:
+                        merged.add(extract_vectors(delta))
+                index_bytes = faiss.serialize_index(merged)
+                    
+                # The metadata and vector stores are append-only, so their
+                # first `count` rows can be written without holding the lock
+                files = self._snapshot_files(generation, os.path.basename(self.vectors_file))
+                self._save_index(index_bytes, count, files)
+                with self._write_lock, self.index_lock.acquire():
+                    manifest = self._publish_snapshot(generation, files, count, wal_segment)
+                    with self._lock:
+                        self._use_snapshot(manifest)
+                        self.metadata_store = self.metadata_store.rebased(self.metadata_file, count)
+                        if self.index is base:
+                            self._swap_base(merged, count)
+                        self._publish()
+                    self.wal.remove(sealed)
+                    self._remove_stale_files()
+            except Exception as e:
+                print(f"Error compacting index: {e}")
+            finally:
+                self._compacting = False
+        
+    def _maybe_purge(self):
+        """
+        Start a background purge once enough of the index is tombstoned.
+        """
+        if self._purging or not self.ntotal:
+            return
+        if self.metadata_store.deleted_count < self.garbage_ratio * self.ntotal:
+            return
+        self._purging = True
+        threading.Thread(target=self.purge, name="faiss-purge", daemon=True).start()
+        
+    @timed("faiss.purge")
+    def purge(self):
+        """
+        Rebuild the index, metadata and vector stores without deleted rows
+        and publish them as a new snapshot. Live rows are renumbered, so
+        writes in every process wait until it is published; searches keep
+        using the old index meanwhile.
+        """
+        with self.maintenance_lock.acquire(blocking=False) as acquired, self._migrate_lock, self._compact_lock:
+            try:
+                if not acquired:
+                    # Another process is maintaining the shared index
+                    return
+                with self._write_lock, self.index_lock.acquire():
+                    self._purge()
+            except Exception as e:
+                print(f"Error purging index: {e}")
+            finally:
+                self._purging = False
                 
-        return results
+    def _purge(self):
+        self._catch_up()
+        with self._lock:
+            deleted = self.metadata_store.column_values('deleted', self.ntotal)
+            if not deleted.any():
+                return
+            live = np.flatnonzero(deleted == 0)
+            vectors = self._vectors()[live]
+            sealed = self.wal.rotate()
+            self._wal_cursor = self.wal.end()
+            generation = self.generation + 1
+            
+        metadata_store = self.metadata_store.select(live)
+        index_type = index_type_of(self.index)
+        if len(live) < training_threshold(index_type):
+            # Too few rows left to train; migrated again once there are
+            index_type = 'flat'
+        new_index = build_index(index_type, self.dimension, num_vectors=len(live))
+        train_and_fill(new_index, vectors)
+        set_search_params(new_index, self.nprobe, self.ef_search)
+        
+        files = self._snapshot_files(generation, "vectors.%08d.f32" % generation)
+        self._save_purged(faiss.serialize_index(new_index), metadata_store, vectors, files)
+        manifest = self._publish_snapshot(generation, files, len(live), self._wal_cursor[0])
+        metadata_store = MetadataStore.load(os.path.join(self.data_dir, files['metadata']))
+        if self.mmap:
+            new_index = read_index(os.path.join(self.data_dir, files['index']), mmap=True)
+            set_search_params(new_index, self.nprobe, self.ef_search)
+        vector_store = None
+        if self.vector_store is not None:
+            vector_store = VectorStore(os.path.join(self.data_dir, files['vectors']), self.dimension)
+            
+        with self._lock:
+            self._use_snapshot(manifest)
+            self.index = new_index
+            self.deltas = ()
+            self._index_mmapped = self.mmap
+            self.metadata_store = metadata_store
+            self.vector_store = vector_store
+            self._near_duplicates = None
+            self._publish()
+            
+        # The sealed segments use the old row numbering
+        self.wal.remove(sealed)
+        self._remove_stale_files()
+        print(f"Purged {int(deleted.sum())} deleted chunks, {len(live)} remain")
+        
+    def _save_purged(self, index_bytes: np.ndarray, metadata_store: MetadataStore, vectors: np.ndarray, files: Dict[str, str]):
+        """
+        Write the files of a purged snapshot; they are unused until published.
+        """
+        if self.vector_store is not None:
+            with open(os.path.join(self.data_dir, files['vectors']), 'wb') as f:
+                f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        metadata_store.save(os.path.join(self.data_dir, files['metadata']))
+        self._write_file(os.path.join(self.data_dir, files['index']), index_bytes)
+        
+    def _finish_purge(self):
+        """
+        Complete a purge interrupted by a crash in versions before snapshots
+        were versioned: move its files into place and drop the WAL segments
+        it replaces (those use the old row numbering).
+        """
+        with open(self.purge_marker) as f:
+            sealed = json.load(f)['sealed']
+        for path in (self.vectors_file, self.metadata_file, self.index_file):
+            if os.path.exists(path + ".tmp"):
+                os.replace(path + ".tmp", path)
+        self.wal.remove(sealed)
+        if os.path.exists(self.legacy_metadata_file):
+            os.remove(self.legacy_metadata_file)
+        os.remove(self.purge_marker)
+        
+    def _swap_base(self, merged: faiss.Index, count: int):
+        """
+        Switch to the compacted base holding the first `count` vectors (the
+        memory-mapped snapshot with FAISS_MMAP), moving anything newer into
+        a fresh delta segment.
+        """
+        newer = self._vectors(start=count)
+        self.index = read_index(self.index_file, mmap=True) if self.mmap else merged
+        self._index_mmapped = self.mmap
+        self.deltas = ()
+        if len(newer):
+            self._add_to_index(newer)
+        set_search_params(self.index, self.nprobe, self.ef_search)
+        
+    def _save_index(self, index_bytes: np.ndarray, count: int, files: Dict[str, str]):
+        """
+        Write the files of a snapshot holding the first `count` rows; they
+        are unused until published. The vector store file is shared by
+        consecutive snapshots and only appended to.
+        """
+        if self.vector_store is not None:
+            self.vector_store.flush(count)
+        self.metadata_store.save(os.path.join(self.data_dir, files['metadata']), count)
+        self._write_file(os.path.join(self.data_dir, files['index']), index_bytes)
+        
+    def _write_file(self, path: str, data: np.ndarray):
+        with open(path, 'wb') as f:
+            f.write(data.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            
+    def _snapshot_files(self, generation: int, vectors: str) -> Dict[str, str]:
+        return {
+            'index': "faiss_index.%08d.bin" % generation,
+            'metadata': "metadata.%08d.bin" % generation,
+            'vectors': vectors
+        }
         
-    def _save_index(self):
+    def _read_manifest(self) -> Dict[str, Any]:
         """
-        Save FAISS index and metadata to disk.
+        The published snapshot. Data directories from before snapshots were
+        versioned use fixed file names (generation 0).
         """
         try:
-            # Save FAISS index
-            faiss.write_index(self.index, self.index_file)
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'generation': 0, 'index': "faiss_index.bin", 'metadata': "metadata.bin",
+                    'vectors': "vectors.f32", 'wal_segment': 0}
             
-            # Save metadata
-            with open(self.metadata_file, 'wb') as f:
-                pickle.dump(self.metadata_store, f)
+    def _manifest_stamp(self):
+        try:
+            stat = os.stat(self.manifest_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+        
+    def _use_snapshot(self, manifest: Dict[str, Any]):
+        self.generation = manifest['generation']
+        self.index_file = os.path.join(self.data_dir, manifest['index'])
+        self.metadata_file = os.path.join(self.data_dir, manifest['metadata'])
+        self.vectors_file = os.path.join(self.data_dir, manifest['vectors'])
+        # WAL segments before this one are folded into the snapshot
+        self.wal_segment = manifest['wal_segment']
+        self._snapshot_stamp = self._manifest_stamp()
+        
+    def _publish_snapshot(self, generation: int, files: Dict[str, str], count: int, wal_segment: int) -> Dict[str, Any]:
+        """
+        Atomically make a written snapshot the current one. Called with the
+        index lock held.
+        """
+        manifest = dict(files, generation=generation, count=count, wal_segment=wal_segment)
+        tmp_path = self.manifest_file + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_file)
+        return manifest
+        
+    def _remove_stale_files(self):
+        """
+        Delete the snapshot files and WAL segments the current snapshot does
+        not use. Processes that still have them open or mapped keep their
+        copy until they switch. Called under the maintenance lock, so no
+        other snapshot is being written.
+        """
+        current = {self.index_file, self.metadata_file, self.vectors_file}
+        for pattern in ("faiss_index*.bin*", "metadata*.bin*", "vectors*.f32*", "metadata.pkl"):
+            for path in glob.glob(os.path.join(self.data_dir, pattern)):
+                if path not in current:
+                    os.remove(path)
+        self.wal.remove_before(self.wal_segment)
+        
+    @timed("faiss.load")
+    def _load_index(self):
+        """
+        Load the current snapshot and replay the WAL, then start whatever
+        maintenance the loaded index needs.
+        """
+        if os.path.exists(self.purge_marker):
+            with self.index_lock.acquire():
+                if os.path.exists(self.purge_marker):
+                    # Interrupted while switching to a purged snapshot
+                    self._finish_purge()
+                    
+        if self._dimension_source is not None:
+            dimension = self._dimension_source()
+            if dimension != self.dimension:
+                self.dimension = dimension
+                self.index = self._new_index()
                 
-        except Exception as e:
-            print(f"Error saving index: {e}")
+        with self.index_lock.acquire(exclusive=False):
+            self._load_state()
             
-    def _load_index(self):
+        self._near_duplicates = None
+        backfill = self.near_duplicate_distance >= 0 and not self.metadata_store.column_values('simhashes').all()
+        if backfill:
+            # Older store: link its duplicates now so searches skip them
+            self._near_duplicate_index()
+        set_search_params(self.index, self.nprobe, self.ef_search)
+        with self._lock:
+            self._publish()
+        if backfill:
+            self._compacting = True
+            threading.Thread(target=self.compact, name="faiss-compaction", daemon=True).start()
+        if self.ntotal:
+            print(f"Loaded existing index with {self.ntotal} documents")
+            
+        # Existing index of another type (e.g. flat from older versions)
+        if not self._maybe_migrate():
+            self._maybe_purge()
+            
+    def _load_state(self):
         """
-        Load FAISS index and metadata from disk.
+        Load the snapshot named by the manifest and apply the WAL after it.
+        Called with the index lock held.
         """
+        self._use_snapshot(self._read_manifest())
         try:
             if os.path.exists(self.index_file) and os.path.exists(self.metadata_file):
                 # Load FAISS index
-                self.index = faiss.read_index(self.index_file)
+                self.index = read_index(self.index_file, mmap=self.mmap)
+                self._index_mmapped = self.mmap
                 
-                # Load metadata
-                with open(self.metadata_file, 'rb') as f:
-                    self.metadata_store = pickle.load(f)
-                    
-                print(f"Loaded existing index with {self.index.ntotal} documents")
+                # Load metadata (memory-mapped)
+                self.metadata_store = MetadataStore.load(self.metadata_file)
                 
+            elif os.path.exists(self.index_file) and os.path.exists(self.legacy_metadata_file):
+                # Pickled list of dicts from older versions; converted on next compaction
+                self.index = faiss.read_index(self.index_file)
+                with open(self.legacy_metadata_file, 'rb') as f:
+                    self.metadata_store = MetadataStore.from_records(pickle.load(f))
+                    
+            # Crash between the two snapshot renames (unversioned snapshots)
+            self.metadata_store.truncate(self.index.ntotal)
+                    
         except Exception as e:
             print(f"Error loading index: {e}")
             # Initialize fresh index if loading fails
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.metadata_store = []
+            self.index = self._new_index()
+            self._index_mmapped = False
+            self.metadata_store = MetadataStore()
+            
+        if self.index.d != self.dimension:
+            raise ValueError(
+                f"Index {self.index_file} holds {self.index.d}-dimensional vectors but the embedder produces "
+                f"{self.dimension}; use the backend and model it was built with or re-ingest"
+            )
             
-    def get_stats(self) -> Dict[str, int]:
+        if self.vector_store is not None:
+            self.vector_store = VectorStore(self.vectors_file, self.dimension)
+            self.vector_store.truncate(self.index.ntotal)
+            if len(self.vector_store) < self.index.ntotal:
+                # Re-ranking was just enabled; best effort from the index itself
+                self.vector_store.append(extract_vectors(self.index, start=len(self.vector_store)))
+                
+        self._wal_cursor = (self.wal_segment, 0)
+        self._apply_wal()
+        
+    def _apply_wal(self) -> int:
+        """
+        Apply the WAL records after the cursor, i.e. those that are not part
+        of the snapshot or came from other processes. Returns their number.
+        """
+        applied = 0
+        try:
+            for start_id, vectors, metadata, cursor in self.wal.records(*self._wal_cursor):
+                with self._lock:
+                    self._wal_cursor = cursor
+                    applied += 1
+                    if isinstance(metadata, dict):
+                        # Tombstone; deleting twice is a no-op
+                        self._delete_rows(metadata['delete'])
+                        continue
+                    if start_id + len(vectors) <= self.ntotal:
+                        # Already folded into the snapshot
+                        continue
+                    if start_id != self.ntotal:
+                        print(f"WAL gap at id {self.ntotal}, ignoring records from {start_id}")
+                        break
+                    self._add_to_index(vectors)
+                    if self.vector_store is not None:
+                        self.vector_store.append(vectors)
+                    self.metadata_store.extend(metadata)
+                    # Rebuilt by the next tombstone that needs it
+                    self._near_duplicates = None
+        except Exception as e:
+            print(f"Error replaying WAL: {e}")
+        self._wal_cursor = self.wal.end()
+        return applied
+        
+    def find_document_by_filename(self, filename: str):
+        """
+        Return the document_id already ingested under `filename`, or None.
+        """
+        self.ensure_loaded()
+        return self.metadata_store.find_by_filename(filename)
+        
+    def find_translation(self, content: str) -> Optional[str]:
+        """
+        Pre-translation stored at ingest for a chunk with exactly this
+        content, or None.
+        """
+        self.ensure_loaded()
+        metadata_store = self._view.metadata_store
+        for row in metadata_store.rows_with_simhash(simhash(content)):
+            if metadata_store.get_content(row) == content:
+                translation = metadata_store.get_translation(row)
+                if translation:
+                    return translation
+        return None
+        
+    def get_stats(self) -> Dict[str, Any]:
         """
         Get statistics about the index.
         """
+        self.ensure_loaded()
+        
         return {
-            "total_documents": self.index.ntotal,
+            "total_documents": self.ntotal,
             "dimension": self.dimension,
-            "metadata_count": len(self.metadata_store)
-        }
\ No newline at end of file
+            "index_type": index_type_of(self.index),
+            "memory_mapped": self._index_mmapped,
+            "delta_segments": len(self.deltas),
+            "version": self.version,
+            "generation": self.generation,
+            "metadata_count": len(self.metadata_store),
+            "near_duplicates": int(((self.metadata_store.column_values('duplicate_of') >= 0)
+                                    & (self.metadata_store.column_values('deleted') == 0)).sum()),
+            "deleted_chunks": self.metadata_store.deleted_count,
+            "partitions": self._partition_sizes()
+        }
+        
+    def _partition_sizes(self) -> Dict[str, int]:
+        """
+        Live chunks per language partition.
+        """
+        store = self.metadata_store
+        codes = store.column_values('language_codes')[store.column_values('deleted') == 0]
+        counts = np.bincount(codes, minlength=len(store.languages))
+        return {language: int(count) for language, count in zip(store.languages, counts)}
\ No newline at end of file
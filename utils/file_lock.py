@@ -0,0 +1,54 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+
+class FileLock:
+    """
+    Cross-process reader/writer lock on a file (flock), re-entrant per thread.
+
+    Every acquisition opens its own file descriptor, so threads of one
+    process exclude each other exactly like separate processes do. A thread
+    already holding the lock passes straight through nested acquisitions.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    @contextmanager
+    def acquire(self, exclusive: bool = True, blocking: bool = True):
+        """
+        Hold the lock for the `with` block; yields False if `blocking` is
+        off and another holder has it.
+        """
+        if getattr(self._local, 'depth', 0):
+            self._local.depth += 1
+            try:
+                yield True
+            finally:
+                self._local.depth -= 1
+            return
+        if fcntl is None:
+            yield True
+            return
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            self._local.depth = 1
+            try:
+                yield True
+            finally:
+                self._local.depth = 0
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
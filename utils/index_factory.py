@@ -0,0 +1,193 @@
+import math
+import os
+import threading
+from typing import Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq', 'sq8', 'sq_fp16', 'pq')
+
+# Types that store lossy codes instead of the float32 vectors
+QUANTIZED_TYPES = ('ivf_pq', 'sq8', 'sq_fp16', 'pq')
+
+# IVF direct maps are built lazily by readers that may run concurrently
+_direct_map_lock = threading.Lock()
+
+
+def build_index(
+    index_type: str,
+    dimension: int,
+    num_vectors: int = 0,
+    nlist: Optional[int] = None,
+    pq_m: Optional[int] = None,
+    hnsw_m: Optional[int] = None
+) -> faiss.Index:
+    """
+    Create an empty inner-product index of the given type.
+    `num_vectors` sizes the IVF coarse quantizer when `nlist` is not set.
+    """
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dimension)
+
+    if index_type == 'hnsw':
+        hnsw_m = hnsw_m or int(os.getenv("FAISS_HNSW_M", "32"))
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = int(os.getenv("FAISS_EF_CONSTRUCTION", "80"))
+        return index
+
+    if index_type in ('sq8', 'sq_fp16'):
+        qtype = faiss.ScalarQuantizer.QT_8bit if index_type == 'sq8' else faiss.ScalarQuantizer.QT_fp16
+        return faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+
+    if index_type == 'pq':
+        pq_m = pq_m or int(os.getenv("FAISS_PQ_M", "48"))
+        return faiss.IndexPQ(dimension, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = nlist or int(os.getenv("FAISS_NLIST", "0")) or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == 'ivf_flat':
+            return faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        pq_m = pq_m or int(os.getenv("FAISS_PQ_M", "48"))
+        return faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+
+def default_nlist(num_vectors: int) -> int:
+    """
+    About 4 * sqrt(N) lists, keeping at least 39 training points per list.
+    """
+    nlist = int(4 * math.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // 39 or 1, 65536))
+
+
+def training_threshold(index_type: str) -> int:
+    """
+    Number of vectors needed before an index of this type is trained.
+    """
+    if index_type == 'ivf_flat':
+        return int(os.getenv("FAISS_TRAIN_THRESHOLD", "10000"))
+    if index_type in ('ivf_pq', 'pq'):
+        # PQ codebooks need 256 centroids per sub-quantizer
+        return max(int(os.getenv("FAISS_TRAIN_THRESHOLD", "10000")), 256 * 39)
+    if index_type == 'sq8':
+        # Only per-dimension ranges are learned
+        return int(os.getenv("FAISS_SQ_TRAIN_THRESHOLD", "1000"))
+    return 0
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """
+    Map a FAISS index instance back to our index type name.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf_flat'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'sq8' if index.sq.qtype == faiss.ScalarQuantizer.QT_8bit else 'sq_fp16'
+    if isinstance(index, faiss.IndexPQ):
+        return 'pq'
+    return 'flat'
+
+
+def read_index(path: str, mmap: bool = False) -> faiss.Index:
+    """
+    Read an index from disk. With `mmap` the codes stay in the file and are
+    shared between processes through the page cache; such an index is
+    read-only and must never be added to.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    try:
+        # Flat, scalar-quantized, PQ and HNSW storage (flat codes)
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # IVF inverted lists
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    Apply runtime recall/latency knobs to whichever index type is in use.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF) and nprobe:
+        index.nprobe = min(nprobe, index.nlist)
+    if isinstance(index, faiss.IndexHNSW) and ef_search:
+        index.hnsw.efSearch = ef_search
+
+
+def search_parameters(index: faiss.Index, allowed: np.ndarray):
+    """
+    Search parameters restricting results to ids whose bit is set in the
+    little-endian bitmap `allowed`, carrying over the index's own IVF nprobe
+    / HNSW efSearch (typed parameters replace them otherwise). Keep
+    `allowed` alive while the parameters are in use. Returns None for
+    IndexPQ, which does not accept search parameters.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPQ):
+        return None
+    selector = faiss.IDSelectorBitmap(len(allowed) * 8, faiss.swig_ptr(allowed))
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.selector_ref = selector
+    return params
+
+
+def extract_vectors(index: faiss.Index, start: int = 0) -> np.ndarray:
+    """
+    Reconstruct the stored vectors from id `start` on (exact for flat/HNSW/
+    IVF-Flat, approximate for PQ codes). Used to migrate between index types.
+    """
+    if index.ntotal <= start:
+        return np.zeros((0, index.d), dtype='float32')
+    index = faiss.downcast_index(index)
+    _ensure_direct_map(index)
+    return index.reconstruct_n(start, index.ntotal - start)
+
+
+def reconstruct_rows(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    """
+    Reconstruct the stored vectors of `ids` (same precision as extract_vectors).
+    """
+    if not len(ids):
+        return np.zeros((0, index.d), dtype='float32')
+    index = faiss.downcast_index(index)
+    _ensure_direct_map(index)
+    return index.reconstruct_batch(np.ascontiguousarray(ids, dtype='int64'))
+
+
+def _ensure_direct_map(index: faiss.Index):
+    """
+    Build an IVF index's id -> list map once; later adds maintain it.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        with _direct_map_lock:
+            if index.direct_map.no():
+                index.make_direct_map()
+
+
+def train_and_fill(index: faiss.Index, vectors: np.ndarray, max_training_vectors: int = 256 * 1024):
+    """
+    Train `index` on (a sample of) `vectors` if needed, then add them all.
+    """
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > max_training_vectors:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), max_training_vectors, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype='float32'))
+    if len(vectors):
+        index.add(np.ascontiguousarray(vectors, dtype='float32'))
+    return index
@@ -0,0 +1,54 @@
+from typing import List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from utils.metadata_store import MetadataStore
+from utils.vector_store import VectorStore
+
+
+class IndexView:
+    """
+    Immutable state a search runs against: the base index, the delta
+    segments holding the rows added since, the metadata and vector stores,
+    and which of the first `ntotal` rows are live and canonical.
+
+    Index objects are never modified once they are part of a published
+    view: new rows go to new delta segments and maintenance builds a new
+    base. The stores are append-only for the rows a view covers, and the
+    per-row flags that do change (deletions, near-duplicate links) are
+    frozen in the masks here. A search therefore reads the manager's
+    current view once and needs no lock, and it sees every document of a
+    write or none of them.
+    """
+    __slots__ = ('index', 'deltas', 'ntotal', 'metadata_store', 'vector_store', 'live', 'canonical', 'version')
+
+    def __init__(
+        self,
+        index: faiss.Index,
+        deltas: Tuple[faiss.Index, ...],
+        metadata_store: MetadataStore,
+        vector_store: Optional[VectorStore],
+        live: np.ndarray,
+        canonical: np.ndarray,
+        version: int
+    ):
+        self.index = index
+        self.deltas = deltas
+        self.ntotal = len(live)
+        self.metadata_store = metadata_store
+        self.vector_store = vector_store
+        self.live = live
+        self.canonical = canonical
+        self.version = version
+
+    def segments(self) -> List[Tuple[faiss.Index, int]]:
+        """
+        (index, first row) of the base and of every delta segment.
+        """
+        segments = [(self.index, 0)]
+        start = self.index.ntotal
+        for delta in self.deltas:
+            segments.append((delta, start))
+            start += delta.ntotal
+        return segments
@@ -0,0 +1,620 @@
+import json
+import os
+import struct
+import threading
+from array import array
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_MAGIC = b'META0001'
+_HEADER_LEN = struct.Struct('<Q')
+_ALIGN = 64
+
+# Per-row columns: name -> (numpy dtype, array typecode)
+_COLUMNS = {
+    'document_codes': ('int32', 'i'),
+    'filename_codes': ('int32', 'i'),
+    'language_codes': ('int16', 'h'),
+    'chunk_ids': ('int32', 'i'),
+    # Row of the canonical chunk this one near-duplicates, -1 if canonical
+    'duplicate_of': ('int64', 'q'),
+    # SimHash of the content, 0 if not computed yet
+    'simhashes': ('uint64', 'Q'),
+    # 1 once the row's document was deleted (tombstone until the next purge)
+    'deleted': ('uint8', 'B'),
+}
+
+# Defaults for columns missing from stores written by older versions
+_COLUMN_DEFAULTS = {'duplicate_of': -1, 'simhashes': 0, 'deleted': 0}
+
+# Columns that may change after a row is written
+_MUTABLE_COLUMNS = ('duplicate_of', 'simhashes', 'deleted')
+
+
+def _aligned(position: int) -> int:
+    return -(-position // _ALIGN) * _ALIGN
+
+
+def _clip_ranges(document_ranges: List[List[List[int]]], count: int) -> List[List[List[int]]]:
+    """
+    Row ranges restricted to the first `count` rows.
+    """
+    return [
+        [[start, min(stop, count)] for start, stop in ranges if start < count]
+        for ranges in document_ranges
+    ]
+
+
+class _TextColumn:
+    """
+    Variable-length UTF-8 strings addressed by row: a base of offsets and
+    bytes (memory-mapped when loaded) plus rows appended since in memory.
+    """
+    def __init__(self, offsets: Optional[np.ndarray] = None, text: Optional[np.ndarray] = None):
+        self.base_offsets = np.zeros(1, dtype='int64') if offsets is None else offsets
+        self.base_text = np.zeros(0, dtype='uint8') if text is None else text
+        self.tail_ends = array('q')
+        self.tail_text = bytearray()
+
+    @property
+    def base_count(self) -> int:
+        return len(self.base_offsets) - 1
+
+    def _span(self, row: int):
+        if row < self.base_count:
+            return int(self.base_offsets[row]), int(self.base_offsets[row + 1])
+        tail_row = row - self.base_count
+        start = self.tail_ends[tail_row - 1] if tail_row else int(self.base_offsets[-1])
+        return start, self.tail_ends[tail_row]
+
+    def get(self, row: int) -> str:
+        start, end = self._span(row)
+        if row < self.base_count:
+            return self.base_text[start:end].tobytes().decode('utf-8')
+        base_len = int(self.base_offsets[-1])
+        return self.tail_text[start - base_len:end - base_len].decode('utf-8')
+
+    def append(self, value: str):
+        encoded = value.encode('utf-8')
+        text_end = self.tail_ends[-1] if self.tail_ends else int(self.base_offsets[-1])
+        self.tail_text += encoded
+        self.tail_ends.append(text_end + len(encoded))
+
+    def truncate(self, count: int):
+        if count <= self.base_count:
+            self.base_offsets = self.base_offsets[:count + 1]
+            self.base_text = self.base_text[:int(self.base_offsets[-1])]
+            self.tail_ends = array('q')
+            self.tail_text = bytearray()
+        else:
+            keep = count - self.base_count
+            del self.tail_ends[keep:]
+            text_end = self.tail_ends[-1] if self.tail_ends else int(self.base_offsets[-1])
+            del self.tail_text[text_end - int(self.base_offsets[-1]):]
+
+    def arrays(self, count: int):
+        """
+        (offsets, text) arrays of the first `count` rows, for saving.
+        """
+        base_rows = min(count, self.base_count)
+        tail_rows = count - base_rows
+        base_ends = self.base_offsets[1:base_rows + 1]
+        tail_ends = np.frombuffer(self.tail_ends[:tail_rows], dtype='int64') if tail_rows else np.zeros(0, dtype='int64')
+        offsets = np.concatenate([np.zeros(1, dtype='int64'), base_ends, tail_ends])
+        text_len = int(offsets[-1])
+        base_text_len = int(self.base_offsets[-1])
+        text = np.concatenate([
+            self.base_text[:min(text_len, base_text_len)],
+            np.frombuffer(bytes(self.tail_text[:max(0, text_len - base_text_len)]), dtype='uint8')
+        ])
+        return offsets, text
+
+    def rebased(self, snapshot: '_TextColumn') -> '_TextColumn':
+        """
+        New column with a snapshot of the first rows of this one as its base
+        and the rows after it in memory.
+        """
+        dropped = snapshot.base_count - self.base_count
+        text_dropped = int(snapshot.base_offsets[-1]) - int(self.base_offsets[-1])
+        column = _TextColumn(snapshot.base_offsets, snapshot.base_text)
+        column.tail_ends = self.tail_ends[dropped:]
+        column.tail_text = self.tail_text[text_dropped:]
+        return column
+
+    def select(self, rows: np.ndarray) -> '_TextColumn':
+        """
+        New column holding only `rows`, gathered into one buffer.
+        """
+        offsets = np.concatenate([
+            self.base_offsets,
+            np.frombuffer(self.tail_ends, dtype='int64') if len(self.tail_ends) else np.zeros(0, dtype='int64')
+        ])
+        text = np.concatenate([self.base_text, np.frombuffer(bytes(self.tail_text), dtype='uint8')])
+        starts, lengths = offsets[rows], offsets[rows + 1] - offsets[rows]
+        new_offsets = np.concatenate([np.zeros(1, dtype='int64'), np.cumsum(lengths)])
+        gather = np.arange(int(new_offsets[-1]), dtype='int64') + np.repeat(starts - new_offsets[:-1], lengths)
+        return _TextColumn(new_offsets, text[gather])
+
+
+class MetadataStore:
+    """
+    Columnar, memory-mappable store for chunk metadata.
+
+    Row ids are the FAISS vector ids. Filenames, languages and document ids are
+    interned into small tables, per-row fields are fixed-width integer columns
+    and chunk text lives in one contiguous UTF-8 buffer addressed by offsets,
+    as do the optional pre-translations of the chunks.
+    Rows loaded from disk stay memory-mapped; rows appended since then are
+    kept in compact in-memory arrays until the next snapshot.
+
+    A document's rows are tracked as a list of contiguous [start, stop)
+    ranges, so large documents can be appended window by window while other
+    documents are being ingested.
+
+    Deleting a document only sets its rows' `deleted` flag; `select` builds
+    the compacted store without them.
+    """
+    def __init__(self):
+        # Interned string tables
+        self.filenames: List[str] = []
+        self.languages: List[str] = []
+        self._filename_codes: Dict[str, int] = {}
+        self._language_codes: Dict[str, int] = {}
+
+        # Document table: code -> id, filename code and [start, stop) row ranges
+        self.document_ids: List[str] = []
+        self.document_filenames: List[int] = []
+        self.document_ranges: List[List[List[int]]] = []
+
+        # Hash indexes
+        self._document_index: Dict[str, int] = {}
+        self._filename_index: Dict[str, int] = {}
+
+        # Memory-mapped base rows
+        self._base_count = 0
+        self._base = {name: np.zeros(0, dtype=dtype) for name, (dtype, _) in _COLUMNS.items()}
+
+        # Rows appended since the base was loaded
+        self._tail = {name: array(code) for name, (_, code) in _COLUMNS.items()}
+
+        # Chunk text and its translation into the other language ('' if none)
+        self._text = _TextColumn()
+        self._translations = _TextColumn()
+
+        # SimHash -> rows, built on first lookup and kept up to date after
+        self._simhash_rows: Optional[Dict[int, List[int]]] = None
+        self._simhash_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._base_count + len(self._text.tail_ends)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        """
+        Hydrate one row into the dict layout used by the services.
+        """
+        if row < 0 or row >= len(self):
+            raise IndexError(row)
+        document_code = self._column('document_codes', row)
+        duplicate_of = self._column('duplicate_of', row)
+        return {
+            'document_id': self.document_ids[document_code],
+            'filename': self.filenames[self._column('filename_codes', row)],
+            'chunk_id': self._column('chunk_ids', row),
+            'content': self.get_content(row),
+            'language': self.languages[self._column('language_codes', row)],
+            'duplicate_of': duplicate_of if duplicate_of >= 0 else None,
+            'translation': self.get_translation(row) or None
+        }
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def _column(self, name: str, row: int) -> int:
+        if row < self._base_count:
+            return int(self._base[name][row])
+        return self._tail[name][row - self._base_count]
+
+    def column_values(self, name: str, count: Optional[int] = None, start: int = 0) -> np.ndarray:
+        """
+        Values of a per-row column for rows `start`..`count` (default: all).
+        """
+        count = len(self) if count is None else count
+        base_rows = min(count, self._base_count)
+        tail_start = max(start - self._base_count, 0)
+        tail_stop = count - base_rows
+        dtype = _COLUMNS[name][0]
+        if tail_stop > tail_start:
+            tail = np.frombuffer(self._tail[name][tail_start:tail_stop], dtype=dtype)
+        else:
+            tail = np.zeros(0, dtype=dtype)
+        return np.concatenate([self._base[name][min(start, base_rows):base_rows], tail])
+
+    def set_value(self, name: str, row: int, value: int):
+        """
+        Overwrite one value of a per-row column (backfilling older stores).
+        """
+        if row < self._base_count:
+            if not self._base[name].flags.writeable:
+                # Copy the read-only mapping on first write
+                self._base[name] = np.array(self._base[name])
+            self._base[name][row] = value
+        else:
+            self._tail[name][row - self._base_count] = value
+        if name == 'simhashes':
+            self._index_simhashes([row], [value])
+
+    def get_content(self, row: int) -> str:
+        return self._text.get(row)
+
+    def get_translation(self, row: int) -> str:
+        """
+        Pre-translation of the row's chunk into the other language, '' if none.
+        """
+        return self._translations.get(row)
+
+    def rows_with_simhash(self, signature: int) -> List[int]:
+        """
+        Live rows whose content has the given SimHash.
+        """
+        if self._simhash_rows is None:
+            with self._simhash_lock:
+                if self._simhash_rows is None:
+                    signatures = self.column_values('simhashes')
+                    rows = np.flatnonzero(signatures)
+                    index: Dict[int, List[int]] = {}
+                    for row, signature in zip(rows.tolist(), signatures[rows].tolist()):
+                        index.setdefault(signature, []).append(row)
+                    self._simhash_rows = index
+        count = len(self)
+        # Rows may be listed twice when appended while the index was built
+        rows = sorted(set(self._simhash_rows.get(signature, ())))
+        return [row for row in rows if row < count and not self._column('deleted', row)]
+
+    def _index_simhashes(self, rows: List[int], signatures: List[int]):
+        # Signatures are only ever set once (0 means not computed), so rows
+        # are added and never moved
+        with self._simhash_lock:
+            if self._simhash_rows is None:
+                return
+            for row, signature in zip(rows, signatures):
+                if signature:
+                    self._simhash_rows.setdefault(int(signature), []).append(row)
+
+    def _intern(self, value: str, table: List[str], codes: Dict[str, int]) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = len(table)
+            table.append(value)
+            codes[value] = code
+        return code
+
+    def extend(self, metadata: List[Dict[str, Any]]):
+        """
+        Append rows. Expects the dict layout produced by DocumentService.
+        """
+        start = len(self)
+        for meta in metadata:
+            row = len(self)
+            document_code = self._document_index.get(meta['document_id'])
+            filename_code = self._intern(meta['filename'], self.filenames, self._filename_codes)
+            if document_code is None:
+                document_code = len(self.document_ids)
+                self.document_ids.append(meta['document_id'])
+                self.document_filenames.append(filename_code)
+                self.document_ranges.append([[row, row + 1]])
+                self._document_index[meta['document_id']] = document_code
+                self._filename_index.setdefault(meta['filename'], document_code)
+            else:
+                ranges = self.document_ranges[document_code]
+                if ranges[-1][1] == row:
+                    ranges[-1][1] = row + 1
+                else:
+                    ranges.append([row, row + 1])
+
+            self._tail['document_codes'].append(document_code)
+            self._tail['filename_codes'].append(filename_code)
+            self._tail['language_codes'].append(
+                self._intern(meta['language'], self.languages, self._language_codes))
+            self._tail['chunk_ids'].append(int(meta['chunk_id']))
+            duplicate_of = meta.get('duplicate_of')
+            self._tail['duplicate_of'].append(-1 if duplicate_of is None else int(duplicate_of))
+            self._tail['simhashes'].append(int(meta.get('simhash', 0)))
+            self._tail['deleted'].append(0)
+            self._translations.append(meta.get('translation') or '')
+            # Appended last: a row counts once its text is in place
+            self._text.append(meta['content'])
+        self._index_simhashes(list(range(start, start + len(metadata))),
+                              [int(meta.get('simhash', 0)) for meta in metadata])
+
+    def find_by_filename(self, filename: str) -> Optional[str]:
+        """
+        Return the document_id first ingested under `filename`, if any.
+        """
+        code = self._filename_index.get(filename)
+        return self.document_ids[code] if code is not None else None
+
+    def get_document_rows(self, document_id: str) -> List[int]:
+        code = self._document_index.get(document_id)
+        if code is None:
+            return []
+        return [row for start, stop in self.document_ranges[code] for row in range(start, stop)]
+
+    def delete_document(self, document_id: str) -> List[int]:
+        """
+        Tombstone a document's rows and return them ([] if it is unknown or
+        already deleted). Its filename becomes free for a new document.
+        """
+        rows = self.get_document_rows(document_id)
+        if not rows:
+            return []
+        for row in rows:
+            self.set_value('deleted', row, 1)
+        code = self._document_index.pop(document_id)
+        filename = self.filenames[self.document_filenames[code]]
+        if self._filename_index.get(filename) == code:
+            del self._filename_index[filename]
+            self._index_filename(self.document_filenames[code])
+        return rows
+
+    def _index_filename(self, filename_code: int):
+        """
+        Point a filename at the earliest live document stored under it.
+        """
+        for code, document_id in enumerate(self.document_ids):
+            if self.document_filenames[code] == filename_code and document_id in self._document_index:
+                self._filename_index[self.filenames[filename_code]] = code
+                return
+
+    def partition_mask(
+        self,
+        count: int,
+        language: Optional[str] = None,
+        document_id: Optional[str] = None,
+        filename: Optional[str] = None,
+        filename_prefix: Optional[str] = None
+    ) -> np.ndarray:
+        """
+        Boolean mask over the first `count` rows matching every given field.
+        """
+        mask = np.ones(count, dtype=bool)
+        if language is not None:
+            code = self._language_codes.get(language)
+            if code is None:
+                return np.zeros(count, dtype=bool)
+            mask &= self.column_values('language_codes', count) == code
+        if filename is not None or filename_prefix is not None:
+            codes = [
+                code for code, name in enumerate(self.filenames)
+                if (filename is None or name == filename)
+                and (filename_prefix is None or name.startswith(filename_prefix))
+            ]
+            mask &= np.isin(self.column_values('filename_codes', count), codes)
+        if document_id is not None:
+            document_mask = np.zeros(count, dtype=bool)
+            code = self._document_index.get(document_id)
+            for start, stop in (self.document_ranges[code] if code is not None else []):
+                document_mask[start:stop] = True
+            mask &= document_mask
+        return mask
+
+    @property
+    def deleted_count(self) -> int:
+        return int(self.column_values('deleted').sum())
+
+    def truncate(self, count: int):
+        """
+        Drop rows from `count` onwards (crash recovery only).
+        """
+        if count >= len(self):
+            return
+        if count <= self._base_count:
+            self._base_count = count
+            self._base = {name: column[:count] for name, column in self._base.items()}
+            self._tail = {name: array(code) for name, (_, code) in _COLUMNS.items()}
+        else:
+            keep = count - self._base_count
+            for column in self._tail.values():
+                del column[keep:]
+        self._text.truncate(count)
+        self._translations.truncate(count)
+        with self._simhash_lock:
+            self._simhash_rows = None
+
+        for code, ranges in enumerate(self.document_ranges):
+            if ranges[0][0] >= count:
+                # Documents are appended in order, everything after is gone too
+                for document_id in self.document_ids[code:]:
+                    self._document_index.pop(document_id, None)
+                self._filename_index = {
+                    name: c for name, c in self._filename_index.items() if c < code
+                }
+                del self.document_ids[code:]
+                del self.document_filenames[code:]
+                del self.document_ranges[code:]
+                break
+        self.document_ranges = _clip_ranges(self.document_ranges, count)
+
+    def save(self, path: str, count: Optional[int] = None):
+        """
+        Write the first `count` rows (default: all) to a single file.
+        Safe to call while other threads append.
+        """
+        count = len(self) if count is None else count
+
+        columns = {name: self.column_values(name, count) for name in _COLUMNS}
+        columns['offsets'], columns['text'] = self._text.arrays(count)
+        columns['translation_offsets'], columns['translation_text'] = self._translations.arrays(count)
+
+        documents = sum(1 for ranges in self.document_ranges if ranges[0][0] < count)
+        header = {
+            'count': count,
+            'filenames': self.filenames[:],
+            'languages': self.languages[:],
+            'documents': {
+                'ids': self.document_ids[:documents],
+                'filenames': self.document_filenames[:documents],
+                'ranges': _clip_ranges(self.document_ranges[:documents], count)
+            },
+            'columns': {}
+        }
+
+        # Column offsets depend on the header length; grow until they fit
+        data_start = 0
+        while True:
+            position = data_start
+            for name, values in columns.items():
+                position = _aligned(position)
+                header['columns'][name] = [position, str(values.dtype), int(values.shape[0])]
+                position += values.nbytes
+            header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+            needed = _aligned(len(_MAGIC) + _HEADER_LEN.size + len(header_bytes))
+            if needed <= data_start:
+                break
+            data_start = needed
+
+        with open(path, 'wb') as f:
+            f.write(_MAGIC + _HEADER_LEN.pack(len(header_bytes)) + header_bytes)
+            for name, values in columns.items():
+                f.seek(header['columns'][name][0])
+                f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def load(cls, path: str) -> 'MetadataStore':
+        """
+        Open a saved store; row columns and text are memory-mapped.
+        """
+        store = cls()
+        with open(path, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a metadata store")
+            header_len = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))[0]
+            header = json.loads(f.read(header_len).decode('utf-8'))
+
+        mapped = {}
+        for name, (offset, dtype, length) in header['columns'].items():
+            if length:
+                mapped[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(length,))
+            else:
+                mapped[name] = np.zeros(0, dtype=dtype)
+
+        store._base_count = header['count']
+        for name, default in _COLUMN_DEFAULTS.items():
+            if name not in mapped:
+                mapped[name] = np.full(store._base_count, default, dtype=_COLUMNS[name][0])
+        store._base = {name: mapped[name] for name in _COLUMNS}
+        store._text = _TextColumn(mapped['offsets'], mapped['text'])
+        if 'translation_offsets' in mapped:
+            store._translations = _TextColumn(mapped['translation_offsets'], mapped['translation_text'])
+        else:
+            # Stores written before chunks could carry a translation
+            store._translations = _TextColumn(np.zeros(store._base_count + 1, dtype='int64'))
+
+        store.filenames = header['filenames']
+        store.languages = header['languages']
+        store._filename_codes = {name: code for code, name in enumerate(store.filenames)}
+        store._language_codes = {name: code for code, name in enumerate(store.languages)}
+
+        documents = header['documents']
+        store.document_ids = documents['ids']
+        store.document_filenames = documents['filenames']
+        if 'ranges' in documents:
+            store.document_ranges = documents['ranges']
+        else:
+            # Stores written before documents could span several ranges
+            store.document_ranges = [[[start, stop]] for start, stop in zip(documents['starts'], documents['stops'])]
+        deleted = store._base['deleted']
+        for code, (document_id, filename_code) in enumerate(zip(store.document_ids, store.document_filenames)):
+            # A document's rows are all deleted together
+            if not deleted[store.document_ranges[code][0][0]]:
+                store._document_index[document_id] = code
+                store._filename_index.setdefault(store.filenames[filename_code], code)
+        return store
+
+    @classmethod
+    def from_records(cls, metadata: List[Dict[str, Any]]) -> 'MetadataStore':
+        """
+        Build a store from the legacy list-of-dicts layout.
+        """
+        store = cls()
+        store.extend(metadata)
+        return store
+
+    def rebased(self, path: str, count: int) -> 'MetadataStore':
+        """
+        New store whose base is the snapshot at `path` (holding the first
+        `count` rows), with only the rows appended after it in memory. This
+        store is left untouched for readers still using it.
+        """
+        snapshot = MetadataStore.load(path)
+        dropped = count - self._base_count
+        for name in _MUTABLE_COLUMNS:
+            # Keep values changed while the snapshot was being written
+            live = self.column_values(name, count)
+            if not np.array_equal(live, snapshot._base[name]):
+                snapshot._base[name] = live
+
+        # Tables are append-only, so the live ones already cover the snapshot
+        store = MetadataStore()
+        for name in ('filenames', 'languages', '_filename_codes', '_language_codes', 'document_ids',
+                     'document_filenames', 'document_ranges', '_document_index', '_filename_index'):
+            setattr(store, name, getattr(self, name))
+        store._base_count = snapshot._base_count
+        store._base = snapshot._base
+        store._tail = {name: column[dropped:] for name, column in self._tail.items()}
+        store._text = self._text.rebased(snapshot._text)
+        store._translations = self._translations.rebased(snapshot._translations)
+        # Same rows, so the SimHash index carries over
+        with self._simhash_lock:
+            store._simhash_rows = self._simhash_rows
+            store._simhash_lock = self._simhash_lock
+        return store
+
+    def select(self, rows: np.ndarray) -> 'MetadataStore':
+        """
+        New in-memory store holding only `rows` (ascending), renumbered from
+        0. Near-duplicate links are remapped, links to dropped rows cleared.
+        """
+        rows = np.asarray(rows, dtype='int64')
+        store = MetadataStore()
+        store.filenames = self.filenames[:]
+        store.languages = self.languages[:]
+        store._filename_codes = dict(self._filename_codes)
+        store._language_codes = dict(self._language_codes)
+
+        count = len(self)
+        new_row = np.full(count, -1, dtype='int64')
+        new_row[rows] = np.arange(len(rows))
+        columns = {name: self.column_values(name)[rows] for name in _COLUMNS}
+        duplicate_of = columns['duplicate_of']
+        linked = duplicate_of >= 0
+        duplicate_of[linked] = new_row[duplicate_of[linked]]
+
+        # Keep the documents that still have rows, in their original order
+        document_codes = columns['document_codes']
+        kept = np.unique(document_codes)
+        new_code = np.full(len(self.document_ids), -1, dtype='int64')
+        new_code[kept] = np.arange(len(kept))
+        columns['document_codes'] = new_code[document_codes].astype(_COLUMNS['document_codes'][0])
+        store.document_ids = [self.document_ids[code] for code in kept]
+        store.document_filenames = [self.document_filenames[code] for code in kept]
+        store.document_ranges = [[] for _ in kept]
+        codes = columns['document_codes']
+        breaks = np.flatnonzero(np.diff(codes)) + 1
+        for start, stop in zip(np.concatenate([[0], breaks]), np.concatenate([breaks, [len(codes)]])):
+            if stop > start:
+                store.document_ranges[int(codes[start])].append([int(start), int(stop)])
+        deleted = columns['deleted']
+        for code, (document_id, filename_code) in enumerate(zip(store.document_ids, store.document_filenames)):
+            if not deleted[store.document_ranges[code][0][0]]:
+                store._document_index[document_id] = code
+                store._filename_index.setdefault(store.filenames[filename_code], code)
+
+        store._base_count = len(rows)
+        store._base = columns
+        store._text = self._text.select(rows)
+        store._translations = self._translations.select(rows)
+        return store
@@ -0,0 +1,53 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+DEFAULT_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of embedding models.
+
+    Models are loaded lazily on first use (or by a background warm-up) and
+    shared by every service, so a worker holds exactly one copy of each.
+    Each model is wrapped in the embedder backend (EMBEDDING_BACKEND) that
+    runs it, see utils.embedders.
+    """
+    def __init__(self):
+        self._models: Dict[Tuple[str, str], object] = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, name: Optional[str] = None, backend: Optional[str] = None):
+        """
+        Return the embedder for `name` on `backend`, loading it on first use.
+        """
+        key = self._key(name, backend)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                # Deferred so that importing the app does not pull in torch
+                from utils.embedders import create_embedder
+                model = create_embedder(*key)
+                self._models[key] = model
+        return model
+
+    def dimension(self, name: Optional[str] = None, backend: Optional[str] = None) -> int:
+        """
+        Embedding dimension of the model, loading it if needed.
+        """
+        return self.get_model(name, backend).dimension
+
+    def is_loaded(self, name: Optional[str] = None, backend: Optional[str] = None) -> bool:
+        return self._key(name, backend) in self._models
+
+    def _key(self, name: Optional[str], backend: Optional[str]) -> Tuple[str, str]:
+        # EMBEDDING_BACKEND is read per call, so it can be set after import
+        return backend or os.getenv("EMBEDDING_BACKEND", "torch"), name or DEFAULT_MODEL_NAME
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,144 @@
+import difflib
+import re
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+_SHINGLE = 4
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 finalizer, spreads shingle hashes over all 64 bits.
+    """
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash over case-folded character 4-grams. Works the same for
+    Japanese (no word boundaries) and English; near-identical texts get
+    signatures a few bits apart.
+    """
+    codes = np.frombuffer(text.casefold().encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+    count = max(len(codes) - _SHINGLE + 1, 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(min(_SHINGLE, len(codes))):
+        hashes = (hashes ^ codes[offset:offset + count]) * np.uint64(0x100000001b3)
+    bits = (_mix64(hashes)[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    majority = bits.sum(axis=0) * 2 > count
+    return int(np.bitwise_or.reduce(majority.astype(np.uint64) << _BIT_SHIFTS))
+
+
+# Numbers (with decimals), single Japanese characters, other words
+_CJK = '\u3005-\u3007\u3040-\u30ff\u3400-\u9fff'
+_TOKEN = re.compile(rf'\d+(?:[.,]\d+)*|[{_CJK}]|[^\W\d_{_CJK}]+')
+
+# Tokens that change a clinical statement when added, removed or replaced:
+# negations, number words, dose units and frequencies, comparatives
+_GUARDED_WORDS = frozenset(word.casefold() for word in """
+    no not nor never none neither without cannot avoid contraindicated except unless
+    don doesn didn isn aren wasn weren won shouldn mustn couldn wouldn
+    zero one two three four five six seven eight nine ten eleven twelve twenty
+    hundred thousand million once twice thrice half double triple single
+    first second third last every each per
+    mg g kg mcg ug µg ml l mmol mol iu unit units dose doses tablet tablets
+    hourly daily weekly monthly yearly hour hours day days week weeks month months year years
+    more less fewer higher lower increase decrease maximum minimum max min
+    above below over under before after left right
+""".split())
+_GUARDED_JAPANESE = (
+    'ない', 'なかっ', 'ません', 'ず', 'ぬ', '不', '非', '無', '未', '禁', '否', '以上', '以下', '未満', '超',
+    '〇', '一', '二', '三', '四', '五', '六', '七', '八', '九', '十', '百', '千', '万', '半', '倍', '毎', '回'
+)
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+def _guarded(tokens: List[str]) -> bool:
+    if any(token in _GUARDED_WORDS or any(c.isdigit() for c in token) for token in tokens):
+        return True
+    text = ''.join(tokens)
+    return any(marker in text for marker in _GUARDED_JAPANESE)
+
+
+def near_duplicate_text(a: str, b: str, max_change: float = 0.15) -> bool:
+    """
+    Whether two chunks can stand in for each other: at most `max_change`
+    of the longer one's tokens differ (case, whitespace and punctuation
+    ignored), and no differing token is a number, a negation or another
+    guarded qualifier. SimHash distance alone cannot tell "type 1" from
+    "type 2", so linked duplicates must pass this check.
+    """
+    tokens_a, tokens_b = _tokens(a), _tokens(b)
+    if tokens_a == tokens_b:
+        return True
+    changed = 0
+    matcher = difflib.SequenceMatcher(None, tokens_a, tokens_b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        if _guarded(tokens_a[i1:i2]) or _guarded(tokens_b[j1:j2]):
+            return False
+        changed += max(i2 - i1, j2 - j1)
+    return changed <= max_change * max(len(tokens_a), len(tokens_b))
+
+
+class NearDuplicateIndex:
+    """
+    LSH index over SimHash signatures of canonical chunks.
+
+    Signatures are split into `max_distance + 1` bands; two signatures at
+    most `max_distance` bits apart agree on at least one band, so only the
+    rows sharing a band value need an exact Hamming check.
+    """
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        self._bounds = [(64 * i // bands, 64 * (i + 1) // bands) for i in range(bands)]
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: int):
+        for start, stop in self._bounds:
+            yield (signature >> start) & ((1 << (stop - start)) - 1)
+
+    def find(self, signature: int, accept: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+        """
+        Closest indexed row within `max_distance` bits (earliest on ties)
+        for which `accept(row)` holds, or None.
+        """
+        candidates = {}
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            for row in buckets.get(key, ()):
+                if row not in candidates:
+                    distance = bin(self._signatures[row] ^ signature).count('1')
+                    if distance <= self.max_distance:
+                        candidates[row] = distance
+        for row in sorted(candidates, key=lambda row: (candidates[row], row)):
+            if accept is None or accept(row):
+                return row
+        return None
+
+    def add(self, row: int, signature: int):
+        self._signatures[row] = signature
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(key, []).append(row)
+
+    def remove(self, row: int):
+        signature = self._signatures.pop(row, None)
+        if signature is None:
+            return
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            bucket = buckets[key]
+            bucket.remove(row)
+            if not bucket:
+                del buckets[key]
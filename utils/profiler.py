@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, List, Optional, Tuple
+
+# Innermost frames of threads that are idle rather than working
+_IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py', 'thread.py')
+
+
+class SlowRequestProfiler:
+    """
+    Sampling profiler for slow requests.
+
+    A background thread records the Python stack of every thread each
+    `interval_ms`, keeping the last `max_samples` samples. When a request
+    takes `threshold_ms` or longer, the samples taken while it ran are
+    folded into stacks with their sample counts and passed to `hook`
+    (default: print the busiest stacks). Samples cover all threads, so
+    work for concurrent requests shows up as well.
+    """
+    def __init__(
+        self,
+        threshold_ms: float,
+        interval_ms: Optional[float] = None,
+        max_samples: int = 50000,
+        hook: Optional[Callable] = None
+    ):
+        self.threshold = threshold_ms / 1000.0
+        if interval_ms is None:
+            interval_ms = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+        self.interval = interval_ms / 1000.0
+        self.hook = hook or print_slow_request
+        # (time, thread name, stack) with the innermost frame last
+        self._samples = deque(maxlen=max_samples)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 64:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._samples.append((now, names.get(ident, str(ident)), tuple(reversed(stack))))
+
+    def samples_between(self, start: float, end: float) -> List[Tuple[str, Tuple[str, ...]]]:
+        return [(thread, stack) for at, thread, stack in list(self._samples) if start <= at <= end]
+
+    def observe(self, label: str, start: float, end: float, spans: List[Tuple[str, float]]):
+        """
+        Called for every finished request (perf_counter times).
+        """
+        if end - start < self.threshold:
+            return
+        stacks = Counter(';'.join(stack) for _, stack in self.samples_between(start, end))
+        try:
+            self.hook(label, end - start, spans, stacks.most_common())
+        except Exception as e:
+            print(f"Slow request hook failed: {e}")
+
+
+def print_slow_request(label: str, seconds: float, spans: List[Tuple[str, float]], stacks: List[Tuple[str, int]]):
+    """
+    Default hook: the request's stages and its five busiest stacks.
+    """
+    stages = ', '.join(f"{stage}={elapsed * 1000:.1f}ms" for stage, elapsed in spans)
+    print(f"Slow request {label} took {seconds * 1000:.1f} ms; stages: {stages or 'none'}")
+    for stack, count in stacks[:5]:
+        frames = stack.split(';')
+        print(f"  {count:>5} samples: {' <- '.join(reversed(frames[-6:]))}")
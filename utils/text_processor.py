@@ -1,86 +1,224 @@
+import hashlib
 import re
-from typing import List
+from typing import Iterable, Iterator, List
+
+# Special characters are removed, punctuation is kept
+_UNWANTED_CHARS = re.compile(r'[^\w\s\.\!\?\,\;\:\-\(\)\[\]\{\}\"\'。！？、；：（）［］｛｝「」『』]')
+# Numbered section starts (1., 2., etc.)
+_SECTION_START = re.compile(r'(?=\d+\.\s)')
+_PIECE_CHARS = 64 * 1024
+# Sentence endings per language
+_SENTENCE_END = {
+    'ja': re.compile(r'[。！？]'),
+    'en': re.compile(r'[.!?]+\s+')
+}
+
 
 class TextProcessor:
     def __init__(self):
         self.chunk_size = 300  # Reduced for better semantic chunks
         self.overlap = 30      # Reduced overlap
-        
+
     def chunk_text(self, text: str, language: str = 'en') -> List[str]:
         """
         Split text into meaningful semantic chunks for better retrieval.
+
+        Numbered sections up to `chunk_size` characters become one chunk;
+        longer ones are packed sentence by sentence. Chunks of 50 characters
+        or less and repeated chunks are dropped.
         """
-        # Clean the text
-        text = self._clean_text(text)
-        
-        # First try to split by paragraphs or sections
-        paragraphs = self._split_by_paragraphs(text)
-        
+        # Fed in pieces: the engine then works on cache-sized strings
+        chunker = self.stream(language)
         chunks = []
-        for paragraph in paragraphs:
-            if len(paragraph) <= self.chunk_size:
-                if paragraph.strip():
-                    chunks.append(paragraph.strip())
-            else:
-                # Split large paragraphs into sentences
-                sentences = self._split_by_sentences(paragraph, language)
-                current_chunk = ""
-                
-                for sentence in sentences:
-                    # If adding this sentence would exceed chunk size, save current chunk
-                    if len(current_chunk) + len(sentence) > self.chunk_size and current_chunk:
-                        chunks.append(current_chunk.strip())
-                        current_chunk = sentence
-                    else:
-                        current_chunk += " " + sentence if current_chunk else sentence
-                
-                # Add the last chunk
-                if current_chunk.strip():
-                    chunks.append(current_chunk.strip())
-        
-        # Remove duplicates and very short chunks
-        unique_chunks = []
-        seen = set()
-        for chunk in chunks:
-            chunk_clean = chunk.strip()
-            if len(chunk_clean) > 50 and chunk_clean not in seen:  # Minimum 50 chars
-                unique_chunks.append(chunk_clean)
-                seen.add(chunk_clean)
-                
-        return unique_chunks
-    
-    def _split_by_paragraphs(self, text: str) -> List[str]:
-        """Split text by paragraphs or numbered sections."""
-        # Split by double newlines (paragraphs)
-        paragraphs = re.split(r'\n\s*\n', text)
-        
-        # Also split by numbered sections (1., 2., etc.)
-        all_sections = []
-        for para in paragraphs:
-            sections = re.split(r'(?=\d+\.\s)', para)
-            all_sections.extend([s.strip() for s in sections if s.strip()])
-            
-        return all_sections
-    
-    def _split_by_sentences(self, text: str, language: str) -> List[str]:
-        """Split text into sentences based on language."""
-        if language == 'ja':
-            # Japanese sentence endings
-            sentences = re.split(r'[。！？]', text)
-        else:
-            # English sentence endings
-            sentences = re.split(r'[.!?]+\s+', text)
-            
-        return [s.strip() for s in sentences if s.strip()]
-        
+        for start in range(0, len(text), _PIECE_CHARS):
+            chunks.extend(chunker.feed(text[start:start + _PIECE_CHARS]))
+        return chunks + chunker.close()
+
+    def stream(self, language: str = 'en') -> 'StreamingChunker':
+        """
+        Incremental chunker for text arriving in pieces.
+        """
+        return StreamingChunker(self, language)
+
+    def iter_chunks(self, pieces: Iterable[str], language: str = 'en') -> Iterator[str]:
+        """
+        Yield the chunks `chunk_text` would return for ''.join(pieces),
+        holding only about one section of text in memory at a time.
+        """
+        chunker = self.stream(language)
+        for piece in pieces:
+            yield from chunker.feed(piece)
+        yield from chunker.close()
+
     def _clean_text(self, text: str) -> str:
         """
         Clean and normalize text.
         """
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        
+        return self._clean_fragment(text).strip()
+
+    def _clean_fragment(self, text: str) -> str:
+        """
+        Character-level cleaning; gives the same result on any split of the
+        text that does not cut through a whitespace run.
+        """
+        # Collapse whitespace runs (str.split uses the same set as regex \s)
+        cleaned = ' '.join(text.split())
+        if text[:1].isspace() and cleaned:
+            cleaned = ' ' + cleaned
+        if text[-1:].isspace():
+            cleaned += ' '
+
         # Remove special characters but keep punctuation
-        text = re.sub(r'[^\w\s\.\!\?\,\;\:\-\(\)\[\]\{\}\"\'。！？、；：（）［］｛｝「」『』]', '', text)
-        
-        return text.strip()
\ No newline at end of file
+        return _UNWANTED_CHARS.sub('', cleaned)
+
+
+class StreamingChunker:
+    """
+    Single-pass chunking engine: `feed` pieces of a document, then `close`.
+
+    Sections are found with one scan for numbered section starts, long
+    sections are split with one scan for sentence ends, and a chunk is kept
+    as a list of sentences with a running length that is joined once when it
+    is emitted. Duplicates are filtered as chunks are emitted.
+
+    Split points are only acted on once the text after them can no longer
+    change them: a whitespace run may continue in the next piece, a trailing
+    "12." may become a section start, and a sentence end followed only by
+    whitespace may be the end of the section. Sections longer than the chunk
+    size are packed as they arrive, so memory stays bounded by the piece size
+    plus the duplicate filter.
+    """
+    def __init__(self, processor: TextProcessor, language: str = 'en'):
+        self.processor = processor
+        self.chunk_size = processor.chunk_size
+        self.language = language
+        self._sentence_end = _SENTENCE_END['ja' if language == 'ja' else 'en']
+
+        self._raw_carry = ''       # Trailing whitespace run of the raw input
+        self._clean_carry = ''     # Trailing whitespace of the cleaned text
+        self._started = False      # Leading whitespace has been stripped
+        self._section = ''         # Unconsumed text of the open section
+        self._large = False        # Open section is known to exceed chunk_size
+        self._parts: List[str] = []  # Sentences of the chunk being packed
+        self._parts_len = 0        # len(' '.join(self._parts))
+        self._seen = set()         # Digests of chunks already emitted
+
+    def feed(self, text: str) -> List[str]:
+        chunks = []
+        self._process(self._clean(text, final=False), chunks, final=False)
+        return chunks
+
+    def close(self) -> List[str]:
+        chunks = []
+        self._process(self._clean('', final=True), chunks, final=True)
+        return chunks
+
+    def _clean(self, text: str, final: bool) -> str:
+        text = self._raw_carry + text
+        self._raw_carry = ''
+        if not final and text[-1:].isspace():
+            # rstrip strips the same characters as regex \s
+            end = len(text.rstrip())
+            self._raw_carry = text[end:]
+            text = text[:end]
+
+        cleaned = self.processor._clean_fragment(text)
+        if not self._started:
+            cleaned = cleaned.lstrip()
+            self._started = bool(cleaned)
+
+        # Whitespace at the very end of the document is stripped
+        cleaned = self._clean_carry + cleaned
+        stripped = cleaned.rstrip()
+        self._clean_carry = '' if final else cleaned[len(stripped):]
+        return stripped
+
+    def _process(self, cleaned: str, chunks: List[str], final: bool):
+        section = self._section + cleaned if self._section else cleaned
+        sections = _SECTION_START.split(section)
+        if len(sections) > 1 and not sections[0]:
+            # The text starts with the open section's own start
+            del sections[0]
+        section = sections.pop()
+        for rest in sections:
+            self._close_section(rest, chunks)
+
+        if final:
+            self._close_section(section, chunks)
+            section = ''
+        else:
+            limit = _open_section_start(section)
+            if not self._large and len(section[:limit].strip()) > self.chunk_size:
+                self._large = True
+            if self._large:
+                section = section[self._pack_sentences(section, limit, chunks):]
+        self._section = section
+
+    def _pack_sentences(self, text: str, limit: int, chunks: List[str]) -> int:
+        """
+        Pack the sentences of `text` whose end lies before `limit`; return
+        the offset of the first unconsumed character.
+        """
+        start = 0
+        sentences = []
+        for match in self._sentence_end.finditer(text):
+            if match.end() >= limit:
+                break
+            sentences.append(text[start:match.start()])
+            start = match.end()
+        self._pack(sentences, chunks)
+        return start
+
+    def _close_section(self, rest: str, chunks: List[str]):
+        rest = rest.rstrip()
+        if not self._large:
+            rest = rest.lstrip()
+            if len(rest) <= self.chunk_size:
+                self._emit(rest, chunks)
+                return
+        self._pack(self._sentence_end.split(rest), chunks)
+        if self._parts:
+            self._emit(' '.join(self._parts), chunks)
+        self._parts = []
+        self._parts_len = 0
+        self._large = False
+
+    def _pack(self, sentences: List[str], chunks: List[str]):
+        parts = self._parts
+        length = self._parts_len
+        for sentence in sentences:
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if parts:
+                # If adding this sentence would exceed chunk size, save current chunk
+                if length + len(sentence) > self.chunk_size:
+                    self._emit(' '.join(parts), chunks)
+                    parts = []
+                    length = 0
+                else:
+                    length += 1
+            parts.append(sentence)
+            length += len(sentence)
+        self._parts = parts
+        self._parts_len = length
+
+    def _emit(self, chunk: str, chunks: List[str]):
+        # 128-bit digest: collision-free in practice and the same in every
+        # process, unlike hash(), while not keeping every chunk in memory
+        key = hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).digest()
+        if len(chunk) > 50 and key not in self._seen:  # Minimum 50 chars
+            chunks.append(chunk)
+            self._seen.add(key)
+
+
+def _open_section_start(text: str) -> int:
+    """
+    Offset of a trailing run of digits, optionally followed by a dot, that
+    may still start a section; len(text) if there is none.
+    """
+    end = len(text) - 1 if text.endswith('.') else len(text)
+    start = end
+    while start and text[start - 1].isdecimal():
+        start -= 1
+    return start if start < end else len(text)
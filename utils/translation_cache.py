@@ -0,0 +1,128 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+def translation_key(text: str, source: str, target: str) -> str:
+    """
+    Content hash identifying one translation.
+    """
+    return hashlib.sha256(f"{source}\x00{target}\x00{text}".encode('utf-8')).hexdigest()
+
+
+class TranslationCache:
+    """
+    Persistent translation cache in SQLite, keyed by content hash.
+
+    The database survives restarts and is shared by every worker on the
+    host (SQLite WAL mode lets them read while one writes). Once the stored
+    translations exceed `max_bytes`, the least recently used ones are
+    evicted down to 90% of it.
+    """
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, translation TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        self._conn.commit()
+        self._bytes = self._stored_bytes()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """
+        Cached translations for the keys present; refreshes their recency.
+        """
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, translation FROM translations WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE translations SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def set_many(self, entries: List[Tuple[str, str]]):
+        """
+        Store (key, translation) pairs, evicting old entries if needed.
+        """
+        if not entries:
+            return
+        now = time.time()
+        rows = [(key, translation, len(translation.encode('utf-8')), now) for key, translation in entries]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations (key, translation, size, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            self._bytes += sum(row[2] for row in rows)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Other workers write to the same file; start from the real total
+        self._bytes = self._stored_bytes()
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM translations ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            removed = []
+            for key, size in rows:
+                removed.append((key,))
+                self._bytes -= size
+                if self._bytes <= target:
+                    break
+            self._conn.executemany("DELETE FROM translations WHERE key = ?", removed)
+            self.evictions += len(removed)
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,88 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class GoogleTranslatorBackend:
+    """
+    Google Translate through deep_translator.
+
+    Each thread keeps one client per (source, target) pair: a client keeps
+    the text of its current request in its own state, so it must not be
+    shared between threads. A batch is packed into as
+    few requests as fit the service's per-request limit, one text per line,
+    so a handful of chunks costs a single round trip.
+    """
+    max_chars = 4500  # Google rejects requests over 5000 characters
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _client(self, source: str, target: str):
+        clients: Dict[Tuple[str, str], object] = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = self._local.clients = {}
+        client = clients.get((source, target))
+        if client is None:
+            from deep_translator import GoogleTranslator
+            client = clients[(source, target)] = GoogleTranslator(source=source, target=target)
+        return client
+
+    def translate_batch(self, texts: List[str], source: str, target: str) -> List[str]:
+        client = self._client(source, target)
+        results: List[Optional[str]] = [None] * len(texts)
+
+        # Texts with line breaks cannot share a request
+        packable = [i for i, text in enumerate(texts) if '\n' not in text and len(text) < self.max_chars]
+        for i in set(range(len(texts))) - set(packable):
+            results[i] = client.translate(texts[i])
+
+        group: List[int] = []
+        length = 0
+        for i in packable + [None]:
+            if i is not None and length + len(texts[i]) + 1 <= self.max_chars:
+                group.append(i)
+                length += len(texts[i]) + 1
+                continue
+            if group:
+                self._translate_group(client, texts, group, results)
+            group, length = ([i], len(texts[i]) + 1) if i is not None else ([], 0)
+        return results
+
+    def _translate_group(self, client, texts: List[str], group: List[int], results: List[Optional[str]]):
+        if len(group) == 1:
+            results[group[0]] = client.translate(texts[group[0]])
+            return
+        lines = client.translate('\n'.join(texts[i] for i in group)).split('\n')
+        if len(lines) != len(group):
+            # The service merged or split lines; translate one by one
+            for i in group:
+                results[i] = client.translate(texts[i])
+            return
+        for i, line in zip(group, lines):
+            results[i] = line.strip()
+
+
+class StubTranslatorBackend:
+    """
+    Offline stand-in that returns texts unchanged, for tests and
+    air-gapped deployments.
+    """
+    def translate_batch(self, texts: List[str], source: str, target: str) -> List[str]:
+        return list(texts)
+
+
+TRANSLATION_BACKENDS = {
+    'google': GoogleTranslatorBackend,
+    'stub': StubTranslatorBackend,
+}
+
+
+def create_translator(name: Optional[str] = None):
+    """
+    Backend named by `name` or TRANSLATION_BACKEND (default: google).
+    """
+    name = name or os.getenv("TRANSLATION_BACKEND", "google")
+    if name not in TRANSLATION_BACKENDS:
+        raise ValueError(f"Unknown TRANSLATION_BACKEND '{name}', expected one of {tuple(TRANSLATION_BACKENDS)}")
+    return TRANSLATION_BACKENDS[name]()
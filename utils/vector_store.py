@@ -0,0 +1,98 @@
+import os
+import threading
+
+import numpy as np
+
+
+class VectorStore:
+    """
+    Append-only store of the original float32 embeddings.
+
+    Kept alongside quantized indexes so the top candidates can be re-ranked
+    with exact scores. Rows already on disk are memory-mapped, so every worker
+    shares them through the page cache; rows added since the last flush are
+    held in memory. Safe to append and read while a flush is writing.
+    """
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self._row_bytes = dimension * 4
+        self._base = np.zeros((0, dimension), dtype='float32')
+        self._tail_parts = []
+        self._tail_rows = 0
+        self._lock = threading.RLock()
+        self._open()
+
+    def _open(self, count: int = None):
+        rows = os.path.getsize(self.path) // self._row_bytes if os.path.exists(self.path) else 0
+        if count is not None:
+            rows = min(rows, count)
+        if rows:
+            self._base = np.memmap(self.path, dtype='float32', mode='r', shape=(rows, self.dimension))
+        else:
+            self._base = np.zeros((0, self.dimension), dtype='float32')
+
+    def __len__(self) -> int:
+        return len(self._base) + self._tail_rows
+
+    def _tail(self) -> np.ndarray:
+        if len(self._tail_parts) != 1:
+            # Concatenate lazily so appends stay O(new rows)
+            parts = self._tail_parts or [np.zeros((0, self.dimension), dtype='float32')]
+            self._tail_parts = [np.concatenate(parts)]
+        return self._tail_parts[0]
+
+    def _set_tail(self, tail: np.ndarray):
+        self._tail_parts = [tail]
+        self._tail_rows = len(tail)
+
+    def truncate(self, count: int):
+        """
+        Ignore rows from `count` onwards (crash recovery only).
+        """
+        with self._lock:
+            if count < len(self._base):
+                self._base = self._base[:count]
+                self._set_tail(self._tail()[:0])
+            else:
+                self._set_tail(self._tail()[:count - len(self._base)])
+
+    def append(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype='float32').reshape(-1, self.dimension)
+        with self._lock:
+            self._tail_parts.append(vectors)
+            self._tail_rows += len(vectors)
+
+    def get(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Fetch the vectors for `ids` (all must be < len(self)).
+        """
+        ids = np.asarray(ids, dtype='int64')
+        with self._lock:
+            base, tail = self._base, self._tail()
+        out = np.empty((len(ids), self.dimension), dtype='float32')
+        in_base = ids < len(base)
+        out[in_base] = base[ids[in_base]]
+        if not in_base.all():
+            out[~in_base] = tail[ids[~in_base] - len(base)]
+        return out
+
+    def get_range(self, start: int, stop: int) -> np.ndarray:
+        return self.get(np.arange(start, stop))
+
+    def flush(self, count: int):
+        """
+        Persist the first `count` rows and memory-map them.
+        """
+        with self._lock:
+            base_rows = len(self._base)
+            tail = self._tail()
+        with open(self.path, 'ab') as f:
+            f.truncate(base_rows * self._row_bytes)
+            f.write(np.ascontiguousarray(tail[:count - base_rows]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            # Rows appended during the write are kept
+            self._set_tail(self._tail()[count - base_rows:])
+            self._open(count)
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import struct
+import zlib
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+_MAGIC = b'WAL1'
+# start_id, vector count, dimension, metadata byte length
+_HEADER = struct.Struct('<QIII')
+_CRC = struct.Struct('<I')
+
+
+class WriteAheadLog:
+    """
+    Append-only log of ingested vectors and their metadata.
+
+    Each record holds the id of its first vector, the float32 vectors and the
+    JSON-encoded metadata, followed by a CRC32. The log is split into numbered
+    segment files so that a compaction can seal the current segment, snapshot
+    everything up to it and delete it without blocking new appends.
+
+    Deleting a document appends a tombstone: a record without vectors whose
+    metadata is {"delete": document_id} instead of a list of rows.
+
+    Several processes may share the log as long as appends and rotations are
+    serialized by the caller: appends always go to the newest segment on
+    disk, and readers can follow the log from a (segment, offset) cursor.
+    """
+    def __init__(self, directory: str, prefix: str = "wal"):
+        self.directory = directory
+        self.prefix = prefix
+        self._pattern = re.compile(rf'^{re.escape(prefix)}\.(\d+)\.log$')
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self._segment_numbers()
+        self._current = segments[-1] if segments else 0
+
+    def _segment_numbers(self) -> List[int]:
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = self._pattern.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}.{number:08d}.log")
+
+    def segments(self) -> List[str]:
+        return [self._segment_path(n) for n in self._segment_numbers()]
+
+    @property
+    def size_bytes(self) -> int:
+        size = 0
+        for path in self.segments():
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                # Removed by a compaction meanwhile
+                pass
+        return size
+
+    def end(self) -> Tuple[int, int]:
+        """
+        Cursor just past the last record: (newest segment, its size).
+        """
+        segments = self._segment_numbers()
+        self._current = max([self._current] + segments)
+        path = self._segment_path(self._current)
+        return self._current, os.path.getsize(path) if os.path.exists(path) else 0
+
+    def append(self, start_id: int, vectors: np.ndarray, metadata: Union[List[Dict[str, Any]], Dict[str, str]]) -> Tuple[int, int]:
+        """
+        Durably append one record to the newest segment. Returns the cursor
+        just past it.
+        """
+        # Another process may have rotated the log
+        segments = self._segment_numbers()
+        self._current = max([self._current] + segments)
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        meta_bytes = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        body = _HEADER.pack(start_id, vectors.shape[0], vectors.shape[1], len(meta_bytes))
+        body += vectors.tobytes() + meta_bytes
+
+        with open(self._segment_path(self._current), 'ab') as f:
+            f.write(_MAGIC + body + _CRC.pack(zlib.crc32(body)))
+            f.flush()
+            os.fsync(f.fileno())
+            return self._current, f.tell()
+
+    def append_tombstone(self, start_id: int, document_id: str):
+        """
+        Durably record the deletion of a document.
+        """
+        return self.append(start_id, np.zeros((0, 0), dtype='float32'), {'delete': document_id})
+
+    def rotate(self) -> List[str]:
+        """
+        Seal the current segment; later appends go to a new one.
+        Returns the sealed segment paths.
+        """
+        sealed = self.segments()
+        self._current = max([self._current] + self._segment_numbers()) + 1
+        # Create it right away so other processes append to it too
+        open(self._segment_path(self._current), 'ab').close()
+        return sealed
+
+    @property
+    def current_segment(self) -> int:
+        return self._current
+
+    def replay(self) -> Iterator[Tuple[int, np.ndarray, List[Dict[str, Any]]]]:
+        """
+        Yield (start_id, vectors, metadata) for every intact record in order.
+        A torn or corrupt tail (crash mid-append) is truncated away.
+        """
+        for start_id, vectors, metadata, _ in self.records():
+            yield start_id, vectors, metadata
+
+    def records(self, segment: int = 0, offset: int = 0) -> Iterator[Tuple[int, np.ndarray, Any, Tuple[int, int]]]:
+        """
+        Yield (start_id, vectors, metadata, cursor after the record) for the
+        intact records from `offset` in `segment` onwards. Segments that no
+        longer exist are skipped. A torn or corrupt tail is truncated away,
+        so appends must not run concurrently.
+        """
+        for number in self._segment_numbers():
+            if number < segment:
+                continue
+            path = self._segment_path(number)
+            start = offset if number == segment else 0
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read()
+
+            position = 0
+            while position < len(data):
+                record = self._parse_record(data, position)
+                if record is None:
+                    print(f"Truncating corrupt WAL tail in {path} at byte {start + position}")
+                    with open(path, 'r+b') as f:
+                        f.truncate(start + position)
+                    break
+                position, start_id, vectors, metadata = record
+                yield start_id, vectors, metadata, (number, start + position)
+
+    def _parse_record(self, data: bytes, offset: int):
+        header_end = offset + len(_MAGIC) + _HEADER.size
+        if data[offset:offset + len(_MAGIC)] != _MAGIC or header_end > len(data):
+            return None
+
+        start_id, count, dimension, meta_len = _HEADER.unpack_from(data, offset + len(_MAGIC))
+        vectors_end = header_end + count * dimension * 4
+        meta_end = vectors_end + meta_len
+        record_end = meta_end + _CRC.size
+        if record_end > len(data):
+            return None
+
+        body = data[offset + len(_MAGIC):meta_end]
+        if _CRC.unpack_from(data, meta_end)[0] != zlib.crc32(body):
+            return None
+
+        vectors = np.frombuffer(data, dtype='float32', count=count * dimension, offset=header_end)
+        metadata = json.loads(data[vectors_end:meta_end].decode('utf-8'))
+        return record_end, start_id, vectors.reshape(count, dimension).copy(), metadata
+
+    def remove_before(self, segment: int):
+        """
+        Delete the segments numbered below `segment`.
+        """
+        self.remove([self._segment_path(n) for n in self._segment_numbers() if n < segment])
+
+    def remove(self, paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass